@@ -1,9 +1,7 @@
 import cv2
 import numpy as np
 import time
-from ultralytics import YOLO
 import json
-import torch
 import os
 from datetime import datetime, timezone
 import sys
@@ -12,31 +10,28 @@ import os
 current_dir = os.path.dirname(os.path.abspath(__file__))
 parent_dir = os.path.dirname(current_dir)
 sys.path.insert(0, parent_dir)
-from queue_store import SQLiteQueue
+from queue_store import QueuePruner, SQLiteQueue
+from inference_scheduler import InferenceScheduler
+from inference_backends import BACKEND_AUTO, PRECISION_FP32, create_backend, get_backend_config
 
 class YOLOInference:
     """Class xử lý inference YOLO"""
     
-    def __init__(self, model_path):
+    def __init__(self, model_path, backend=BACKEND_AUTO, precision=PRECISION_FP32, imgsz=640, calibration_data=None):
         """
         Args:
             model_path: Đường dẫn file .pt
+            backend: "auto" (CUDA nếu có, ngược lại CPU), "torch_cuda", "torch_cpu", "onnx", "openvino"
+            precision: "fp32", "fp16" hoặc "int8" (tuỳ backend)
+            imgsz: Kích thước input model
+            calibration_data: File yaml dataset để calibration OpenVINO int8
         """
-        # Bắt buộc dùng GPU. Nếu không có CUDA, dừng chương trình.
-        if not torch.cuda.is_available():
-            print("[YOLO] Lỗi: CUDA không khả dụng. Vui lòng chạy trên máy có GPU/CUDA.")
-            raise SystemExit(1)
-        self.device = "cuda:0"
-
-        # Load model và chuyển sang thiết bị tương ứng
-        self.model = YOLO(model_path)
-        try:
-            # Một số phiên bản Ultralytics hỗ trợ .to()
-            self.model.to(self.device)
-        except Exception:
-            # Nếu không hỗ trợ .to(), sẽ truyền device ở mỗi lần gọi
-            pass
-        print(f"Đã load model YOLO: {model_path} | device={self.device}")
+        # Backend được chọn theo cấu hình, không còn bắt buộc CUDA
+        self.backend = create_backend(model_path, backend, precision, imgsz, calibration_data)
+        self.model = self.backend.model
+        self.device = self.backend.device
+        print(f"Đã load model YOLO: {self.backend.model_file} | backend={self.backend.name} "
+              f"| precision={precision} | device={self.device}")
     
     def detect(self, frame):
         """
@@ -50,7 +45,7 @@ class YOLOInference:
         """
         try:
             # Hỗ trợ cả đơn frame (np.ndarray) và batch (List[np.ndarray])
-            results = self.model(frame, device=self.device, verbose=False)
+            results = self.backend.predict(frame)
             return results
         except Exception as e:
             print(f"Lỗi inference: {e}")
@@ -121,128 +116,193 @@ class YOLOInference:
             "objects": objects
         }
 
-def ai_inference_worker(shared_dict, result_dict, model_path="weights/model-hanam_0506.pt", target_fps=2.0):
+def batch_boxes_to_numpy(batch_results):
+    """
+    Chuyển boxes của cả batch sang numpy với đúng 1 lần copy device -> host
+    
+    Args:
+        batch_results: List YOLO results (mỗi camera 1 phần tử)
+        
+    Returns:
+        List np.ndarray float32 shape (N, 6): [x1, y1, x2, y2, confidence, class_id] cho từng result
+    """
+    counts = []
+    tensors = []
+    for results in batch_results:
+        boxes = getattr(results, 'boxes', None) if results is not None else None
+        n = len(boxes) if boxes is not None else 0
+        counts.append(n)
+        if n > 0:
+            tensors.append(boxes.data)
+    
+    if not tensors:
+        return [np.zeros((0, 6), dtype=np.float32) for _ in batch_results]
+    
+    if hasattr(tensors[0], 'cpu'):
+        # Gộp trên device rồi copy 1 lần (1 lần sync GPU cho cả batch thay vì 3 lần/box)
+        import torch
+        merged = torch.cat(tensors).cpu().numpy()
+    else:
+        merged = np.concatenate([np.asarray(t) for t in tensors])
+    merged = merged.astype(np.float32, copy=False)
+    return np.split(merged, np.cumsum(counts)[:-1])
+
+
+def build_detection_payload(cam_name: str, frame: np.ndarray, boxes: np.ndarray, names, frame_id: int) -> dict:
+    """
+    Chuẩn hoá payload theo định dạng yêu cầu.
+    
+    Args:
+        cam_name: ID camera
+        frame: Frame đã inference (chỉ dùng shape)
+        boxes: np.ndarray (N, 6) [x1, y1, x2, y2, confidence, class_id] từ batch_boxes_to_numpy
+        names: Mapping class_id -> class_name của model
+        frame_id: Số thứ tự frame
+    """
+    # frame shape
+    h, w = (frame.shape[0], frame.shape[1]) if frame is not None else (0, 0)
+    c = frame.shape[2] if frame is not None and len(frame.shape) == 3 else 0
+
+    detections = []
+    if boxes is not None and len(boxes) > 0:
+        # Tính tâm bbox cho cả mảng, rồi chuyển sang list Python 1 lần
+        centers = (boxes[:, 0:2] + boxes[:, 2:4]) / 2.0
+        rows = boxes.tolist()
+        center_rows = centers.tolist()
+        for (x1, y1, x2, y2, confidence, class_id), (cx, cy) in zip(rows, center_rows):
+            class_id = int(class_id)
+            detections.append({
+                "class_id": class_id,
+                "class_name": names[class_id],
+                "confidence": confidence,
+                "bbox": {
+                    "x1": x1,
+                    "y1": y1,
+                    "x2": x2,
+                    "y2": y2
+                },
+                "center": {
+                    "x": cx,
+                    "y": cy
+                }
+            })
+
+    payload = {
+        "camera_id": cam_name,
+        "frame_id": frame_id,
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "frame_shape": {
+            "height": int(h),
+            "width": int(w),
+            "channels": int(c)
+        },
+        "detections": detections,
+        "detection_count": len(detections)
+    }
+    return payload
+
+def ai_inference_worker(frame_ring, result_dict, model_path="weights/model-hanam_0506.pt", target_fps=2.0,
+                        frame_size=(1280, 720), max_batch_latency=0.2, backend_config=None,
+                        prune_interval=60.0, fuse_roi=False, raw_sample_every=1):
     """
 AI Inference worker process
     
     Args:
-shared_dict: Dict chứa frame từ camera
+        frame_ring: SharedFrameRing chứa frame JPEG/raw từ camera (đọc trực tiếp từ shared memory)
         result_dict: Dict để lưu kết quả detection
         model_path: Đường dẫn model YOLO
-        target_fps: FPS mục tiêu cho AI inference (mặc định: 2.0 FPS)
+        target_fps: FPS mục tiêu của camera (AI chỉ inference frame mới nên tự theo FPS camera)
+        frame_size: (width, height) frame đưa vào model
+        max_batch_latency: Thời gian tối đa (giây) frame mới chờ gom batch trước khi inference
+        backend_config: Dict cấu hình backend {backend, precision, imgsz, calibration_data}
+            (mặc định: DEFAULT_BACKEND_CONFIG)
+        prune_interval: Chu kỳ (giây) dọn queues.db theo DEFAULT_RETENTION, 0/None = tắt
+        fuse_roi: Lọc ROI ngay trong worker (ROIProcessor chạy inline) và publish thẳng roi_detection,
+            bỏ chặng raw_detection -> roi_processor.py (không chạy roi_processor.py song song)
+        raw_sample_every: Khi fuse_roi, vẫn publish raw_detection mỗi N frame của mỗi camera
+            (debug / viewer), 0 = không publish raw_detection
     """
     print("AI Inference worker: Bắt đầu batch processing (không vẽ, chỉ lưu & in JSON)")
-    print(f"Processing all cameras in single process for better efficiency (GPU batch, FPS: {target_fps})")
+    print(f"Processing all cameras in single process for better efficiency (batch, FPS: {target_fps})")
     
     # Load YOLO model
     try:
-        yolo = YOLOInference(model_path)
+        yolo = YOLOInference(model_path, **get_backend_config(backend_config))
     except Exception as e:
         print(f"Lỗi load model: {e}")
         return
     
     frame_count = 0
-    inference_interval = 1.0 / target_fps  # Khoảng thời gian giữa các lần inference
-    last_inference_time = 0
+    # Chỉ inference frame mới (theo frame_seq), không chạy lại YOLO trên frame cũ
+    scheduler = InferenceScheduler(frame_ring, max_batch_latency=max_batch_latency)
 
     # Khởi tạo SQLiteQueue để lưu kết quả detection (lưu trong thư mục cha)
     queue_db_path = os.path.join(parent_dir, "queues.db")
     queue = SQLiteQueue(queue_db_path)
     print(f"Đã khởi tạo SQLiteQueue để lưu kết quả detection vào raw_detection topic tại: {queue_db_path}")
+    # Dọn queues.db định kỳ (retention theo topic + checkpoint WAL) vì worker này ghi nhiều nhất
+    pruner = QueuePruner(queue, interval=prune_interval).start() if prune_interval else None
 
-    def build_detection_payload(cam_name: str, frame: np.ndarray, results, frame_id: int) -> dict:
-        """Chuẩn hoá payload theo định dạng yêu cầu."""
-        # frame shape
-        h, w = (frame.shape[0], frame.shape[1]) if frame is not None else (0, 0)
-        c = frame.shape[2] if frame is not None and len(frame.shape) == 3 else 0
+    roi_stage = None
+    raw_counts = {}
+    if fuse_roi:
+        from roi_processor import ROIProcessor
+        # Trạng thái lọc (ROI config, block/unlock slot) cập nhật qua queue như roi_processor.py
+        roi_stage = ROIProcessor(queue_db_path, show_video=False,
+                                 pairing_config_path=os.path.join(parent_dir, "logic", "slot_pairing_config.json"))
+        roi_stage.start_inline()
+        print(f"Chế độ fuse ROI: publish roi_detection trực tiếp (raw_detection mỗi {raw_sample_every or '-'} frame)")
 
-        detections = []
-        if results is not None and hasattr(results, 'boxes') and len(results.boxes) > 0:
-            for box in results.boxes:
-                # Toạ độ bbox
-                x1, y1, x2, y2 = box.xyxy[0].cpu().numpy()
-                confidence = float(box.conf[0].cpu().numpy())
-                class_id = int(box.cls[0].cpu().numpy())
-                class_name = results.names[class_id]
-                # Tâm bbox
-                cx = float((x1 + x2) / 2.0)
-                cy = float((y1 + y2) / 2.0)
-                detections.append({
-                    "class_id": class_id,
-                    "class_name": class_name,
-                    "confidence": confidence,
-                    "bbox": {
-                        "x1": float(x1),
-                        "y1": float(y1),
-                        "x2": float(x2),
-                        "y2": float(y2)
-                    },
-                    "center": {
-                        "x": cx,
-                        "y": cy
-                    }
-                })
-
-        payload = {
-            "camera_id": cam_name,
-            "frame_id": frame_id,
-            "timestamp": datetime.now(timezone.utc).isoformat(),
-            "frame_shape": {
-                "height": int(h),
-                "width": int(w),
-                "channels": int(c)
-            },
-            "detections": detections,
-            "detection_count": len(detections)
-        }
-        return payload
-    
     try:
         while True:
-            # Kiểm tra FPS - chỉ inference nếu đã đủ thời gian
+            # Chờ đến khi có frame mới (hết deadline gom batch hoặc đủ frame mới từ mọi camera)
+            camera_names = scheduler.wait_for_batch()
             current_time = time.time()
-            if current_time - last_inference_time < inference_interval:
-                time.sleep(0.01)  # Sleep ngắn để không chiếm CPU
-                continue
-            
-            last_inference_time = current_time
-            
-            # Lấy danh sách camera
-            camera_names = list(shared_dict.keys())
-            if not camera_names:
-                time.sleep(0.1)
-                continue
             
             # === TRUE BATCH PROCESSING ===
-            # Bước 1: Thu thập tất cả frame hợp lệ
+            # Bước 1: Thu thập frame mới của các camera (đọc thẳng từ shared memory, không qua Manager)
             valid_frames = {}
             
-            TARGET_WIDTH, TARGET_HEIGHT = 1280, 720
+            TARGET_WIDTH, TARGET_HEIGHT = frame_size
             for cam_name in camera_names:
-                cam_data = shared_dict.get(cam_name, {})
-                frame_age = current_time - cam_data.get('ts', 0)
+                view = frame_ring.read_latest(cam_name)
+                if view is None:
+                    continue
+                scheduler.mark_done(cam_name, view.frame_seq)
+                frame_age = current_time - view.ts
                 
-                if (cam_data.get('status') == 'ok' and 
-                    cam_data.get('frame') is not None and 
-                    frame_age < 5.0):
-                    
+                if view.status == 'ok' and frame_age < 5.0:
                     try:
-                        # Decode frame từ JPEG
-                        jpeg_bytes = cam_data['frame']
-                        nparr = np.frombuffer(jpeg_bytes, np.uint8)
-                        frame = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-                        # Resize frame về 1280x720
-                        if frame is not None:
+                        raw_frame = frame_ring.as_array(view)
+                        if raw_frame is not None:
+                            # Chế độ raw: dùng thẳng mảng BGR trên shared memory, không decode.
+                            # Seqlock được kiểm tra lại sau khi inference xong.
+                            frame = raw_frame
+                        else:
+                            # Decode frame từ JPEG ngay trên vùng nhớ chia sẻ
+                            nparr = np.frombuffer(view.data, np.uint8)
+                            frame = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+                            # Seqlock: bỏ frame nếu camera đã ghi đè slot trong lúc decode
+                            if not frame_ring.is_valid(view):
+                                frame = None
+                        # Resize frame về kích thước input model (chế độ raw đã đúng kích thước)
+                        if frame is not None and (frame.shape[1], frame.shape[0]) != (TARGET_WIDTH, TARGET_HEIGHT):
                             try:
                                 frame = cv2.resize(frame, (TARGET_WIDTH, TARGET_HEIGHT), interpolation=cv2.INTER_LINEAR)
                             except Exception as re:
                                 print(f"Lỗi resize frame {cam_name}: {re}")
-                        
+                            # Raw đã resize = bản copy, không còn kiểm tra sau inference:
+                            # bỏ frame nếu camera đã ghi đè slot trong lúc resize
+                            if raw_frame is not None and frame is not raw_frame and not frame_ring.is_valid(view):
+                                frame = None
+
                         if frame is not None:
                             valid_frames[cam_name] = {
                                 'frame': frame,
                                 'timestamp': current_time,
-                                'original_data': cam_data
+                                'frame_seq': view.frame_seq,
+                                # Chỉ giữ view khi frame còn trỏ vào shared memory
+                                'view': view if frame is raw_frame else None
                             }
                     except Exception as e:
                         print(f"Lỗi decode frame {cam_name}: {e}")
@@ -265,11 +325,18 @@ shared_dict: Dict chứa frame từ camera
                     batch_inference_time = time.time() - batch_start_time
 
                     # Bước 3: Xử lý kết quả batch (LƯU VÀO RAW_DETECTION TOPIC)
+                    # Copy toàn bộ boxes của batch sang CPU 1 lần
+                    batch_boxes = batch_boxes_to_numpy(batch_results)
+                    batch_messages = []
                     for i, (cam_name, results) in enumerate(zip(cam_names_list, batch_results)):
                         frame_data = valid_frames[cam_name]
                         frame = frames_list[i]
+                        # Frame raw bị camera ghi đè trong lúc inference -> kết quả không tin cậy
+                        if frame_data['view'] is not None and not frame_ring.is_valid(frame_data['view']):
+                            continue
                         frame_count += 1
-                        payload = build_detection_payload(cam_name, frame, results, frame_id=frame_count)
+                        payload = build_detection_payload(cam_name, frame, batch_boxes[i], results.names,
+                                                          frame_id=frame_count)
                         
                         # # In ra stdout (mỗi dòng 1 JSON) - để debug
                         # try:
@@ -278,11 +345,23 @@ shared_dict: Dict chứa frame từ camera
                         #     # Fallback nếu có ký tự đặc biệt
                         #     print(json.dumps(payload))
                         
-                        # Lưu vào raw_detection topic với key là camera_id
-                        try:
-                            queue.publish("raw_detection", cam_name, payload)
-                        except Exception as qe:
-                            print(f"Lỗi lưu vào queue: {qe}")
+                        batch_messages.append((cam_name, payload))
+
+                    # Lưu cả batch vào raw_detection topic (key là camera_id) trong 1 transaction
+                    try:
+                        if roi_stage is None:
+                            queue.publish_many("raw_detection", batch_messages)
+                        else:
+                            queue.publish_many("roi_detection", roi_stage.process_batch(batch_messages))
+                            if raw_sample_every:
+                                sampled = []
+                                for cam_name, payload in batch_messages:
+                                    raw_counts[cam_name] = raw_counts.get(cam_name, 0) + 1
+                                    if raw_counts[cam_name] % raw_sample_every == 0:
+                                        sampled.append((cam_name, payload))
+                                queue.publish_many("raw_detection", sampled)
+                    except Exception as qe:
+                        print(f"Lỗi lưu vào queue: {qe}")
                     # Log hiệu năng batch
                     avg_time_per_frame = batch_inference_time / max(1, len(frames_list))
                     # print(f"True batch: {len(frames_list)} cams in {batch_inference_time:.3f}s (avg: {avg_time_per_frame:.3f}s/frame)")
@@ -299,4 +378,10 @@ shared_dict: Dict chứa frame từ camera
     except Exception as e:
         print(f"AI Inference worker lỗi: {e}")
     finally:
+        frame_ring.close()
+        if pruner is not None:
+            pruner.stop()
+        if roi_stage is not None:
+            roi_stage.stop_inline()
+        queue.close()
         print("AI Inference worker: Đã dừng")
\ No newline at end of file
@@ -1,46 +1,141 @@
+import queue
 import time
-from camera_thread import CameraThread
+from camera_thread import CameraThread, CAPTURE_GRAB
+from capture_scheduler import NO_OWNER
+from frame_ring import TRANSPORT_JPEG
 
-def camera_process_worker(process_id, camera_list, shared_dict, max_retry_attempts=5, target_fps=1.0):
+# Kết nối lại camera: CameraThread kết thúc khi kết nối thất bại / mất tín hiệu, supervisor của process
+# hẹn giờ khởi động thread mới (không thread nào sleep chờ): sau n lần thất bại liên tiếp chờ
+# RECONNECT_BACKOFF * 2^(n-1) giây (tối đa RECONNECT_BACKOFF_MAX); từ lần thứ max_retry_attempts
+# báo connection_failed và chỉ thử lại mỗi FAILED_RETRY_INTERVAL giây
+RECONNECT_BACKOFF = 2.0
+RECONNECT_BACKOFF_MAX = 30.0
+FAILED_RETRY_INTERVAL = 300.0
+# Phiên kết nối chạy ổn lâu hơn ngưỡng này -> mất tín hiệu thì kết nối lại ngay, đếm thất bại từ đầu
+THREAD_HEALTHY_SECONDS = 60.0
+COMMAND_POLL_INTERVAL = 1.0
+
+def camera_process_worker(process_id, camera_list, frame_ring, max_retry_attempts=5, target_fps=1.0,
+                          transport=TRANSPORT_JPEG, frame_size=(1280, 720), capture_mode=CAPTURE_GRAB,
+                          decode_threads=None, command_queue=None, decode_seconds=None, owners=None):
     """
     Worker function cho mỗi process
-    
+
     Args:
         process_id: ID process
         camera_list: Danh sách camera [(name, url), ...]
-        shared_dict: Multiprocessing.Manager().dict()
-        max_retry_attempts: Số lần thử kết nối lại tối đa cho mỗi camera
+        frame_ring: SharedFrameRing dùng chung (camera thread ghi frame trực tiếp vào shared memory)
+        max_retry_attempts: Số lần kết nối thất bại liên tiếp trước khi báo connection_failed
         target_fps: FPS mục tiêu cho camera (mặc định: 2.0 FPS)
+        transport: Chế độ truyền frame ("jpeg" hoặc "raw")
+        frame_size: (width, height) frame raw cho AI inference (chế độ raw)
+        capture_mode: "grab" (grab mọi frame, chỉ retrieve frame publish) hoặc "read"
+        decode_threads: Số thread decoder FFmpeg mỗi camera (None = mặc định FFmpeg)
+        command_queue: multiprocessing.Queue nhận lệnh của CaptureScheduler:
+            ("start", cam_name, cam_url) / ("stop", cam_name)
+        decode_seconds: multiprocessing.Array('d') thời gian CPU decode cộng dồn theo camera index
+        owners: multiprocessing.Array('i') process đang chạy camera; process ghi process_id khi khởi động
+            camera và NO_OWNER sau khi thread đã dừng hẳn (để scheduler giao camera cho process khác)
     """
     print(f"Process {process_id}: Bắt đầu với {len(camera_list)} camera (FPS: {target_fps})")
-    
-    # Dict local trong process
-    local_dict = {}
-    
+    cam_index = {cam_name: i for i, cam_name in enumerate(frame_ring.camera_names)}
+    threads = {}  # cam_name -> (CameraThread, cam_url)
+    stopping = {}  # cam_name -> CameraThread đang dừng (chuyển sang process khác)
+    restarts = {}  # cam_name -> (cam_url, thời điểm kết nối lại, số lần thất bại liên tiếp)
+
+    def start_camera(cam_name, cam_url, retry_count=0):
+        thread = CameraThread(cam_name, cam_url, frame_ring, max_retry_attempts, target_fps,
+                              transport=transport, frame_size=frame_size,
+                              capture_mode=capture_mode, decode_threads=decode_threads,
+                              decode_seconds=decode_seconds, stats_index=cam_index[cam_name])
+        thread.retry_count = retry_count
+        threads[cam_name] = (thread, cam_url)
+        if owners is not None:
+            owners[cam_index[cam_name]] = process_id
+        thread.start()
+        if retry_count == 0:
+            print(f"Process {process_id}: Khởi động thread {cam_name} (FPS: {target_fps})")
+
+    def release_camera(cam_name):
+        if owners is not None and owners[cam_index[cam_name]] == process_id:
+            owners[cam_index[cam_name]] = NO_OWNER
+
+    def handle_command(command):
+        if command[0] == "start":
+            _, cam_name, cam_url = command
+            if cam_name not in threads and cam_name not in stopping:
+                restarts.pop(cam_name, None)
+                start_camera(cam_name, cam_url)
+        elif command[0] == "stop":
+            cam_name = command[1]
+            if cam_name in threads:
+                thread = threads.pop(cam_name)[0]
+                thread.stop()
+                stopping[cam_name] = thread
+            elif restarts.pop(cam_name, None) is not None:
+                release_camera(cam_name)
+
+    def supervise(now):
+        # Thread đã dừng hẳn sau lệnh stop -> nhả camera cho process khác
+        for cam_name, thread in list(stopping.items()):
+            if not thread.is_alive():
+                del stopping[cam_name]
+                release_camera(cam_name)
+                print(f"Process {process_id}: Đã dừng thread {cam_name}")
+        # Thread kết thúc (kết nối thất bại, mất tín hiệu, lỗi) -> hẹn giờ kết nối lại
+        for cam_name, (thread, cam_url) in list(threads.items()):
+            if thread.is_alive():
+                continue
+            del threads[cam_name]
+            connected_at = thread.last_successful_connection
+            if connected_at is not None and time.time() - connected_at >= THREAD_HEALTHY_SECONDS:
+                restarts[cam_name] = (cam_url, now, 0)
+                continue
+            failures = thread.retry_count + 1
+            if failures >= max_retry_attempts:
+                status, delay = 'connection_failed', FAILED_RETRY_INTERVAL
+            else:
+                status, delay = 'retrying', min(RECONNECT_BACKOFF * 2 ** (failures - 1), RECONNECT_BACKOFF_MAX)
+            frame_ring[cam_name] = {
+                'frame': None,
+                'ts': time.time(),
+                'status': status,
+                'retry_count': failures,
+                'next_retry_in': delay
+            }
+            restarts[cam_name] = (cam_url, now + delay, failures)
+            print(f"Camera {cam_name} sẽ thử kết nối lại sau {delay:.0f} giây "
+                  f"({status}, thất bại {failures}/{max_retry_attempts})")
+        for cam_name, (cam_url, restart_at, failures) in list(restarts.items()):
+            if now >= restart_at:
+                del restarts[cam_name]
+                start_camera(cam_name, cam_url, failures)
+
     # Tạo và khởi động các camera thread
-    threads = []
     for cam_name, cam_url in camera_list:
-        thread = CameraThread(cam_name, cam_url, local_dict, max_retry_attempts, target_fps)
-        threads.append(thread)
-        thread.start()
-        print(f"Process {process_id}: Khởi động thread {cam_name} (FPS: {target_fps})")
-    
-    # Vòng lặp cập nhật từ local_dict lên shared_dict
+        start_camera(cam_name, cam_url)
+
+    # Camera thread ghi thẳng vào frame_ring, process chỉ nhận lệnh scheduler + giám sát thread
     try:
         while True:
-            # Copy dữ liệu từ local_dict lên shared_dict
-            for cam_name, data in local_dict.items():
-                shared_dict[cam_name] = data
-            
-            time.sleep(0.7)  # Update mỗi 100ms
-            
+            if command_queue is None:
+                time.sleep(COMMAND_POLL_INTERVAL)
+            else:
+                try:
+                    handle_command(command_queue.get(timeout=COMMAND_POLL_INTERVAL))
+                except queue.Empty:
+                    pass
+            supervise(time.monotonic())
+
     except KeyboardInterrupt:
         print(f"Process {process_id}: Đang dừng...")
-        
+
         # Dừng tất cả thread
-        for thread in threads:
+        for thread, _ in threads.values():
             thread.stop()
-        
+
         # Đợi thread kết thúc
-        for thread in threads:
-            thread.join(timeout=1.0)
\ No newline at end of file
+        for thread, _ in threads.values():
+            thread.join(timeout=1.0)
+    finally:
+        frame_ring.close()
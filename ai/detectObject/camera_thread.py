@@ -2,18 +2,51 @@ import cv2
 import time
 import threading
 import numpy as np
+from frame_ring import TRANSPORT_JPEG, TRANSPORT_RAW
+
+# Cấu hình cho chế độ truyền JPEG
+JPEG_FRAME_SIZE = (640, 360)
+JPEG_QUALITY = 85
+
+# Chế độ capture
+CAPTURE_GRAB = "grab"  # grab() mọi frame, chỉ retrieve() frame sẽ publish (bỏ convert YUV->BGR + copy)
+CAPTURE_READ = "read"  # read() mọi frame rồi bỏ frame thừa (cách cũ)
+CAPTURE_MODES = (CAPTURE_GRAB, CAPTURE_READ)
+
+# Timeout của FFmpeg: open() / read() trả về thất bại thay vì treo thread khi camera không phản hồi
+OPEN_TIMEOUT_MS = 5000
+READ_TIMEOUT_MS = 5000
+
+# Chu kỳ (giây) cộng dồn thời gian CPU của thread vào decode_seconds (cho CaptureScheduler)
+DECODE_STATS_INTERVAL = 1.0
 
 class CameraThread(threading.Thread):
-    """Thread xử lý một camera"""
+    """
+    Thread xử lý một camera trong 1 phiên kết nối: mở capture 1 lần, đọc frame đến khi mất tín hiệu / lỗi /
+    stop() rồi release capture và kết thúc. Thread không tự chờ để kết nối lại: supervisor của
+    camera_process_worker hẹn giờ (backoff) rồi khởi động thread mới cho camera.
+    """
     
-    def __init__(self, cam_name, cam_url, local_dict, max_retry_attempts=5, target_fps=1.0):
+    def __init__(self, cam_name, cam_url, local_dict, max_retry_attempts=5, target_fps=1.0,
+                 transport=TRANSPORT_JPEG, frame_size=(1280, 720), capture_mode=CAPTURE_GRAB,
+                 decode_threads=None, decode_seconds=None, stats_index=None):
         """
         Args:
             cam_name: Tên camera
             cam_url: URL/ID camera
-            local_dict: Dict local trong process
-            max_retry_attempts: Số lần thử kết nối lại tối đa (mặc định: 5)
+            local_dict: Nơi ghi frame/trạng thái (SharedFrameRing hoặc dict có __setitem__)
+            max_retry_attempts: Số lần kết nối thất bại liên tiếp trước khi báo connection_failed (hiển thị
+                trong log; supervisor của process quyết định thời điểm kết nối lại)
             target_fps: FPS mục tiêu cho camera (mặc định: 2.0 FPS)
+            transport: "jpeg" (resize 640x360 + encode JPEG) hoặc "raw" (mảng BGR kích thước frame_size)
+            frame_size: (width, height) frame raw gửi cho AI inference (chỉ dùng ở chế độ raw)
+            capture_mode: "grab" (chỉ retrieve frame cần publish) hoặc "read" (decode + convert mọi frame)
+            decode_threads: Số thread decoder FFmpeg cho camera này (None = mặc định của FFmpeg,
+                thường bằng số core -> quá tải khi 1 process chạy nhiều camera; nên đặt 1-2)
+            decode_seconds: multiprocessing.Array('d') thời gian CPU cộng dồn theo camera (None = không đo).
+                Đo bằng time.thread_time() của thread này (grab/read/retrieve + resize/encode); decode
+                trong thread riêng của FFmpeg (decode_threads > 1) không được tính
+            stats_index: Vị trí camera trong decode_seconds
         """
         super().__init__(daemon=True)
         self.cam_name = cam_name
@@ -21,139 +54,131 @@ class CameraThread(threading.Thread):
         self.local_dict = local_dict
         self.running = False
         self.max_retry_attempts = max_retry_attempts
-        self.retry_count = 0
-        self.last_successful_connection = None
+        self.retry_count = 0  # Số lần kết nối thất bại liên tiếp trước phiên này (supervisor đặt)
+        self.last_successful_connection = None  # Thời điểm kết nối thành công của phiên này
         self.target_fps = target_fps
         self.frame_interval = 1.0 / target_fps  # Khoảng thời gian giữa các frame
         self.last_frame_time = 0
+        self.transport = transport
+        self.frame_size = tuple(frame_size)
+        self.capture_mode = capture_mode
+        self.decode_threads = decode_threads
+        self.decode_seconds = decode_seconds
+        self.stats_index = stats_index
+        self._reported_cpu = 0.0
+        self._next_stats_report = 0.0
     
-    def _try_connect_camera(self, timeout=5.0):
+    def _open_capture(self):
         """
-        Thử kết nối camera với timeout
+        Mở VideoCapture qua FFmpeg với timeout open/read và tuỳ chọn decoder (số thread FFmpeg).
+        URL/đường dẫn dạng str đi qua CAP_FFMPEG; index webcam (int) dùng backend mặc định.
+        """
+        if not isinstance(self.cam_url, str):
+            return cv2.VideoCapture(self.cam_url)
+        params = []
+        if hasattr(cv2, "CAP_PROP_OPEN_TIMEOUT_MSEC"):
+            params += [cv2.CAP_PROP_OPEN_TIMEOUT_MSEC, OPEN_TIMEOUT_MS,
+                       cv2.CAP_PROP_READ_TIMEOUT_MSEC, READ_TIMEOUT_MS]
+        if self.decode_threads is not None and hasattr(cv2, "CAP_PROP_N_THREADS"):
+            params += [cv2.CAP_PROP_N_THREADS, int(self.decode_threads)]
+        return cv2.VideoCapture(self.cam_url, cv2.CAP_FFMPEG, params)
+    
+    def _try_connect_camera(self):
+        """
+        Thử kết nối camera 1 lần (FFmpeg tự giới hạn thời gian mở bằng OPEN_TIMEOUT_MS)
         
         Returns:
             cv2.VideoCapture: Đối tượng camera nếu kết nối thành công, None nếu thất bại
         """
         print(f"Đang kết nối camera {self.cam_name}... (lần thử {self.retry_count + 1}/{self.max_retry_attempts})")
         
-        cap = cv2.VideoCapture(self.cam_url)
-        start_time = time.time()
-        
-        while not cap.isOpened() and (time.time() - start_time) < timeout:
-            time.sleep(0.1)
-            cap = cv2.VideoCapture(self.cam_url)
-        
+        cap = self._open_capture()
         if cap.isOpened():
             print(f"Camera {self.cam_name} đã kết nối thành công")
-            self.retry_count = 0  # Reset retry count khi kết nối thành công
             self.last_successful_connection = time.time()
             return cap
-        else:
-            print(f"Không thể kết nối camera {self.cam_name} (timeout {timeout}s)")
-            return None
+        
+        # Giải phóng capture lỗi ngay (không giữ FD / socket tới lần thử sau)
+        cap.release()
+        print(f"Không thể kết nối camera {self.cam_name}")
+        return None
     
-    def _handle_connection_failure(self):
-        """Xử lý khi kết nối camera thất bại"""
-        self.retry_count += 1
+    def _report_decode_time(self, now):
+        """Cộng phần thời gian CPU mới của thread vào decode_seconds (tối đa 1 lần / DECODE_STATS_INTERVAL)"""
+        if self.decode_seconds is None or now < self._next_stats_report:
+            return
+        self._next_stats_report = now + DECODE_STATS_INTERVAL
+        cpu = time.thread_time()
+        self.decode_seconds[self.stats_index] += cpu - self._reported_cpu
+        self._reported_cpu = cpu
+
+    def _prepare_frame(self, frame):
+        """
+        Chuẩn bị frame theo chế độ truyền
         
-        if self.retry_count >= self.max_retry_attempts:
-            print(f"Camera {self.cam_name} đã thử kết nối {self.max_retry_attempts} lần nhưng thất bại. Dừng thử lại.")
-            self.local_dict[self.cam_name] = {
-                'frame': None,
-                'ts': time.time(),
-                'status': 'connection_failed',
-                'retry_count': self.retry_count,
-                'last_attempt': time.time()
-            }
-            return False
-        else:
-            # Tính thời gian chờ tăng dần (exponential backoff)
-            wait_time = min(2 ** self.retry_count, 30)  # Tối đa 30 giây
-            print(f"Camera {self.cam_name} sẽ thử kết nối lại sau {wait_time} giây...")
-            
-            self.local_dict[self.cam_name] = {
-                'frame': None,
-                'ts': time.time(),
-                'status': 'retrying',
-                'retry_count': self.retry_count,
-                'next_retry_in': wait_time
-            }
-            
-            time.sleep(wait_time)
-            return True
+        Returns:
+            bytes (JPEG) hoặc np.ndarray BGR uint8 kích thước frame_size (raw)
+        """
+        if self.transport == TRANSPORT_RAW:
+            # Resize một lần về kích thước input model, không encode
+            height, width = frame.shape[:2]
+            if (width, height) != self.frame_size:
+                frame = cv2.resize(frame, self.frame_size, interpolation=cv2.INTER_LINEAR)
+            return np.ascontiguousarray(frame)
         
+        # Resize frame
+        frame = cv2.resize(frame, JPEG_FRAME_SIZE)
+        
+        # Encode JPEG để giảm dung lượng
+        _, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
+        return buffer.tobytes()
+    
     def run(self):
-        """Vòng lặp chính đọc frame liên tục"""
+        """Vòng lặp chính đọc frame của 1 phiên kết nối"""
         self.running = True
         
-        # Thử kết nối camera ban đầu
         cap = self._try_connect_camera()
         if cap is None:
-            # Thử kết nối lại nếu thất bại
-            while self.running and self.retry_count < self.max_retry_attempts:
-                if not self._handle_connection_failure():
-                    return  # Đã thử hết số lần cho phép
-                
-                cap = self._try_connect_camera()
-                if cap is not None:
-                    break  # Kết nối thành công
+            return  # Supervisor của process hẹn giờ kết nối lại
         
-        while self.running:
-            try:
-                ret, frame = cap.read()
+        try:
+            while self.running:
+                self._report_decode_time(time.monotonic())
+                if self.capture_mode == CAPTURE_GRAB:
+                    # Chỉ grab (demux + decode), chưa convert sang BGR
+                    ret = cap.grab()
+                    frame = None
+                else:
+                    ret, frame = cap.read()
                 if not ret:
-                    # Camera mất tín hiệu - thử kết nối lại
+                    # Mất tín hiệu hoặc quá READ_TIMEOUT_MS không có dữ liệu
                     print(f"Camera {self.cam_name} mất tín hiệu, thử kết nối lại...")
-                    cap.release()
-                    
-                    # Thử kết nối lại
-                    cap = self._try_connect_camera()
-                    if cap is None:
-                        # Nếu không kết nối được, thử retry
-                        if not self._handle_connection_failure():
-                            return  # Đã thử hết số lần cho phép
-                        continue
-                    else:
-                        print(f"Camera {self.cam_name} đã kết nối lại thành công")
-                        continue
+                    break
                 
                 # Kiểm tra FPS - chỉ xử lý frame nếu đã đủ thời gian
                 current_time = time.time()
                 if current_time - self.last_frame_time < self.frame_interval:
                     continue  # Bỏ qua frame này để duy trì FPS mục tiêu
                 
-                self.last_frame_time = current_time
-                
-                # Resize frame
-                frame = cv2.resize(frame, (640, 360))
+                if frame is None:
+                    # Frame này sẽ được publish: lúc này mới retrieve (convert + copy)
+                    ret, frame = cap.retrieve()
+                    if not ret or frame is None:
+                        continue
                 
-                # Encode JPEG để giảm dung lượng
-                _, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 85])
-                jpeg_bytes = buffer.tobytes()
+                self.last_frame_time = current_time
                 
                 # Lưu vào local_dict
                 self.local_dict[self.cam_name] = {
-                    'frame': jpeg_bytes,
+                    'frame': self._prepare_frame(frame),
                     'ts': current_time,
                     'status': 'ok'
                 }
                 
-            except Exception as e:
-                print(f"Lỗi camera {self.cam_name}: {e}")
-                cap.release()
-                
-                # Thử kết nối lại sau lỗi
-                cap = self._try_connect_camera()
-                if cap is None:
-                    # Nếu không kết nối được, thử retry
-                    if not self._handle_connection_failure():
-                        return  # Đã thử hết số lần cho phép
-                    continue
-                else:
-                    print(f"Camera {self.cam_name} đã kết nối lại sau lỗi")
-                    continue
-                
-        cap.release()
+        except Exception as e:
+            print(f"Lỗi camera {self.cam_name}: {e}")
+        finally:
+            cap.release()
     
     def stop(self):
         """Dừng thread"""
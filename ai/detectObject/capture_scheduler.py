@@ -0,0 +1,157 @@
+"""
+Phân camera cho các process capture theo chi phí decode đo được.
+
+Thay cho chia khối cố định (math.ceil(total / num_processes)) chạy suốt vòng đời: mỗi CameraThread
+cộng dồn thời gian CPU của grab/read/retrieve + chuẩn bị frame (time.thread_time) vào mảng shared memory
+decode_seconds theo camera. Orchestrator gọi CaptureScheduler.tick() mỗi giây:
+- Ước lượng chi phí decode mỗi camera (giây CPU / giây, trung bình trượt EWMA); camera chết có chi phí ~0
+  nên không còn chiếm chỗ trong việc chia tải
+- Mỗi rebalance_interval giây: nếu process nặng nhất vượt trung bình quá imbalance_threshold, chuyển tối đa
+  max_moves camera từ process nặng nhất sang process nhẹ nhất (plan_moves)
+- Chuyển camera theo 2 bước để không bao giờ có 2 thread cùng ghi 1 camera vào frame ring:
+  gửi "stop" cho process cũ, đợi process cũ báo đã dừng thread (owners[idx] = NO_OWNER) rồi mới gửi
+  "start" cho process mới
+"""
+
+import time
+
+NO_OWNER = -1
+
+
+def plan_moves(costs, assignment, num_processes, imbalance_threshold=1.25, max_moves=2):
+    """
+    Chọn camera cần chuyển để cân bằng tải decode (không sửa assignment truyền vào).
+
+    Mỗi bước chuyển từ process nặng nhất sang process nhẹ nhất camera có chi phí gần nửa chênh lệch nhất
+    (và nhỏ hơn chênh lệch, để cả 2 process sau khi chuyển đều nhẹ hơn process nặng nhất trước đó).
+
+    Args:
+        costs: Chi phí decode theo camera index
+        assignment: Process đang chạy từng camera index
+        num_processes: Số process capture
+        imbalance_threshold: Chỉ chuyển khi tải process nặng nhất > trung bình * ngưỡng
+        max_moves: Số camera chuyển tối đa (mỗi lần chuyển camera mất vài giây kết nối lại)
+
+    Returns:
+        list: [(cam_idx, process cũ, process mới), ...]
+    """
+    loads = [0.0] * num_processes
+    for idx, proc in enumerate(assignment):
+        loads[proc] += costs[idx]
+    mean = sum(loads) / num_processes
+    assignment = list(assignment)
+    moves = []
+    while len(moves) < max_moves and mean > 0:
+        src = max(range(num_processes), key=loads.__getitem__)
+        dst = min(range(num_processes), key=loads.__getitem__)
+        if loads[src] <= mean * imbalance_threshold:
+            break
+        gap = loads[src] - loads[dst]
+        candidates = [idx for idx, proc in enumerate(assignment) if proc == src and 0 < costs[idx] < gap]
+        if not candidates:
+            break
+        idx = min(candidates, key=lambda i: abs(costs[i] - gap / 2))
+        assignment[idx] = dst
+        loads[src] -= costs[idx]
+        loads[dst] += costs[idx]
+        moves.append((idx, src, dst))
+    return moves
+
+
+class CaptureScheduler:
+    """Theo dõi chi phí decode từng camera và chuyển camera giữa các process capture khi lệch tải"""
+
+    def __init__(self, camera_urls, camera_groups, decode_seconds, owners, rebalance_interval=30.0,
+                 imbalance_threshold=1.25, max_moves=2, ewma_alpha=0.2):
+        """
+        Args:
+            camera_urls: [(cam_name, cam_url), ...] (thứ tự = camera index của decode_seconds/owners)
+            camera_groups: Phân chia ban đầu [[(cam_name, cam_url), ...] cho mỗi process]
+            decode_seconds: multiprocessing.Array('d') thời gian CPU decode cộng dồn theo camera
+            owners: multiprocessing.Array('i') process đang chạy camera (NO_OWNER = không có)
+            rebalance_interval: Chu kỳ (giây) xét cân bằng lại (None = không chuyển camera)
+            imbalance_threshold: Xem plan_moves()
+            max_moves: Số camera chuyển tối đa mỗi lần cân bằng
+            ewma_alpha: Hệ số trung bình trượt chi phí decode (mỗi lần tick)
+        """
+        self.camera_urls = list(camera_urls)
+        self.num_processes = len(camera_groups)
+        self.decode_seconds = decode_seconds
+        self.owners = owners
+        self.rebalance_interval = rebalance_interval
+        self.imbalance_threshold = imbalance_threshold
+        self.max_moves = max_moves
+        self.ewma_alpha = ewma_alpha
+        index = {cam_name: i for i, (cam_name, _) in enumerate(self.camera_urls)}
+        self.assignment = [0] * len(self.camera_urls)
+        for process_idx, group in enumerate(camera_groups):
+            for cam_name, _ in group:
+                self.assignment[index[cam_name]] = process_idx
+        # Camera đang chuyển: cam_idx -> process mới (chờ process cũ dừng thread)
+        self.pending = {}
+        self.cost = [0.0] * len(self.camera_urls)
+        self._last_totals = None
+        self._last_sample = None
+        # Chờ đủ 1 chu kỳ dữ liệu trước lần cân bằng đầu tiên
+        self._last_rebalance = time.monotonic()
+
+    def sample(self, now):
+        """Cập nhật chi phí decode (giây CPU / giây) từ decode_seconds"""
+        totals = self.decode_seconds[:]
+        if self._last_sample is not None and now > self._last_sample:
+            dt = now - self._last_sample
+            for i, total in enumerate(totals):
+                rate = max(0.0, total - self._last_totals[i]) / dt
+                self.cost[i] += self.ewma_alpha * (rate - self.cost[i])
+        self._last_totals = totals
+        self._last_sample = now
+
+    def loads(self):
+        """Tải decode ước lượng theo process"""
+        loads = [0.0] * self.num_processes
+        for idx, proc in enumerate(self.assignment):
+            loads[proc] += self.cost[idx]
+        return loads
+
+    def cameras_of(self, process_idx):
+        """Camera process_idx đang phụ trách (không gồm camera đang chờ chuyển đi)"""
+        return [self.camera_urls[idx] for idx, proc in enumerate(self.assignment)
+                if proc == process_idx and idx not in self.pending]
+
+    def tick(self, send, now=None):
+        """
+        Gọi định kỳ (mỗi giây) từ orchestrator.
+
+        Args:
+            send: send(process_idx, command) gửi lệnh ("start", cam_name, cam_url) / ("stop", cam_name)
+
+        Returns:
+            list: Các camera bắt đầu chuyển ở lần tick này [(cam_idx, process cũ, process mới), ...]
+        """
+        now = time.monotonic() if now is None else now
+        self.sample(now)
+
+        # Bước 2 của các lần chuyển: process cũ đã dừng thread -> khởi động ở process mới
+        for idx, dst in list(self.pending.items()):
+            if self.owners[idx] == NO_OWNER:
+                cam_name, cam_url = self.camera_urls[idx]
+                send(dst, ("start", cam_name, cam_url))
+                self.assignment[idx] = dst
+                del self.pending[idx]
+
+        if (self.rebalance_interval is None or self.pending
+                or now - self._last_rebalance < self.rebalance_interval):
+            return []
+        self._last_rebalance = now
+        moves = plan_moves(self.cost, self.assignment, self.num_processes,
+                           self.imbalance_threshold, self.max_moves)
+        if moves:
+            loads = ", ".join(f"{load * 100:.0f}%" for load in self.loads())
+            print(f"[CaptureScheduler] Tải decode theo process: {loads}")
+        for idx, src, dst in moves:
+            cam_name = self.camera_urls[idx][0]
+            print(f"[CaptureScheduler] Chuyển {cam_name} ({self.cost[idx] * 100:.0f}% CPU) "
+                  f"từ process {src} sang process {dst}")
+            send(src, ("stop", cam_name))
+            self.pending[idx] = dst
+        return moves
@@ -7,7 +7,7 @@ def display_worker(shared_dict):
     Display worker process - hiển thị mỗi camera trong một window riêng
     
     Args:
-        shared_dict: Multiprocessing.Manager().dict()
+        shared_dict: SharedFrameRing (hoặc dict cùng định dạng {'frame', 'ts', 'status'})
     """
     print("Display worker: Bắt đầu")
     
@@ -37,10 +37,14 @@ def display_worker(shared_dict):
                     frame_age < 2.0):
                     
                     try:
-                        # Decode JPEG bytes thành frame
-                        jpeg_bytes = cam_data['frame']
-                        nparr = np.frombuffer(jpeg_bytes, np.uint8)
-                        frame = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+                        if isinstance(cam_data['frame'], np.ndarray):
+                            # Chế độ raw: frame đã là mảng BGR
+                            frame = cam_data['frame']
+                        else:
+                            # Decode JPEG bytes thành frame
+                            jpeg_bytes = cam_data['frame']
+                            nparr = np.frombuffer(jpeg_bytes, np.uint8)
+                            frame = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
                         
                         if frame is not None:
                             # Resize frame để fit vào window
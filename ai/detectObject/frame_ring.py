@@ -0,0 +1,326 @@
+"""
+Ring buffer frame trên multiprocessing.shared_memory.
+
+Thay cho Manager().dict(): camera thread ghi frame trực tiếp vào vùng nhớ chia sẻ,
+AI inference worker đọc lại bằng memoryview (không pickle, không copy qua proxy).
+
+Bố cục vùng nhớ:
+    [camera header 0][camera header 1]...[slot 0 của cam 0][slot 1 của cam 0]...
+
+- Camera header: frame_seq (số frame đã ghi), latest_slot, status, status_ts, retry_count
+- Slot: version (seqlock), frame_seq, ts, length, height, width, channels, data[slot_bytes]
+
+Seqlock: writer tăng version lên số lẻ trước khi ghi, lên số chẵn sau khi ghi xong.
+Reader lấy version (chẵn) trước khi đọc và kiểm tra lại sau khi dùng xong dữ liệu;
+nếu version thay đổi thì frame đã bị ghi đè giữa chừng và phải bỏ.
+"""
+
+import struct
+import time
+from collections import namedtuple
+from multiprocessing import shared_memory
+
+import numpy as np
+
+# frame_seq, latest_slot, status, status_ts, retry_count
+_CAM_HEADER = struct.Struct("<QIIdI")
+_CAM_HEADER_SIZE = 64
+# version, frame_seq, ts, length, height, width, channels
+_SLOT_HEADER = struct.Struct("<QQdIIII")
+_SLOT_HEADER_SIZE = 64
+
+STATUS_CODES = {
+    "empty": 0,
+    "ok": 1,
+    "retrying": 2,
+    "connection_failed": 3,
+}
+STATUS_NAMES = {code: name for name, code in STATUS_CODES.items()}
+
+# Kích thước mặc định mỗi slot: đủ cho 1 frame BGR 640x360 (JPEG luôn nhỏ hơn)
+DEFAULT_SLOT_BYTES = 640 * 360 * 3
+
+# Chế độ truyền frame giữa camera và AI inference
+TRANSPORT_JPEG = "jpeg"  # JPEG 640x360 (tiết kiệm bộ nhớ, tốn CPU encode/decode)
+TRANSPORT_RAW = "raw"    # Mảng uint8 BGR đúng kích thước input model (không encode/decode)
+TRANSPORTS = (TRANSPORT_JPEG, TRANSPORT_RAW)
+
+
+def slot_bytes_for(transport, frame_size):
+    """
+    Dung lượng slot cần cho chế độ truyền
+
+    Args:
+        transport: TRANSPORT_JPEG hoặc TRANSPORT_RAW
+        frame_size: (width, height) của frame raw
+    """
+    if transport == TRANSPORT_RAW:
+        width, height = frame_size
+        return int(width) * int(height) * 3
+    return DEFAULT_SLOT_BYTES
+
+FrameView = namedtuple(
+    "FrameView",
+    ["cam_name", "slot", "version", "frame_seq", "ts", "status", "data", "shape"],
+)
+
+
+class SharedFrameRing:
+    """Ring buffer frame dùng chung giữa các process camera và AI inference worker"""
+
+    def __init__(self, camera_names, num_slots=3, slot_bytes=DEFAULT_SLOT_BYTES, name=None, create=True,
+                 new_frame_event=None):
+        """
+        Args:
+            camera_names: Danh sách tên camera (cố định khi tạo ring)
+            num_slots: Số slot mỗi camera (>= 2 để reader đọc slot cũ khi writer ghi slot mới)
+            slot_bytes: Dung lượng tối đa 1 frame (bytes)
+            name: Tên shared memory (dùng khi attach từ process khác)
+            create: True nếu tạo mới, False nếu attach vào ring đã có
+            new_frame_event: multiprocessing.Event được set mỗi khi có frame mới (để reader không phải polling)
+        """
+        if num_slots < 2:
+            raise ValueError("num_slots phải >= 2")
+        self.camera_names = list(camera_names)
+        self.num_slots = int(num_slots)
+        self.slot_bytes = int(slot_bytes)
+        self._cam_index = {cam_name: i for i, cam_name in enumerate(self.camera_names)}
+        self._slot_stride = _SLOT_HEADER_SIZE + self.slot_bytes
+        self._slots_offset = _CAM_HEADER_SIZE * len(self.camera_names)
+        total_size = self._slots_offset + self._slot_stride * self.num_slots * len(self.camera_names)
+
+        if create:
+            self._shm = shared_memory.SharedMemory(name=name, create=True, size=total_size)
+            self._shm.buf[:self._slots_offset] = bytes(self._slots_offset)
+            for cam_idx in range(len(self.camera_names)):
+                for slot in range(self.num_slots):
+                    _SLOT_HEADER.pack_into(self._shm.buf, self._slot_offset(cam_idx, slot), 0, 0, 0.0, 0, 0, 0, 0)
+        else:
+            self._shm = _attach_shared_memory(name)
+        self._owner = create
+        self._buf = self._shm.buf
+        self.new_frame_event = new_frame_event
+
+    @classmethod
+    def attach(cls, name, camera_names, num_slots, slot_bytes, new_frame_event=None):
+        """Attach vào ring đã được tạo bởi process khác"""
+        return cls(camera_names, num_slots=num_slots, slot_bytes=slot_bytes, name=name, create=False,
+                   new_frame_event=new_frame_event)
+
+    def __reduce__(self):
+        # Cho phép truyền ring trực tiếp làm args của Process (kể cả start method "spawn")
+        return (SharedFrameRing.attach,
+                (self.name, self.camera_names, self.num_slots, self.slot_bytes, self.new_frame_event))
+
+    @property
+    def name(self):
+        return self._shm.name
+
+    def _cam_offset(self, cam_idx):
+        return cam_idx * _CAM_HEADER_SIZE
+
+    def _slot_offset(self, cam_idx, slot):
+        return self._slots_offset + (cam_idx * self.num_slots + slot) * self._slot_stride
+
+    def _read_cam_header(self, cam_idx):
+        return _CAM_HEADER.unpack_from(self._buf, self._cam_offset(cam_idx))
+
+    # ------------------------------------------------------------------ writer
+
+    def write(self, cam_name, data, ts=None, shape=(0, 0, 0)):
+        """
+        Ghi 1 frame vào slot kế tiếp của camera (chỉ 1 writer cho mỗi camera)
+
+        Args:
+            cam_name: Tên camera
+            data: bytes / memoryview / buffer (JPEG bytes hoặc mảng uint8 liên tục)
+            ts: Timestamp capture (mặc định time.time())
+            shape: (height, width, channels) của frame raw, (0, 0, 0) với JPEG
+
+        Returns:
+            int: frame_seq của frame vừa ghi, hoặc None nếu frame quá lớn
+        """
+        cam_idx = self._cam_index[cam_name]
+        ts = time.time() if ts is None else ts
+        payload = memoryview(data).cast("B")
+        length = payload.nbytes
+        if length > self.slot_bytes:
+            print(f"[FrameRing] Frame {cam_name} ({length} bytes) vượt quá slot_bytes={self.slot_bytes}, bỏ qua")
+            return None
+
+        frame_seq, latest_slot, _, _, _ = self._read_cam_header(cam_idx)
+        slot = (latest_slot + 1) % self.num_slots if frame_seq > 0 else 0
+        offset = self._slot_offset(cam_idx, slot)
+        version = struct.unpack_from("<Q", self._buf, offset)[0]
+        next_seq = frame_seq + 1
+
+        # Seqlock: version lẻ = đang ghi
+        struct.pack_into("<Q", self._buf, offset, version + 1)
+        data_offset = offset + _SLOT_HEADER_SIZE
+        self._buf[data_offset:data_offset + length] = payload
+        height, width, channels = shape
+        _SLOT_HEADER.pack_into(self._buf, offset, version + 1, next_seq, ts, length, height, width, channels)
+        struct.pack_into("<Q", self._buf, offset, version + 2)
+
+        _CAM_HEADER.pack_into(self._buf, self._cam_offset(cam_idx), next_seq, slot, STATUS_CODES["ok"], ts, 0)
+        if self.new_frame_event is not None:
+            self.new_frame_event.set()
+        return next_seq
+
+    def set_status(self, cam_name, status, ts=None, retry_count=0):
+        """Cập nhật trạng thái camera (retrying, connection_failed...) mà không ghi frame"""
+        cam_idx = self._cam_index[cam_name]
+        ts = time.time() if ts is None else ts
+        frame_seq, latest_slot, _, _, _ = self._read_cam_header(cam_idx)
+        _CAM_HEADER.pack_into(
+            self._buf, self._cam_offset(cam_idx),
+            frame_seq, latest_slot, STATUS_CODES.get(status, 0), ts, int(retry_count),
+        )
+
+    def __setitem__(self, cam_name, cam_data):
+        """
+        Tương thích với định dạng local_dict cũ của CameraThread:
+        {'frame': jpeg_bytes | None, 'ts': float, 'status': str, 'retry_count': int, ...}
+        """
+        frame = cam_data.get("frame")
+        ts = cam_data.get("ts")
+        if cam_data.get("status") == "ok" and frame is not None:
+            shape = getattr(frame, "shape", None)
+            if shape is not None and len(shape) == 3:
+                # Frame raw (np.ndarray BGR)
+                self.write(cam_name, frame, ts, shape=shape)
+            else:
+                self.write(cam_name, frame, ts)
+        else:
+            self.set_status(cam_name, cam_data.get("status", "empty"), ts, cam_data.get("retry_count", 0))
+
+    # ------------------------------------------------------------------ reader
+
+    def latest_seq(self, cam_name):
+        """frame_seq mới nhất của camera (0 nếu chưa có frame)"""
+        return self._read_cam_header(self._cam_index[cam_name])[0]
+
+    def frame_info(self, cam_name):
+        """
+        Thông tin nhanh từ header camera, không chạm vào dữ liệu frame
+
+        Returns:
+            (frame_seq, ts, status): ts là thời điểm ghi frame/trạng thái gần nhất
+        """
+        frame_seq, _, status, status_ts, _ = self._read_cam_header(self._cam_index[cam_name])
+        return frame_seq, status_ts, STATUS_NAMES.get(status, "empty")
+
+    def read_latest(self, cam_name, max_attempts=3):
+        """
+        Đọc frame mới nhất của camera mà không copy dữ liệu
+
+        Returns:
+            FrameView với data là memoryview trỏ vào shared memory, hoặc None.
+            Sau khi dùng xong data phải gọi is_valid(view) để chắc chắn frame không bị ghi đè.
+        """
+        cam_idx = self._cam_index.get(cam_name)
+        if cam_idx is None:
+            return None
+        for _ in range(max_attempts):
+            frame_seq, latest_slot, status, status_ts, _ = self._read_cam_header(cam_idx)
+            if frame_seq == 0:
+                return None
+            offset = self._slot_offset(cam_idx, latest_slot)
+            version, slot_seq, ts, length, height, width, channels = _SLOT_HEADER.unpack_from(self._buf, offset)
+            if version % 2 == 1:
+                continue  # writer đang ghi slot này
+            data_offset = offset + _SLOT_HEADER_SIZE
+            data = self._buf[data_offset:data_offset + length]
+            return FrameView(
+                cam_name=cam_name,
+                slot=latest_slot,
+                version=version,
+                frame_seq=slot_seq,
+                ts=ts,
+                status=STATUS_NAMES.get(status, "empty"),
+                data=data,
+                shape=(height, width, channels),
+            )
+        return None
+
+    @staticmethod
+    def as_array(view):
+        """
+        Frame raw dạng np.ndarray (H, W, C) trỏ thẳng vào shared memory, None nếu là JPEG
+        """
+        height, width, channels = view.shape
+        if height == 0 or width == 0:
+            return None
+        return np.frombuffer(view.data, dtype=np.uint8).reshape(height, width, channels)
+
+    def is_valid(self, view):
+        """Kiểm tra frame đã đọc không bị writer ghi đè trong lúc sử dụng"""
+        offset = self._slot_offset(self._cam_index[view.cam_name], view.slot)
+        return struct.unpack_from("<Q", self._buf, offset)[0] == view.version
+
+    # --------------------------------------------- tương thích kiểu dict (display)
+
+    def keys(self):
+        """Danh sách camera đã có frame hoặc trạng thái"""
+        names = []
+        for cam_idx, cam_name in enumerate(self.camera_names):
+            frame_seq, _, status, _, _ = self._read_cam_header(cam_idx)
+            if frame_seq > 0 or status != STATUS_CODES["empty"]:
+                names.append(cam_name)
+        return names
+
+    def __len__(self):
+        return len(self.keys())
+
+    def get(self, cam_name, default=None):
+        """
+        Trả về dict theo định dạng cũ {'frame', 'ts', 'status', 'retry_count'} (frame được copy).
+        'frame' là JPEG bytes, hoặc np.ndarray BGR nếu camera chạy chế độ raw.
+        """
+        cam_idx = self._cam_index.get(cam_name)
+        if cam_idx is None:
+            return default
+        _, _, status, status_ts, retry_count = self._read_cam_header(cam_idx)
+        status_name = STATUS_NAMES.get(status, "empty")
+        if status_name != "ok":
+            return {"frame": None, "ts": status_ts, "status": status_name, "retry_count": retry_count}
+        for _ in range(3):
+            view = self.read_latest(cam_name)
+            if view is None:
+                break
+            raw = self.as_array(view)
+            frame = raw.copy() if raw is not None else bytes(view.data)
+            del raw
+            view.data.release()
+            if self.is_valid(view):
+                return {"frame": frame, "ts": view.ts, "status": "ok", "retry_count": 0}
+        return {"frame": None, "ts": status_ts, "status": status_name, "retry_count": retry_count}
+
+    # ---------------------------------------------------------------- lifecycle
+
+    def close(self):
+        """Đóng mapping của process hiện tại"""
+        self._buf = None
+        try:
+            self._shm.close()
+        except BufferError:
+            # Vẫn còn memoryview chưa release; OS sẽ thu hồi khi process kết thúc
+            pass
+
+    def unlink(self):
+        """Giải phóng vùng nhớ (chỉ process tạo ring gọi)"""
+        if self._owner:
+            try:
+                self._shm.unlink()
+            except FileNotFoundError:
+                pass
+
+
+def _attach_shared_memory(name):
+    """Attach vào shared memory có sẵn; việc unlink do process tạo ring đảm nhiệm"""
+    try:
+        return shared_memory.SharedMemory(name=name, create=False, track=False)
+    except TypeError:
+        # Python < 3.13 không có tham số track. Process con dùng chung resource_tracker
+        # với process cha nên đăng ký lại cùng tên không gây unlink sớm.
+        return shared_memory.SharedMemory(name=name, create=False)
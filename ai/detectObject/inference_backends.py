@@ -0,0 +1,193 @@
+"""
+Backend inference cho YOLOInference.
+
+Cho phép chạy pipeline trên máy có GPU (PyTorch CUDA) lẫn máy edge chỉ có CPU / CI:
+- torch_cuda: PyTorch trên GPU (fp32 hoặc fp16)
+- torch_cpu:  PyTorch trên CPU (fp32)
+- onnx:       Model export sang ONNX, chạy bằng ONNX Runtime (fp32 hoặc int8 dynamic quantization)
+- openvino:   Model export sang OpenVINO IR (fp32, fp16 hoặc int8 - int8 cần dữ liệu calibration)
+- auto:       torch_cuda nếu có CUDA, ngược lại torch_cpu
+
+Model export được cache cạnh file .pt và chỉ export lại khi file .pt mới hơn.
+"""
+
+import os
+
+from ultralytics import YOLO
+
+BACKEND_AUTO = "auto"
+BACKEND_TORCH_CUDA = "torch_cuda"
+BACKEND_TORCH_CPU = "torch_cpu"
+BACKEND_ONNX = "onnx"
+BACKEND_OPENVINO = "openvino"
+BACKENDS = (BACKEND_AUTO, BACKEND_TORCH_CUDA, BACKEND_TORCH_CPU, BACKEND_ONNX, BACKEND_OPENVINO)
+
+PRECISION_FP32 = "fp32"
+PRECISION_FP16 = "fp16"
+PRECISION_INT8 = "int8"
+
+# Precision hỗ trợ theo backend
+SUPPORTED_PRECISIONS = {
+    BACKEND_TORCH_CUDA: (PRECISION_FP32, PRECISION_FP16),
+    BACKEND_TORCH_CPU: (PRECISION_FP32,),
+    BACKEND_ONNX: (PRECISION_FP32, PRECISION_INT8),
+    BACKEND_OPENVINO: (PRECISION_FP32, PRECISION_FP16, PRECISION_INT8),
+}
+
+# Cấu hình mặc định (có thể ghi đè trong main.py)
+DEFAULT_BACKEND_CONFIG = {
+    "backend": BACKEND_AUTO,
+    "precision": PRECISION_FP32,
+    "imgsz": 640,
+    # File yaml dataset để calibration khi export OpenVINO int8 (bắt buộc với openvino + int8)
+    "calibration_data": None,
+}
+
+
+def get_backend_config(overrides=None):
+    """
+    Lấy cấu hình backend (DEFAULT_BACKEND_CONFIG ghi đè bởi overrides)
+
+    Returns:
+        dict: {backend, precision, imgsz, calibration_data}
+    """
+    config = dict(DEFAULT_BACKEND_CONFIG)
+    if overrides:
+        unknown = set(overrides) - set(config)
+        if unknown:
+            raise ValueError(f"Khoá cấu hình backend không hợp lệ: {sorted(unknown)}")
+        config.update(overrides)
+    return config
+
+
+def _cuda_available():
+    try:
+        import torch
+        return torch.cuda.is_available()
+    except ImportError:
+        return False
+
+
+def resolve_backend(backend):
+    """Chuyển "auto" thành backend cụ thể theo phần cứng hiện có"""
+    if backend not in BACKENDS:
+        raise ValueError(f"Backend không hợp lệ: {backend} (chọn trong {BACKENDS})")
+    if backend == BACKEND_AUTO:
+        return BACKEND_TORCH_CUDA if _cuda_available() else BACKEND_TORCH_CPU
+    return backend
+
+
+def _is_stale(exported_path, model_path):
+    """Model export chưa có hoặc cũ hơn file .pt"""
+    if not os.path.exists(exported_path):
+        return True
+    return os.path.getmtime(exported_path) < os.path.getmtime(model_path)
+
+
+class TorchBackend:
+    """PyTorch (Ultralytics) trên CUDA hoặc CPU"""
+
+    def __init__(self, model_path, backend, precision, imgsz):
+        if backend == BACKEND_TORCH_CUDA and not _cuda_available():
+            raise RuntimeError("Backend torch_cuda yêu cầu CUDA nhưng CUDA không khả dụng")
+        self.name = backend
+        self.device = "cuda:0" if backend == BACKEND_TORCH_CUDA else "cpu"
+        self.half = precision == PRECISION_FP16
+        self.imgsz = imgsz
+        self.model = YOLO(model_path)
+        try:
+            # Một số phiên bản Ultralytics hỗ trợ .to()
+            self.model.to(self.device)
+        except Exception:
+            # Nếu không hỗ trợ .to(), sẽ truyền device ở mỗi lần gọi
+            pass
+        self.model_file = model_path
+
+    def predict(self, frames):
+        return self.model(frames, device=self.device, half=self.half, imgsz=self.imgsz, verbose=False)
+
+
+class ExportedBackend:
+    """Model export (ONNX Runtime / OpenVINO) chạy trên CPU"""
+
+    def __init__(self, model_path, backend, precision, imgsz, calibration_data=None):
+        self.name = backend
+        self.device = "cpu"
+        self.imgsz = imgsz
+        if backend == BACKEND_ONNX:
+            self.model_file = self._export_onnx(model_path, precision, imgsz)
+        else:
+            self.model_file = self._export_openvino(model_path, precision, imgsz, calibration_data)
+        self.model = YOLO(self.model_file, task="detect")
+
+    @staticmethod
+    def _export_onnx(model_path, precision, imgsz):
+        base = os.path.splitext(model_path)[0]
+        fp32_path = f"{base}.onnx"
+        if _is_stale(fp32_path, model_path):
+            print(f"[Backend] Export ONNX: {model_path} -> {fp32_path}")
+            fp32_path = YOLO(model_path).export(format="onnx", imgsz=imgsz, dynamic=True, simplify=True)
+        if precision != PRECISION_INT8:
+            return fp32_path
+
+        int8_path = f"{base}.int8.onnx"
+        if _is_stale(int8_path, model_path):
+            # Dynamic quantization: weight int8, activation quantize lúc chạy (không cần calibration)
+            from onnxruntime.quantization import QuantType, quantize_dynamic
+            print(f"[Backend] Quantize ONNX int8: {fp32_path} -> {int8_path}")
+            quantize_dynamic(fp32_path, int8_path, weight_type=QuantType.QUInt8)
+        return int8_path
+
+    @staticmethod
+    def _export_openvino(model_path, precision, imgsz, calibration_data):
+        base = os.path.splitext(model_path)[0]
+        suffix = "" if precision == PRECISION_FP32 else f"_{precision}"
+        export_dir = f"{base}{suffix}_openvino_model"
+        if not _is_stale(export_dir, model_path):
+            return export_dir
+        if precision == PRECISION_INT8 and not calibration_data:
+            raise ValueError("OpenVINO int8 cần calibration_data (file yaml dataset) để calibration")
+
+        print(f"[Backend] Export OpenVINO ({precision}): {model_path} -> {export_dir}")
+        exported = YOLO(model_path).export(
+            format="openvino",
+            imgsz=imgsz,
+            dynamic=True,
+            half=precision == PRECISION_FP16,
+            int8=precision == PRECISION_INT8,
+            data=calibration_data,
+        )
+        if os.path.abspath(exported) != os.path.abspath(export_dir):
+            # Ultralytics luôn export ra <base>_openvino_model, đổi tên để cache theo precision
+            if os.path.exists(export_dir):
+                import shutil
+                shutil.rmtree(export_dir)
+            os.replace(exported, export_dir)
+        return export_dir
+
+    def predict(self, frames):
+        return self.model(frames, device=self.device, imgsz=self.imgsz, verbose=False)
+
+
+def create_backend(model_path, backend=BACKEND_AUTO, precision=PRECISION_FP32, imgsz=640, calibration_data=None):
+    """
+    Tạo backend inference theo cấu hình
+
+    Args:
+        model_path: Đường dẫn file .pt
+        backend: "auto", "torch_cuda", "torch_cpu", "onnx" hoặc "openvino"
+        precision: "fp32", "fp16" hoặc "int8" (xem SUPPORTED_PRECISIONS)
+        imgsz: Kích thước input model
+        calibration_data: File yaml dataset cho OpenVINO int8
+
+    Returns:
+        TorchBackend hoặc ExportedBackend (có .predict(frames), .device, .name)
+    """
+    backend = resolve_backend(backend)
+    if precision not in SUPPORTED_PRECISIONS[backend]:
+        raise ValueError(
+            f"Backend {backend} không hỗ trợ precision {precision} (hỗ trợ: {SUPPORTED_PRECISIONS[backend]})"
+        )
+    if backend in (BACKEND_TORCH_CUDA, BACKEND_TORCH_CPU):
+        return TorchBackend(model_path, backend, precision, imgsz)
+    return ExportedBackend(model_path, backend, precision, imgsz, calibration_data)
@@ -0,0 +1,96 @@
+"""
+Lập lịch batch inference theo sự kiện frame mới.
+
+Thay cho vòng polling cố định (sleep 10ms + inference_interval): mỗi camera có frame_seq
+trong SharedFrameRing, scheduler chỉ gom các camera có frame_seq mới hơn lần inference trước.
+Batch được chạy khi:
+- tất cả camera đang hoạt động đều đã có frame mới, hoặc
+- frame mới đầu tiên đã chờ quá max_batch_latency (deadline độ trễ batch).
+"""
+
+import time
+
+
+class InferenceScheduler:
+    """Gom frame mới của các camera thành batch cho AI inference"""
+
+    def __init__(self, frame_ring, max_batch_latency=0.2, max_frame_age=5.0, min_batch_interval=0.0,
+                 idle_poll_interval=0.05):
+        """
+        Args:
+            frame_ring: SharedFrameRing chứa frame_seq của từng camera
+            max_batch_latency: Thời gian tối đa (giây) một frame mới chờ để được gom batch
+            max_frame_age: Frame cũ hơn (giây) coi như camera không hoạt động
+            min_batch_interval: Khoảng cách tối thiểu giữa 2 batch (0 = chạy ngay khi đủ điều kiện)
+            idle_poll_interval: Chu kỳ kiểm tra khi ring không có event báo frame mới
+        """
+        self.frame_ring = frame_ring
+        self.max_batch_latency = max_batch_latency
+        self.max_frame_age = max_frame_age
+        self.min_batch_interval = min_batch_interval
+        self.idle_poll_interval = idle_poll_interval
+        # frame_seq đã inference gần nhất theo camera
+        self.last_seq = {cam_name: 0 for cam_name in frame_ring.camera_names}
+        # Thời điểm phát hiện frame mới đầu tiên chưa được inference
+        self.first_pending_time = None
+        self.last_batch_time = 0.0
+
+    def _scan(self, now):
+        """Trả về (camera có frame mới, số camera đang hoạt động)"""
+        pending = []
+        active = 0
+        for cam_name in self.frame_ring.camera_names:
+            seq, ts, status = self.frame_ring.frame_info(cam_name)
+            if seq == 0 or status != "ok" or now - ts >= self.max_frame_age:
+                continue
+            active += 1
+            if seq > self.last_seq[cam_name]:
+                pending.append(cam_name)
+        return pending, active
+
+    def _wait(self, timeout):
+        event = self.frame_ring.new_frame_event
+        if event is None:
+            time.sleep(min(timeout, self.idle_poll_interval))
+            return
+        if event.wait(timeout if timeout is not None else self.idle_poll_interval):
+            event.clear()
+
+    def wait_for_batch(self, timeout=None):
+        """
+        Chờ đến khi có batch cần inference
+
+        Args:
+            timeout: Thời gian chờ tối đa (giây), None = chờ đến khi có batch
+
+        Returns:
+            list: Tên các camera có frame mới (rỗng nếu hết timeout)
+        """
+        give_up_at = None if timeout is None else time.time() + timeout
+        while True:
+            now = time.time()
+            pending, active = self._scan(now)
+            if pending:
+                if self.first_pending_time is None:
+                    self.first_pending_time = now
+                waited = now - self.first_pending_time
+                interval_ok = now - self.last_batch_time >= self.min_batch_interval
+                if interval_ok and (len(pending) >= active or waited >= self.max_batch_latency):
+                    self.first_pending_time = None
+                    self.last_batch_time = now
+                    return pending
+                # Chờ đến deadline batch hoặc frame mới của camera khác
+                wait_time = max(self.max_batch_latency - waited,
+                                self.min_batch_interval - (now - self.last_batch_time), 0.001)
+            else:
+                wait_time = self.idle_poll_interval
+            if give_up_at is not None:
+                if now >= give_up_at:
+                    return []
+                wait_time = min(wait_time, give_up_at - now)
+            self._wait(wait_time)
+
+    def mark_done(self, cam_name, frame_seq):
+        """Đánh dấu đã inference (hoặc bỏ qua) frame_seq của camera"""
+        if frame_seq > self.last_seq.get(cam_name, 0):
+            self.last_seq[cam_name] = frame_seq
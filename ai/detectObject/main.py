@@ -1,36 +1,82 @@
 import multiprocessing as mp
-from multiprocessing import Manager, Process
+from multiprocessing import Event, Manager, Process
 import time
 import math
 from camera_process import camera_process_worker
+from capture_scheduler import CaptureScheduler, NO_OWNER
 from display_worker import display_worker
 from ai_inference import ai_inference_worker
 from ai_display_worker import ai_display_worker
+from frame_ring import SharedFrameRing, TRANSPORT_JPEG, TRANSPORTS, slot_bytes_for
+from camera_thread import CAPTURE_GRAB, CAPTURE_MODES
 from fps_config import get_fps_config, print_fps_presets
 
 class CameraOrchestrator:
     """Orchestrator chính quản lý toàn bộ hệ thống"""
     
-    def __init__(self, camera_urls, num_processes=4, max_retry_attempts=5, use_ai=True, model_path="yolov8n.pt", target_fps=1.0):
+    def __init__(self, camera_urls, num_processes=4, max_retry_attempts=5, use_ai=True, model_path="yolov8n.pt", target_fps=1.0,
+                 ring_slots=3, ring_slot_bytes=None, transport=TRANSPORT_JPEG, frame_size=(1280, 720),
+                 capture_mode=CAPTURE_GRAB, decode_threads=None, backend_config=None, fuse_roi=False,
+                 raw_sample_every=1, rebalance_interval=30.0, imbalance_threshold=1.25):
         """
         Args:
             camera_urls: List các URL camera
             num_processes: Số process (có thể tùy chỉnh)
-            max_retry_attempts: Số lần thử kết nối lại tối đa cho mỗi camera
+            max_retry_attempts: Số lần kết nối thất bại liên tiếp trước khi báo connection_failed
             use_ai: Có sử dụng AI detection không
             model_path: Đường dẫn model YOLO .pt
             target_fps: FPS mục tiêu cho camera và AI inference (mặc định: 2.0 FPS)
+            ring_slots: Số slot shared memory cho mỗi camera
+            ring_slot_bytes: Dung lượng tối đa 1 frame trong shared memory (mặc định: tính theo transport)
+            transport: Chế độ truyền frame camera -> AI: "jpeg" (mặc định) hoặc "raw" (BGR không nén)
+            frame_size: (width, height) input model; chế độ raw resize 1 lần tại camera về kích thước này
+            capture_mode: "grab" (mặc định, chỉ retrieve frame cần publish) hoặc "read"
+            decode_threads: Số thread decoder FFmpeg mỗi camera (None = mặc định FFmpeg)
+            backend_config: Cấu hình backend inference {backend, precision, imgsz, calibration_data}
+                (None = DEFAULT_BACKEND_CONFIG: tự chọn CUDA/CPU)
+            fuse_roi: Lọc ROI trong AI inference process, publish thẳng roi_detection (không cần roi_processor.py)
+            raw_sample_every: Khi fuse_roi, publish raw_detection mỗi N frame mỗi camera (0 = tắt)
+            rebalance_interval: Chu kỳ (giây) CaptureScheduler xét chuyển camera giữa các process capture
+                theo chi phí decode đo được (None = giữ nguyên cách chia ban đầu)
+            imbalance_threshold: Chỉ chuyển camera khi process nặng nhất > tải trung bình * ngưỡng
         """
+        if transport not in TRANSPORTS:
+            raise ValueError(f"transport không hợp lệ: {transport} (chọn trong {TRANSPORTS})")
+        if capture_mode not in CAPTURE_MODES:
+            raise ValueError(f"capture_mode không hợp lệ: {capture_mode} (chọn trong {CAPTURE_MODES})")
         self.camera_urls = camera_urls
         self.num_processes = num_processes
         self.max_retry_attempts = max_retry_attempts
         self.use_ai = use_ai
         self.model_path = model_path
         self.target_fps = target_fps
+        self.transport = transport
+        self.frame_size = tuple(frame_size)
+        self.capture_mode = capture_mode
+        self.decode_threads = decode_threads
+        self.backend_config = backend_config
+        self.fuse_roi = fuse_roi
+        self.raw_sample_every = raw_sample_every
+        if ring_slot_bytes is None:
+            ring_slot_bytes = slot_bytes_for(transport, self.frame_size)
+        # Frame đi qua shared memory (seqlock ring) thay vì Manager().dict()
+        self.frame_ring = SharedFrameRing(
+            [cam_name for cam_name, _ in camera_urls],
+            num_slots=ring_slots,
+            slot_bytes=ring_slot_bytes,
+            new_frame_event=Event(),  # Đánh thức AI inference ngay khi có frame mới
+        )
         self.manager = Manager()
-        self.shared_dict = self.manager.dict()
         self.result_dict = self.manager.dict()  # Dict cho kết quả AI
         self.processes = []
+        # Thống kê decode + chủ sở hữu từng camera (shared memory) cho CaptureScheduler
+        self.decode_seconds = mp.Array('d', len(camera_urls))
+        self.owners = mp.Array('i', [NO_OWNER] * len(camera_urls))
+        self.rebalance_interval = rebalance_interval
+        self.imbalance_threshold = imbalance_threshold
+        self.scheduler = None
+        self.capture_processes = []
+        self.command_queues = []
         
     def _divide_cameras(self):
         """Chia nhóm camera cho các process"""
@@ -48,32 +94,66 @@ class CameraOrchestrator:
         
         return camera_groups
     
+    def _spawn_capture_process(self, process_idx, camera_group):
+        """Tạo và khởi động process capture process_idx với nhóm camera ban đầu camera_group"""
+        process = Process(
+            target=camera_process_worker,
+            args=(process_idx, camera_group, self.frame_ring, self.max_retry_attempts, self.target_fps,
+                  self.transport, self.frame_size, self.capture_mode, self.decode_threads),
+            kwargs={"command_queue": self.command_queues[process_idx],
+                    "decode_seconds": self.decode_seconds, "owners": self.owners}
+        )
+        process.start()
+        return process
+    
+    def _supervise_capture(self):
+        """Khởi động lại process capture đã chết với các camera scheduler đang giao cho nó"""
+        for i, process in enumerate(self.capture_processes):
+            if process.is_alive():
+                continue
+            print(f"\nProcess capture {i} đã dừng (exitcode {process.exitcode}), khởi động lại...")
+            with self.owners.get_lock():
+                for idx in range(len(self.owners)):
+                    if self.owners[idx] == i:
+                        self.owners[idx] = NO_OWNER
+            new_process = self._spawn_capture_process(i, self.scheduler.cameras_of(i))
+            self.processes[self.processes.index(process)] = new_process
+            self.capture_processes[i] = new_process
+    
     def start(self):
         """Khởi động hệ thống"""
         print("Bắt đầu khởi động hệ thống camera...")
         print(f"AI Detection: {'BẬT' if self.use_ai else 'TẮT'}")
         print(f"Target FPS: {self.target_fps}")
+        print(f"Frame transport: {self.transport} | frame_size: {self.frame_size}")
+        print(f"Capture mode: {self.capture_mode} | decode_threads: {self.decode_threads or 'auto'}")
         if self.use_ai:
-            print(f"Model YOLO: {self.model_path}")
+            print(f"Model YOLO: {self.model_path} | backend: {self.backend_config or 'mặc định'}")
+            print(f"Fuse ROI: {'BẬT' if self.fuse_roi else 'TẮT'}")
         
         # Chia nhóm camera
         camera_groups = self._divide_cameras()
         
-        # Tạo và spawn các process camera
+        self.scheduler = CaptureScheduler(
+            self.camera_urls, camera_groups, self.decode_seconds, self.owners,
+            rebalance_interval=self.rebalance_interval, imbalance_threshold=self.imbalance_threshold
+        )
+        
+        # Tạo và spawn các process camera (mỗi process 1 hàng đợi lệnh start/stop camera từ scheduler)
         for i, camera_group in enumerate(camera_groups):
-            process = Process(
-                target=camera_process_worker,
-                args=(i, camera_group, self.shared_dict, self.max_retry_attempts, self.target_fps)
-            )
+            self.command_queues.append(mp.Queue())
+            process = self._spawn_capture_process(i, camera_group)
+            self.capture_processes.append(process)
             self.processes.append(process)
-            process.start()
         
         if self.use_ai:
-            print("Khởi động AI inference process (GPU, batch tất cả camera)...")
-            # Một tiến trình AI duy nhất xử lý batch tất cả camera để tận dụng GPU tốt hơn
+            print("Khởi động AI inference process (batch tất cả camera)...")
+            # Một tiến trình AI duy nhất xử lý batch tất cả camera để tận dụng GPU/CPU tốt hơn
             ai_process = Process(
                 target=ai_inference_worker,
-                args=(self.shared_dict, self.result_dict, self.model_path, self.target_fps)
+                args=(self.frame_ring, self.result_dict, self.model_path, self.target_fps, self.frame_size),
+                kwargs={"backend_config": self.backend_config, "fuse_roi": self.fuse_roi,
+                        "raw_sample_every": self.raw_sample_every}
             )
             self.processes.append(ai_process)
             ai_process.start()
@@ -90,7 +170,7 @@ class CameraOrchestrator:
             # Display worker thường (hiển thị frame gốc)
             display_process = Process(
                 target=display_worker,
-                args=(self.shared_dict,)
+                args=(self.frame_ring,)
             )
             self.processes.append(display_process)
             display_process.start()
@@ -104,8 +184,12 @@ class CameraOrchestrator:
             while True:
                 time.sleep(1)
                 
+                # Giám sát process capture + cân bằng camera theo chi phí decode
+                self._supervise_capture()
+                self.scheduler.tick(lambda process_idx, command: self.command_queues[process_idx].put(command))
+                
                 # Hiển thị thống kê (optional)
-                active_cameras = len(self.shared_dict)
+                active_cameras = len(self.frame_ring)
                 print(f"Camera hoạt động: {active_cameras}", end='\r')
                 
         except KeyboardInterrupt:
@@ -120,6 +204,10 @@ class CameraOrchestrator:
         for process in self.processes:
             process.join(timeout=5.0)
         
+        # Giải phóng shared memory sau khi mọi process đã dừng
+        self.frame_ring.close()
+        self.frame_ring.unlink()
+        
         print("Đã dừng hệ thống")
 
 def main():
@@ -164,9 +252,22 @@ def main():
     
     # Tạo orchestrator với số process tùy chỉnh
     NUM_PROCESSES = 5  # Có thể thay đổi số này
-    MAX_RETRY_ATTEMPTS = 5  # Số lần thử kết nối lại tối đa
+    MAX_RETRY_ATTEMPTS = 5  # Số lần kết nối thất bại liên tiếp trước khi báo connection_failed (vẫn thử lại mỗi 5 phút)
     USE_AI = True  # Bật/tắt AI detection
     MODEL_PATH = "weights/model-hanam_0506.pt"  # Đường dẫn model YOLO
+    FRAME_TRANSPORT = "jpeg"  # "jpeg" hoặc "raw" (bỏ encode/decode JPEG, tốn RAM shared memory hơn)
+    FRAME_SIZE = (1280, 720)  # Kích thước frame đưa vào model
+    CAPTURE_MODE = "grab"  # "grab": chỉ retrieve frame cần dùng | "read": đọc mọi frame
+    DECODE_THREADS = 1  # Thread decoder FFmpeg mỗi camera (None = FFmpeg tự chọn theo số core)
+    # Backend inference: "auto" (CUDA nếu có, ngược lại CPU), "torch_cuda", "torch_cpu", "onnx", "openvino"
+    # precision: "fp32" | "fp16" (torch_cuda, openvino) | "int8" (onnx, openvino + calibration_data)
+    BACKEND_CONFIG = {"backend": "auto", "precision": "fp32"}
+    # True: lọc ROI ngay trong AI process và publish roi_detection (khi đó không chạy roi_processor.py)
+    FUSE_ROI = False
+    RAW_SAMPLE_EVERY = 10  # Khi FUSE_ROI: vẫn lưu raw_detection mỗi N frame mỗi camera (0 = không lưu)
+    # Chuyển camera giữa các process capture theo chi phí decode đo được (None = giữ cách chia ban đầu)
+    REBALANCE_INTERVAL = 30.0  # Giây giữa 2 lần xét cân bằng
+    IMBALANCE_THRESHOLD = 1.25  # Chỉ chuyển khi process nặng nhất > trung bình * ngưỡng
     
     # Cấu hình FPS - có thể thay đổi ở đây
     FPS_PRESET = "low"  # Chọn preset: "very_low", "low", "normal", "high", "very_high"
@@ -177,7 +278,13 @@ def main():
     
     print(f"Sử dụng FPS preset: {FPS_PRESET} ({TARGET_FPS} FPS)")
     
-    orchestrator = CameraOrchestrator(camera_urls, NUM_PROCESSES, MAX_RETRY_ATTEMPTS, USE_AI, MODEL_PATH, TARGET_FPS)
+    orchestrator = CameraOrchestrator(camera_urls, NUM_PROCESSES, MAX_RETRY_ATTEMPTS, USE_AI, MODEL_PATH, TARGET_FPS,
+                                      transport=FRAME_TRANSPORT, frame_size=FRAME_SIZE,
+                                      capture_mode=CAPTURE_MODE, decode_threads=DECODE_THREADS,
+                                      backend_config=BACKEND_CONFIG, fuse_roi=FUSE_ROI,
+                                      raw_sample_every=RAW_SAMPLE_EVERY,
+                                      rebalance_interval=REBALANCE_INTERVAL,
+                                      imbalance_threshold=IMBALANCE_THRESHOLD)
     
     # Khởi động và chạy
     orchestrator.start()
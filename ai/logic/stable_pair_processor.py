@@ -1,5 +1,6 @@
 import json
 import time
+from array import array
 from datetime import datetime, timezone
 from typing import Dict, Any, List, Tuple, Optional, Set
 
@@ -36,7 +37,77 @@ def is_point_in_polygon(point: Tuple[float, float], polygon: List[List[int]]) ->
     return inside
 
 
+class TimerWheel:
+    """
+    Hashed timer wheel: timers are bucketed by tick (deadline // tick) into a ring of `size` buckets,
+    so schedule() is O(1) and advance() only touches the buckets of the ticks that elapsed.
+    Deadlines further than one revolution ahead stay in their bucket until their tick comes round.
+
+    An item fires on the first advance() whose tick reaches the deadline's tick, i.e. up to one tick
+    early; callers re-check their exact condition and reschedule if it does not hold yet.
+    """
+
+    def __init__(self, tick: float = 0.1, size: int = 1024, now: Optional[float] = None) -> None:
+        self.tick = tick
+        self.size = size
+        self._buckets: List[List[Tuple[int, Any]]] = [[] for _ in range(size)]
+        self._current = int((time.time() if now is None else now) // tick)
+        self._count = 0
+
+    def __len__(self) -> int:
+        return self._count
+
+    def schedule(self, deadline: float, item: Any) -> None:
+        """Fire item on the first advance() in or after the tick of deadline"""
+        tick_idx = max(int(deadline // self.tick), self._current + 1)
+        self._buckets[tick_idx % self.size].append((tick_idx, item))
+        self._count += 1
+
+    def advance(self, now: float) -> List[Any]:
+        """Return items whose deadline tick is <= the tick of now (in tick order)"""
+        target = int(now // self.tick)
+        if target <= self._current or not self._count:
+            self._current = max(self._current, target)
+            return []
+        due: List[Any] = []
+        # Beyond one revolution every bucket is visited once
+        for tick_idx in range(self._current + 1, min(target, self._current + self.size) + 1):
+            bucket = self._buckets[tick_idx % self.size]
+            if not bucket:
+                continue
+            keep = []
+            for entry in bucket:
+                if entry[0] <= target:
+                    due.append(entry[1])
+                else:
+                    keep.append(entry)
+            self._buckets[tick_idx % self.size] = keep
+        self._count -= len(due)
+        self._current = target
+        return due
+
+    def seconds_to_next_tick(self, now: float) -> float:
+        return max(0.0, (self._current + 1) * self.tick - now)
+
+
+# Slot status codes in StablePairProcessor.slot_status
+STATUS_UNKNOWN = -1
+STATUS_EMPTY = 0
+STATUS_SHELF = 1
+_STATUS_CODES = {"empty": STATUS_EMPTY, "shelf": STATUS_SHELF}
+_STATUS_NAMES = {STATUS_EMPTY: "empty", STATUS_SHELF: "shelf"}
+
+# Timer kinds: slot becomes stable / pair cooldown expires
+_TIMER_SLOT = 0
+_TIMER_PAIR = 1
+
+
 class StablePairProcessor:
+    # Timer wheel resolution (seconds): max delay between a slot becoming stable and pair evaluation
+    TIMER_TICK = 0.1
+    # Max seconds to wait for roi_detection when no timer is pending
+    IDLE_POLL_TIMEOUT = 1.0
+
     def __init__(self, db_path: str = "../queues.db", config_path: str = "slot_pairing_config.json",
                  stable_seconds: float = 20.0, cooldown_seconds: float = 10.0) -> None:
         self.queue = SQLiteQueue(db_path)
@@ -44,22 +115,22 @@ class StablePairProcessor:
         self.stable_seconds = stable_seconds
         self.cooldown_seconds = cooldown_seconds
 
-        # Slot state store per slot_key "cam-x:slot_number"
-        # value: {status: "shelf"|"empty", since: float(epoch_seconds)}
-        self.slot_state: Dict[str, Dict[str, Any]] = {}
-
-        # Pair blocklist to avoid spamming: pair_id -> last_published_epoch
+        # Pair blocklist to avoid spamming: pair_id -> last_published_epoch (one entry per configured pair)
         self.published_at: Dict[str, float] = {}
         
-        # Track published pairs by minute to avoid duplicates
-        # Format: {pair_id: {minute_key: True}} where minute_key = "YYYY-MM-DD HH:MM"
-        self.published_by_minute: Dict[str, Dict[str, bool]] = {}
+        # Minute of stable_since (UTC epoch // 60) of each pair's last publish, to avoid duplicates.
+        # A pair's stable_since never decreases (slot "since" only moves forward), so "already
+        # published in this minute" only ever has to look at the last published minute: one int
+        # per pair instead of a minute history that grows for as long as the process runs.
+        self.published_minute: Dict[str, int] = {}
 
         # Pairing config
         self.qr_to_slot: Dict[int, Tuple[str, int]] = {}  # qr_code -> (camera_id, slot_number)
         self.pairs: List[Tuple[int, List[int]]] = []      # (start_qr, [end_qrs])
 
         self._load_pairing_config()
+        self._build_index()
+        self.timers = TimerWheel(self.TIMER_TICK)
 
     def _load_pairing_config(self) -> None:
         with open(self.config_path, "r", encoding="utf-8") as f:
@@ -83,13 +154,67 @@ class StablePairProcessor:
                 end_qrs = [int(end_qrs_raw)]
             self.pairs.append((start_qr, end_qrs))
 
+    def _build_index(self) -> None:
+        """
+        Integer ids for every slot used by a pair and (start, end) edges between them.
+
+        Slot state lives in arrays indexed by slot id; cameras without paired slots are skipped
+        entirely when roi_detection arrives.
+        """
+        self.slot_keys: List[Tuple[str, int]] = []               # slot id -> (camera_id, slot_number)
+        self.camera_slots: Dict[str, Dict[int, int]] = {}        # camera_id -> {slot_number: slot id}
+        # Edges (one per distinct start_qr -> end_qr with both QR codes configured)
+        self.edge_qrs: List[Tuple[int, int]] = []
+        self.edge_slots: List[Tuple[int, int]] = []              # (start slot id, end slot id)
+        self.edges_by_start: List[List[int]] = []                # slot id -> edges where slot is the start
+        self.edges_by_end: List[List[int]] = []                  # slot id -> edges where slot is an end
+
+        def slot_id(cam_slot: Tuple[str, int]) -> int:
+            camera_id, slot_number = cam_slot
+            slots = self.camera_slots.setdefault(camera_id, {})
+            if slot_number not in slots:
+                slots[slot_number] = len(self.slot_keys)
+                self.slot_keys.append(cam_slot)
+                self.edges_by_start.append([])
+                self.edges_by_end.append([])
+            return slots[slot_number]
+
+        seen: Set[Tuple[int, int]] = set()
+        for start_qr, end_qrs in self.pairs:
+            start_cam_slot = self.qr_to_slot.get(start_qr)
+            if not start_cam_slot:
+                continue
+            for end_qr in end_qrs:
+                end_cam_slot = self.qr_to_slot.get(end_qr)
+                if not end_cam_slot or (start_qr, end_qr) in seen:
+                    continue
+                seen.add((start_qr, end_qr))
+                start_id, end_id = slot_id(start_cam_slot), slot_id(end_cam_slot)
+                edge = len(self.edge_qrs)
+                self.edge_qrs.append((start_qr, end_qr))
+                self.edge_slots.append((start_id, end_id))
+                self.edges_by_start[start_id].append(edge)
+                self.edges_by_end[end_id].append(edge)
+
+        num_slots = len(self.slot_keys)
+        # Compact typed arrays (fast scalar access, unlike numpy scalars)
+        self.slot_status = array("b", [STATUS_UNKNOWN]) * num_slots
+        self.slot_since = array("d", [0.0]) * num_slots
+
+    @property
+    def slot_state(self) -> Dict[str, Dict[str, Any]]:
+        """Debug view of slot state: {"cam-x:slot_number": {status, since}}"""
+        return {
+            f"{camera_id}:{slot_number}": {"status": _STATUS_NAMES[status], "since": since}
+            for (camera_id, slot_number), status, since in zip(self.slot_keys, self.slot_status, self.slot_since)
+            if status != STATUS_UNKNOWN
+        }
+
     # No ROI polygons dependency anymore
 
     def _iter_roi_detections(self) -> List[str]:
         """Return list of camera_ids that have roi_detection data."""
-        with self.queue._connect() as conn:
-            cur = conn.execute("SELECT DISTINCT key FROM messages WHERE topic = 'roi_detection' ORDER BY key")
-            return [row[0] for row in cur.fetchall()]
+        return self.queue.list_keys("roi_detection")
 
     def _compute_slot_statuses(self, camera_id: str, roi_detections: List[Dict[str, Any]]) -> Dict[int, str]:
         """
@@ -111,64 +236,72 @@ class StablePairProcessor:
                 status_by_slot[int(slot_num)] = "empty"
         return status_by_slot
 
-    def _update_slot_state(self, camera_id: str, status_by_slot: Dict[int, str]) -> None:
-        now = time.time()
-        for slot_num, status in status_by_slot.items():
-            key = f"{camera_id}:{slot_num}"
-            prev = self.slot_state.get(key)
-            if prev is None:
-                self.slot_state[key] = {"status": status, "since": now}
-            else:
-                if prev["status"] != status:
-                    self.slot_state[key] = {"status": status, "since": now}
-                # else keep since
-
-    def _is_slot_stable(self, camera_id: str, slot_number: int, expect_status: str) -> Tuple[bool, Optional[float]]:
-        key = f"{camera_id}:{slot_number}"
-        st = self.slot_state.get(key)
-        if not st:
-            return False, None
-        if st["status"] != expect_status:
+    def _update_slot_state(self, slots: Dict[int, int], roi_detections: List[Dict[str, Any]], now: float) -> None:
+        """
+        Same rule as _compute_slot_statuses (shelf wins over empty within a message), restricted to
+        the camera's paired slots; status changes schedule a "becomes stable" timer.
+        """
+        codes: Dict[int, int] = {}
+        for det in roi_detections:
+            sid = slots.get(det.get("slot_number"))
+            if sid is None:
+                continue
+            cls = det.get("class_name")
+            if cls == "shelf":
+                codes[sid] = STATUS_SHELF
+            elif cls == "empty" and sid not in codes:
+                codes[sid] = STATUS_EMPTY
+        status, since = self.slot_status, self.slot_since
+        for sid, code in codes.items():
+            if status[sid] != code:
+                status[sid] = code
+                since[sid] = now
+                # Token = since: the timer is stale if the slot changed again before it fired
+                self.timers.schedule(now + self.stable_seconds, (_TIMER_SLOT, sid, now))
+            # else keep since
+
+    def _stable_since(self, sid: int, expect_code: int, now: float) -> Optional[float]:
+        if self.slot_status[sid] != expect_code:
+            return None
+        since = self.slot_since[sid]
+        return since if now - since >= self.stable_seconds else None
+
+    def _is_slot_stable(self, camera_id: str, slot_number: int, expect_status: str,
+                        now: Optional[float] = None) -> Tuple[bool, Optional[float]]:
+        sid = self.camera_slots.get(camera_id, {}).get(slot_number)
+        if sid is None:
             return False, None
-        now = time.time()
-        stable = (now - st["since"]) >= self.stable_seconds
-        return stable, st["since"] if stable else None
-
-    def _get_minute_key(self, epoch_seconds: float) -> str:
-        """Convert epoch seconds to minute key format: YYYY-MM-DD HH:MM"""
-        dt = datetime.utcfromtimestamp(epoch_seconds)
-        return dt.strftime("%Y-%m-%d %H:%M")
+        since = self._stable_since(sid, _STATUS_CODES[expect_status], time.time() if now is None else now)
+        return since is not None, since
+
+    @staticmethod
+    def _minute_index(epoch_seconds: float) -> int:
+        """UTC minute of epoch seconds (same bucket as "YYYY-MM-DD HH:MM")"""
+        return int(epoch_seconds // 60)
     
     def _is_already_published_this_minute(self, pair_id: str, stable_since_epoch: float) -> bool:
         """Check if this pair was already published in the same minute"""
-        minute_key = self._get_minute_key(stable_since_epoch)
-        
-        if pair_id not in self.published_by_minute:
-            self.published_by_minute[pair_id] = {}
-        
-        return minute_key in self.published_by_minute[pair_id]
+        return self.published_minute.get(pair_id) == self._minute_index(stable_since_epoch)
     
     def _mark_published_this_minute(self, pair_id: str, stable_since_epoch: float) -> None:
         """Mark this pair as published for this minute"""
-        minute_key = self._get_minute_key(stable_since_epoch)
-        
-        if pair_id not in self.published_by_minute:
-            self.published_by_minute[pair_id] = {}
-        
-        self.published_by_minute[pair_id][minute_key] = True
+        self.published_minute[pair_id] = self._minute_index(stable_since_epoch)
 
-    def _maybe_publish_pair(self, start_qr: int, end_qr: int, stable_since_epoch: float) -> None:
+    def _maybe_publish_pair(self, start_qr: int, end_qr: int, stable_since_epoch: float,
+                            now: Optional[float] = None) -> Optional[float]:
+        """Publish the pair unless deduplicated; returns the retry time when held back by cooldown"""
         pair_id = f"{start_qr} -> {end_qr}"
         
         # Check if already published in the same minute
         if self._is_already_published_this_minute(pair_id, stable_since_epoch):
-            return
+            return None
         
         # Check cooldown period
         last_pub = self.published_at.get(pair_id, 0.0)
-        now = time.time()
+        if now is None:
+            now = time.time()
         if now - last_pub < self.cooldown_seconds:
-            return
+            return last_pub + self.cooldown_seconds
         
         # Mark as published for this minute and update cooldown
         self._mark_published_this_minute(pair_id, stable_since_epoch)
@@ -182,63 +315,66 @@ class StablePairProcessor:
         }
         # Use pair_id as key for convenience
         self.queue.publish("stable_pairs", pair_id, payload)
+        return None
+
+    def _evaluate_edge(self, edge: int, now: float) -> None:
+        start_id, end_id = self.edge_slots[edge]
+        start_since = self._stable_since(start_id, STATUS_SHELF, now)
+        if start_since is None:
+            return
+        end_since = self._stable_since(end_id, STATUS_EMPTY, now)
+        if end_since is None:
+            return
+        start_qr, end_qr = self.edge_qrs[edge]
+        retry_at = self._maybe_publish_pair(start_qr, end_qr, max(start_since, end_since), now)
+        if retry_at is not None:
+            self.timers.schedule(retry_at, (_TIMER_PAIR, edge, None))
+
+    def process_rows(self, rows: List[Dict[str, Any]], now: Optional[float] = None) -> None:
+        """Apply roi_detection rows ({key, payload}) to slot state"""
+        if now is None:
+            now = time.time()
+        for r in rows:
+            # Cameras without paired slots cannot affect any pair
+            slots = self.camera_slots.get(r["key"])
+            if slots:
+                self._update_slot_state(slots, r["payload"].get("roi_detections", []), now)
+
+    def process_timers(self, now: Optional[float] = None) -> None:
+        """Evaluate only the pairs touching slots that just became stable (or whose cooldown ended)"""
+        if now is None:
+            now = time.time()
+        for kind, index, token in self.timers.advance(now):
+            if kind == _TIMER_PAIR:
+                self._evaluate_edge(index, now)
+                continue
+            if self.slot_since[index] != token:
+                continue  # slot changed again before becoming stable
+            if now - token < self.stable_seconds:
+                # Fired within the deadline's tick but before the deadline: check again next tick
+                self.timers.schedule(token + self.stable_seconds, (kind, index, token))
+                continue
+            status = self.slot_status[index]
+            edges = self.edges_by_start[index] if status == STATUS_SHELF else self.edges_by_end[index]
+            for edge in edges:
+                self._evaluate_edge(edge, now)
 
     def run(self) -> None:
-        # Prepare roi_detection trackers
-        roi_det_cameras = self._iter_roi_detections()
-        last_roi_det_id: Dict[str, int] = {}
-        for cam in roi_det_cameras:
-            row = self.queue.get_latest_row("roi_detection", cam)
-            if row:
-                last_roi_det_id[cam] = row["id"]
+        # Single cursor over roi_detection (all cameras), starting after the latest existing message
+        subscription = self.queue.subscribe("roi_detection", start="latest", batch_size=200)
 
-        print(f"StablePairProcessor started. Watching cameras: {roi_det_cameras}")
+        print(f"StablePairProcessor started. Watching roi_detection from id={subscription.cursor} "
+              f"({len(self.edge_qrs)} pairs, {len(self.slot_keys)} slots)")
 
         while True:
             try:
-                # ensure we cover any new roi_detection cameras
-                for cam in self._iter_roi_detections():
-                    if cam not in last_roi_det_id:
-                        row = self.queue.get_latest_row("roi_detection", cam)
-                        if row:
-                            last_roi_det_id[cam] = row["id"]
-
-                # read new roi_detection per camera
-                for cam, last_id in list(last_roi_det_id.items()):
-                    rows = self.queue.get_after_id("roi_detection", cam, last_id, limit=20)
-                    for r in rows:
-                        payload = r["payload"]
-                        last_roi_det_id[cam] = r["id"]
-                        roi_detections = payload.get("roi_detections", [])
-
-                        # compute statuses per slot for this camera
-                        status_by_slot = self._compute_slot_statuses(cam, roi_detections)
-                        if status_by_slot:
-                            self._update_slot_state(cam, status_by_slot)
-
-                # evaluate pairs
-                for start_qr, end_qrs in self.pairs:
-                    start_cam_slot = self.qr_to_slot.get(start_qr)
-                    if not start_cam_slot:
-                        continue
-                    start_cam, start_slot = start_cam_slot
-                    start_ok, start_since = self._is_slot_stable(start_cam, start_slot, expect_status="shelf")
-                    if not start_ok or start_since is None:
-                        continue
-
-                    for end_qr in end_qrs:
-                        end_cam_slot = self.qr_to_slot.get(end_qr)
-                        if not end_cam_slot:
-                            continue
-                        end_cam, end_slot = end_cam_slot
-                        end_ok, end_since = self._is_slot_stable(end_cam, end_slot, expect_status="empty")
-                        if not end_ok or end_since is None:
-                            continue
-
-                        stable_since_epoch = max(start_since, end_since)
-                        self._maybe_publish_pair(start_qr, end_qr, stable_since_epoch)
-
-                time.sleep(0.2)
+                # Wake on new roi_detection rows, or at the next timer tick while timers are pending
+                now = time.time()
+                timeout = self.timers.seconds_to_next_tick(now) if len(self.timers) else self.IDLE_POLL_TIMEOUT
+                rows = subscription.poll(timeout=timeout)
+                now = time.time()
+                self.process_rows(rows, now)
+                self.process_timers(now)
 
             except KeyboardInterrupt:
                 print("Stopping StablePairProcessor...")
@@ -247,6 +383,9 @@ class StablePairProcessor:
                 print(f"Error in StablePairProcessor loop: {e}")
                 time.sleep(1.0)
 
+        # Close pooled SQLite connections on shutdown
+        self.queue.close()
+
 
 def main() -> int:
     proc = StablePairProcessor()
@@ -9,12 +9,7 @@ from queue_store import SQLiteQueue
 
 
 def list_keys(queue: SQLiteQueue, topic: str) -> List[str]:
-    with queue._connect() as conn:
-        cur = conn.execute(
-            "SELECT DISTINCT key FROM messages WHERE topic = ? ORDER BY key",
-            (topic,),
-        )
-        return [row[0] for row in cur.fetchall()]
+    return queue.list_keys(topic)
 
 
 def main() -> int:
@@ -45,9 +40,8 @@ def main() -> int:
                     if row:
                         last_id_by_key[key] = row["id"]
 
-            # fetch new rows per key
-            for key, last_id in list(last_id_by_key.items()):
-                rows = queue.get_after_id(topic, key, last_id, limit=100)
+            # fetch new rows for all keys in one query
+            for key, rows in queue.get_after_ids(topic, last_id_by_key, limit=100).items():
                 for r in rows:
                     payload = r["payload"]
                     last_id_by_key[key] = r["id"]
@@ -1,94 +1,66 @@
 import os
 import sys
 import time
-import json
-import threading
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, Optional, Set
 
-import requests
+import httpx
 
 # Allow importing queue_store from project root
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from queue_store import SQLiteQueue
+from queue_store import SequenceAllocator, SQLiteQueue, Subscription
 
 
 API_URL = "http://192.168.1.169:7000/ics/taskOrder/addTask"
 DB_PATH = "../queues.db"  # relative to this script folder
+# Legacy counter file: only read once to seed the queues.db sequence above its last value
 ORDER_ID_FILE = os.path.join(os.path.dirname(__file__), "order_id.txt")
+ORDER_SEQUENCE = "ics_order_id"
+ORDER_ID_BLOCK = 100
 TOPIC = "stable_pairs"
-
-
-def ensure_dirs() -> None:
-    os.makedirs(os.path.dirname(ORDER_ID_FILE), exist_ok=True)
-
-
-def get_next_order_id() -> int:
-    """Persistent, monotonically increasing integer orderId."""
-    ensure_dirs()
-    if not os.path.exists(ORDER_ID_FILE):
-        with open(ORDER_ID_FILE, "w", encoding="utf-8") as f:
-            f.write("1")
-        return 1
+# Consumer group: offset + per-message leases live in queues.db, so a restart resumes where it stopped
+GROUP = "post_api"
+
+# Dispatcher: at most MAX_IN_FLIGHT POSTs at once over a keep-alive pool, each attempt bounded by
+# REQUEST_DEADLINE seconds; failed attempts back off 1s, 2s, ... (capped) without holding a slot.
+MAX_IN_FLIGHT = 8
+REQUEST_DEADLINE = 10.0
+MAX_ATTEMPTS = 3
+RETRY_BACKOFF_BASE = 1.0
+RETRY_BACKOFF_MAX = 8.0
+UNLOCK_DELAY_SECONDS = 60
+
+# Delivery: a pair not acked within VISIBILITY_TIMEOUT (crash / hang) is redelivered. While a pair is held
+# here (waiting for a slot, POSTing, backing off) its lease is renewed every VISIBILITY_TIMEOUT / 3, so only
+# a dead or stuck dispatcher loses it. A delivery that fails all attempts is retried after
+# REDELIVERY_DELAY, up to MAX_DELIVERIES times, then goes to the stable_pairs_dlq topic.
+VISIBILITY_TIMEOUT = 120.0
+MAX_DELIVERIES = 3
+REDELIVERY_DELAY = 30.0
+
+
+def legacy_order_id_floor() -> int:
+    """First orderId after the value stored in the old order_id.txt (1 if there is none)."""
     try:
-        with open(ORDER_ID_FILE, "r+", encoding="utf-8") as f:
-            content = f.read().strip() or "0"
-            current = int(content)
-            next_id = current + 1
-            f.seek(0)
-            f.write(str(next_id))
-            f.truncate()
-            return next_id
-    except Exception:
-        # Fallback: reset to 1 if file corrupted
-        with open(ORDER_ID_FILE, "w", encoding="utf-8") as f:
-            f.write("1")
+        with open(ORDER_ID_FILE, "r", encoding="utf-8") as f:
+            return int(f.read().strip() or "0") + 1
+    except FileNotFoundError:
+        return 1
+    except (OSError, ValueError) as e:
+        print(f"[WARN] Cannot read {ORDER_ID_FILE} ({e}); orderId continues from queues.db only")
         return 1
 
 
-def list_keys(queue: SQLiteQueue, topic: str) -> List[str]:
-    with queue._connect() as conn:
-        cur = conn.execute(
-            "SELECT DISTINCT key FROM messages WHERE topic = ? ORDER BY key",
-            (topic,),
-        )
-        return [row[0] for row in cur.fetchall()]
-
-
-def get_latest_topic_row(queue: SQLiteQueue, topic: str) -> Optional[Dict[str, Any]]:
-    with queue._connect() as conn:
-        cur = conn.execute(
-            """
-            SELECT id, key, payload, created_at FROM messages
-            WHERE topic = ?
-            ORDER BY id DESC
-            LIMIT 1
-            """,
-            (topic,),
-        )
-        row = cur.fetchone()
-        if not row:
-            return None
-        return {"id": row[0], "key": row[1], "payload": json.loads(row[2]), "created_at": row[3]}
-
-
-def get_after_id_topic(queue: SQLiteQueue, topic: str, after_id: int, limit: int = 100) -> List[Dict[str, Any]]:
-    """Fetch rows for a topic with id > after_id, ordered by id ASC regardless of key."""
-    with queue._connect() as conn:
-        cur = conn.execute(
-            """
-            SELECT id, key, payload, created_at FROM messages
-            WHERE topic = ? AND id > ?
-            ORDER BY id ASC
-            LIMIT ?
-            """,
-            (topic, after_id, limit),
-        )
-        rows = cur.fetchall()
-        result: List[Dict[str, Any]] = []
-        for r in rows:
-            result.append({"id": r[0], "key": r[1], "payload": json.loads(r[2]), "created_at": r[3]})
-        return result
+def make_order_allocator(queue: SQLiteQueue) -> SequenceAllocator:
+    """
+    Persistent, monotonically increasing integer orderId kept in queues.db (table sequences).
+    IDs are reserved ORDER_ID_BLOCK at a time and handed out from memory; concurrent dispatchers
+    get disjoint blocks, and a restart continues after the last reserved block.
+    """
+    return SequenceAllocator(queue, ORDER_SEQUENCE, ORDER_ID_BLOCK, floor=legacy_order_id_floor())
 
 
 def build_payload(pair_id: str, start_slot: str, end_slot: str, order_id: int) -> Dict[str, Any]:
@@ -107,110 +79,282 @@ def build_payload(pair_id: str, start_slot: str, end_slot: str, order_id: int) -
 
 def send_unlock_after_delay(queue: SQLiteQueue, pair_id: str, start_slot: str, delay_seconds: int = 60) -> None:
     """
-    Gửi unlock message vào queue sau delay_seconds giây
-    
+    Hẹn gửi unlock message vào queue sau delay_seconds giây
+
+    Message được lưu ngay trong queues.db với deliver_at (bảng scheduled): không tốn thread chờ,
+    và vẫn được giao nếu postAPI restart trước khi đến hạn.
+
     Args:
         queue: SQLiteQueue instance
         pair_id: ID của pair
         start_slot: QR code của ô start (dạng string)
         delay_seconds: Thời gian delay (mặc định 60s = 1 phút)
     """
-    def _delayed_unlock():
-        time.sleep(delay_seconds)
-        try:
-            unlock_payload = {
-                "pair_id": pair_id,
-                "start_slot": start_slot,
-                "reason": "post_failed_after_retries",
-                "timestamp": datetime.now().isoformat()
-            }
-            queue.publish("unlock_start_slot", start_slot, unlock_payload)
-            print(f"[UNLOCK_SCHEDULED] Đã gửi unlock message cho start_slot={start_slot} sau {delay_seconds}s")
-        except Exception as e:
-            print(f"[ERR] Lỗi khi gửi unlock message: {e}")
-    
-    # Tạo thread để delay và gửi unlock
-    thread = threading.Thread(target=_delayed_unlock, daemon=True)
-    thread.start()
-
-
-def send_post(payload: Dict[str, Any]) -> bool:
-    headers = {"Content-Type": "application/json"}
+    deliver_at = time.time() + delay_seconds
     try:
-        resp = requests.post(API_URL, headers=headers, data=json.dumps(payload), timeout=10)
-        status_ok = (200 <= resp.status_code < 300)
+        unlock_payload = {
+            "pair_id": pair_id,
+            "start_slot": start_slot,
+            "reason": "post_failed_after_retries",
+            "timestamp": datetime.fromtimestamp(deliver_at).isoformat()
+        }
+        queue.publish("unlock_start_slot", start_slot, unlock_payload, deliver_at=deliver_at)
+        print(f"[UNLOCK_SCHEDULED] Đã hẹn unlock message cho start_slot={start_slot} sau {delay_seconds}s")
+    except Exception as e:
+        print(f"[ERR] Lỗi khi gửi unlock message: {e}")
+
+
+def check_response(payload: Dict[str, Any], status_code: int, body: Any) -> bool:
+    """Log the ICS response and tell whether the order was accepted."""
+    if 200 <= status_code < 300:
+        # If API has code=1000 convention, consider it success; else accept 2xx
+        code = body.get("code") if isinstance(body, dict) else None
+        # if code is None or code == 1000:
+        if code is None or code == 2009:
+            print(f"[OK] POST success | orderId={payload['orderId']} | taskPath={payload['taskOrderDetail'][0]['taskPath']} | resp={body}")
+            return True
+        print(f"[WARN] POST 2xx but code={code} | resp={body}")
+        return False
+    print(f"[ERR] HTTP {status_code} | orderId={payload['orderId']} | resp={body}")
+    return False
+
+
+async def send_post(client: httpx.AsyncClient, payload: Dict[str, Any], api_url: str = API_URL,
+                    deadline: float = REQUEST_DEADLINE) -> bool:
+    """One POST attempt; deadline covers connect + send + response, not just each socket op."""
+    try:
+        resp = await asyncio.wait_for(client.post(api_url, json=payload), deadline)
         try:
             body = resp.json()
         except Exception:
             body = {"raw": resp.text}
+        return check_response(payload, resp.status_code, body)
+    except asyncio.TimeoutError:
+        print(f"[ERR] POST deadline {deadline}s exceeded | orderId={payload['orderId']}")
+        return False
+    except Exception as e:
+        print(f"[ERR] POST exception: {e!r}")
+        return False
+
+
+def make_client(max_in_flight: int = MAX_IN_FLIGHT, deadline: float = REQUEST_DEADLINE) -> httpx.AsyncClient:
+    """Keep-alive pool sized to the concurrency limit so connections to ICS are reused."""
+    return httpx.AsyncClient(
+        headers={"Content-Type": "application/json"},
+        timeout=httpx.Timeout(deadline),
+        limits=httpx.Limits(max_connections=max_in_flight, max_keepalive_connections=max_in_flight),
+    )
+
+
+class PairDispatcher:
+    """
+    Sends stable pairs to ICS concurrently: each pair is its own task, so a slow or failing
+    order (retries, backoff) no longer delays the ones behind it.
+
+    Rows come from a leased Subscription (at-least-once): a pair is acked only after ICS accepted it,
+    redelivered (nack) after a failed delivery, and dead-lettered after max_deliveries. The orderId is
+    stored with the lease before the first POST, so a redelivered pair is re-sent with the same orderId.
 
-        if status_ok:
-            # If API has code=1000 convention, consider it success; else accept 2xx
-            code = body.get("code") if isinstance(body, dict) else None
-            # if code is None or code == 1000:
-            if code is None or code == 2009:
-                print(f"[OK] POST success | orderId={payload['orderId']} | taskPath={payload['taskOrderDetail'][0]['taskPath']} | resp={body}")
-                return True
-            else:
-                print(f"[WARN] POST 2xx but code={code} | resp={body}")
-                return False
-        else:
-            print(f"[ERR] HTTP {resp.status_code} | orderId={payload['orderId']} | resp={body}")
+    Leases are renewed while a pair is held locally, and a redelivery of a pair that still has a task here
+    is folded into that task, so a backlog larger than max_in_flight is never POSTed twice. ack/nack/
+    dead_letter are fenced by the delivery count: if the pair was redelivered to another consumer after
+    all, this task's result is dropped.
+
+    queues.db calls block (SQLiteQueue._lock, BEGIN IMMEDIATE, fsync) and must never run on the event loop,
+    where they would stall every in-flight POST while the poller or another writer holds the DB. They go
+    through db() to one dedicated thread (one SQLite connection, calls run in submission order).
+    """
+
+    def __init__(
+        self,
+        subscription: Subscription,
+        client: httpx.AsyncClient,
+        api_url: str = API_URL,
+        max_in_flight: int = MAX_IN_FLIGHT,
+        deadline: float = REQUEST_DEADLINE,
+        max_attempts: int = MAX_ATTEMPTS,
+        backoff_base: float = RETRY_BACKOFF_BASE,
+        backoff_max: float = RETRY_BACKOFF_MAX,
+        unlock_delay: int = UNLOCK_DELAY_SECONDS,
+        max_deliveries: int = MAX_DELIVERIES,
+        redelivery_delay: float = REDELIVERY_DELAY,
+        order_ids: Optional[SequenceAllocator] = None,
+        renew_interval: Optional[float] = None,
+    ) -> None:
+        self.subscription = subscription
+        self.queue = subscription.queue
+        self.client = client
+        self.order_ids = order_ids or make_order_allocator(self.queue)
+        self.api_url = api_url
+        self.deadline = deadline
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.unlock_delay = unlock_delay
+        self.max_deliveries = max_deliveries
+        self.redelivery_delay = redelivery_delay
+        if renew_interval is None:
+            renew_interval = (subscription.visibility_timeout or VISIBILITY_TIMEOUT) / 3
+        self.renew_interval = renew_interval
+        self.semaphore = asyncio.Semaphore(max_in_flight)
+        self.tasks: Set[asyncio.Task] = set()
+        # message id -> row of the task currently handling it
+        self.in_flight: Dict[int, Dict[str, Any]] = {}
+        self.db_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="post_api_db")
+
+    def db(self, fn, *args, **kwargs) -> asyncio.Future:
+        """Run a blocking queues.db call on the dispatcher's DB thread; await the result."""
+        return asyncio.get_running_loop().run_in_executor(self.db_executor, functools.partial(fn, *args, **kwargs))
+
+    def submit(self, row: Dict[str, Any]) -> Optional[asyncio.Task]:
+        held = self.in_flight.get(row["id"])
+        if held is not None:
+            # The lease expired while the pair was still queued here and poll() redelivered it:
+            # the running task takes over the new lease instead of starting a second POST
+            held["deliveries"] = row["deliveries"]
+            return None
+        # Validation and the orderId are handled on the DB thread (reserving an orderId block fsyncs).
+        # Queued right now, in stable_pairs order, so orderIds still follow that order.
+        prepared = self.db(self.prepare, row)
+        self.in_flight[row["id"]] = row
+        task = asyncio.create_task(self.dispatch(row, prepared))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+        task.add_done_callback(lambda _, message_id=row["id"]: self.in_flight.pop(message_id, None))
+        return task
+
+    def prepare(self, row: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        Runs on the DB thread: validate the pair and fix its orderId.
+
+        A new orderId is allocated only for a valid pair whose lease is still ours, and is stored with the
+        lease before the first POST; a redelivered pair keeps the orderId saved with its lease.
+
+        Returns:
+            dict | None: ICS request body, or None if the pair must not be POSTed
+        """
+        payload = row["payload"]
+        pair_id = payload.get("pair_id", row.get("key", ""))
+        start_slot = str(payload.get("start_slot", ""))
+        end_slot = str(payload.get("end_slot", ""))
+        if not start_slot or not end_slot:
+            print(f"[SKIP] Invalid pair payload: {payload}")
+            self.subscription.dead_letter(row, "invalid_payload")
+            return None
+
+        order_id = (row.get("state") or {}).get("order_id")
+        if order_id is None:
+            if not self.subscription.extend_lease(row):
+                self.stale(pair_id, "POST")
+                return None
+            order_id = self.order_ids.allocate()
+            self.subscription.extend_lease(row, state={"order_id": order_id})
+        return build_payload(pair_id, start_slot, end_slot, order_id)
+
+    def backoff(self, attempt: int) -> float:
+        return min(self.backoff_max, self.backoff_base * (2 ** attempt))
+
+    async def keep_lease(self, row: Dict[str, Any]) -> None:
+        """Renew the lease every renew_interval while the pair waits for a slot, is POSTed or backs off."""
+        while True:
+            await asyncio.sleep(self.renew_interval)
+            if not await self.db(self.subscription.extend_lease, row):
+                return
+
+    async def dispatch(self, row: Dict[str, Any], prepared: asyncio.Future) -> bool:
+        body = await prepared
+        if body is None:
             return False
-    except Exception as e:
-        print(f"[ERR] POST exception: {e}")
+        payload = row["payload"]
+        pair_id = payload.get("pair_id", row.get("key", ""))
+        renewer = asyncio.create_task(self.keep_lease(row))
+        try:
+            return await self.deliver(row, pair_id, str(payload["start_slot"]), body)
+        finally:
+            renewer.cancel()
+
+    @staticmethod
+    def stale(pair_id: str, action: str) -> bool:
+        print(f"[STALE] Lease lost (pair redelivered to another consumer) | pair_id={pair_id} | {action} dropped")
         return False
 
+    async def deliver(self, row: Dict[str, Any], pair_id: str, start_slot: str, body: Dict[str, Any]) -> bool:
+        for attempt in range(self.max_attempts):
+            async with self.semaphore:
+                # Renew right before POSTing; a lost lease means another consumer owns the pair now
+                if not await self.db(self.subscription.extend_lease, row):
+                    return self.stale(pair_id, "POST")
+                if await send_post(self.client, body, self.api_url, self.deadline):
+                    if not await self.db(self.subscription.ack, row):
+                        self.stale(pair_id, "ack")
+                    return True
+            if attempt + 1 < self.max_attempts:
+                await asyncio.sleep(self.backoff(attempt))
+
+        deliveries = row.get("deliveries", 1)
+        if deliveries < self.max_deliveries:
+            print(f"[RETRY] Could not POST after retries | pair_id={pair_id} | "
+                  f"redeliver in {self.redelivery_delay}s (delivery {deliveries}/{self.max_deliveries})")
+            if not await self.db(self.subscription.nack, row, self.redelivery_delay):
+                return self.stale(pair_id, "nack")
+            return False
+        print(f"[FAIL] Could not POST after {deliveries} deliveries | pair_id={pair_id} -> {TOPIC}_dlq")
+        if not await self.db(self.subscription.dead_letter, row, "post_failed_after_retries"):
+            return self.stale(pair_id, "dead letter")
+        # Gửi unlock message sau 1 phút
+        print(f"[UNLOCK_SCHEDULE] Sẽ unlock start_slot={start_slot} sau {self.unlock_delay} giây do POST thất bại")
+        await self.db(send_unlock_after_delay, self.queue, pair_id, start_slot, delay_seconds=self.unlock_delay)
+        return False
 
-def main() -> int:
-    print("PostAPI Runner - consuming stable_pairs and POSTing to API")
-    print(f"DB: {DB_PATH} | API: {API_URL}")
-    queue = SQLiteQueue(DB_PATH)
+    async def drain(self) -> None:
+        if self.tasks:
+            await asyncio.gather(*self.tasks, return_exceptions=True)
 
-    # Track latest global id for the topic to preserve global order
-    last_global_id: int = 0
-    latest_row = get_latest_topic_row(queue, TOPIC)
-    if latest_row:
-        last_global_id = latest_row["id"]
-        print(f"Starting from latest existing id={last_global_id} (no backlog)")
+    def close(self) -> None:
+        self.db_executor.shutdown(wait=True)
+
+
+async def run(queue: SQLiteQueue, api_url: str = API_URL) -> None:
+    # First start of the group: begin after the latest existing row (no old backlog);
+    # afterwards resume from the stored offset and redeliver unacked pairs
+    offset = queue.get_offset(GROUP, TOPIC)
+    subscription = queue.subscribe(TOPIC, start="latest", group=GROUP, batch_size=200,
+                                   visibility_timeout=VISIBILITY_TIMEOUT)
+    if offset is not None:
+        print(f"Resuming group {GROUP} after id={offset} (pairs published while stopped are sent now)")
+    elif subscription.cursor:
+        print(f"Starting from latest existing id={subscription.cursor} (no backlog)")
     else:
         print("No existing rows. Waiting for new stable_pairs...")
 
+    # poll() blocks, so it runs on one dedicated thread (SQLite connections are per-thread)
+    loop = asyncio.get_running_loop()
+    poller = ThreadPoolExecutor(max_workers=1, thread_name_prefix="stable_pairs_poll")
+    async with make_client() as client:
+        dispatcher = PairDispatcher(subscription, client, api_url)
+        try:
+            while True:
+                # Block until new rows are committed for the topic (no fixed sleep between polls)
+                rows = await loop.run_in_executor(poller, subscription.poll, 1.0)
+                for r in rows:
+                    dispatcher.submit(r)
+        finally:
+            await dispatcher.drain()
+            dispatcher.close()
+            poller.shutdown(wait=False)
+
+
+def main() -> int:
+    print("PostAPI Runner - consuming stable_pairs and POSTing to API")
+    print(f"DB: {DB_PATH} | API: {API_URL} | in-flight: {MAX_IN_FLIGHT}")
+    queue = SQLiteQueue(DB_PATH)
     try:
-        while True:
-            # Read new rows for the topic in global order
-            rows = get_after_id_topic(queue, TOPIC, last_global_id, limit=200)
-            for r in rows:
-                payload = r["payload"]
-                last_global_id = r["id"]
-
-                pair_id = payload.get("pair_id", r.get("key", ""))
-                start_slot = str(payload.get("start_slot", ""))
-                end_slot = str(payload.get("end_slot", ""))
-                if not start_slot or not end_slot:
-                    print(f"[SKIP] Invalid pair payload: {payload}")
-                    continue
-
-                order_id = get_next_order_id()
-                body = build_payload(pair_id, start_slot, end_slot, order_id)
-
-                # Simple retry 3 times
-                ok = False
-                for attempt in range(3):
-                    if send_post(body):
-                        ok = True
-                        break
-                    time.sleep(2)
-                if not ok:
-                    print(f"[FAIL] Could not POST after retries | pair_id={pair_id}")
-                    # Gửi unlock message sau 1 phút
-                    print(f"[UNLOCK_SCHEDULE] Sẽ unlock start_slot={start_slot} sau 60 giây do POST thất bại")
-                    send_unlock_after_delay(queue, pair_id, start_slot, delay_seconds=60)
-
-            time.sleep(0.5)
+        asyncio.run(run(queue))
     except KeyboardInterrupt:
         print("\nStopped by user.")
         return 0
+    finally:
+        queue.close()
 
 
 if __name__ == "__main__":
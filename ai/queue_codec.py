@@ -0,0 +1,223 @@
+"""
+Codec payload cho SQLiteQueue.
+
+- JsonCodec: JSON text (mặc định, như trước)
+- DetectionCodec: nhị phân cho raw_detection / roi_detection, lưu dạng BLOB:
+
+    MAGIC (4 byte) | uint32 độ dài meta | meta JSON | uint32 N | N bản ghi detection cố định
+
+  meta chứa các trường ngoài danh sách detection (camera_id, frame_id, timestamp, ...), tên
+  trường danh sách và bảng class_name. Mỗi detection là 1 bản ghi numpy cố định
+  (class_id, chỉ số class_name, slot_number, confidence, bbox x1..y2, center x/y) thay cho
+  dict JSON lặp lại tên khoá. Toạ độ lưu float32 nếu không mất độ chính xác, ngược lại float64.
+  Payload có confidence/toạ độ kiểu int (bbox "empty" lấy từ points ROI) dùng MAGIC DQI4/DQI8: bản ghi
+  thêm 1 byte đánh dấu giá trị nào là int để đọc lại đúng kiểu.
+
+decode_payload() tự nhận dạng: str -> JSON (dữ liệu cũ), bytes -> codec theo MAGIC.
+Payload không đúng layout detection (thiếu/thừa khoá, sai kiểu/tràn phạm vi trường, hoặc có sẵn khoá
+meta "_list"/"_names") được DetectionCodec ghi JSON như cũ, nên mọi payload đọc lại đúng như khi publish.
+"""
+
+import json
+import struct
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+import numpy as np
+
+_U32 = struct.Struct("<I")
+# slot_number = NO_SLOT nghĩa là detection không có slot_number
+NO_SLOT = -1
+
+_DETECTION_KEYS = {"class_id", "class_name", "confidence", "bbox", "center"}
+_BBOX_KEYS = ("x1", "y1", "x2", "y2")
+_CENTER_KEYS = ("x", "y")
+_INT16_RANGE = (-2 ** 15, 2 ** 15 - 1)
+_INT32_RANGE = (-2 ** 31, 2 ** 31 - 1)
+_MAX_NAMES = 2 ** 16
+# int lưu trong cột float chỉ khi float64 biểu diễn chính xác
+_MAX_EXACT_INT = 2 ** 53
+# Khoá meta dành riêng cho codec: payload có sẵn các khoá này được ghi JSON (tránh bị ghi đè)
+_META_KEYS = ("_list", "_names")
+
+
+def _record_dtype(float_type: str, int_flags: bool = False) -> np.dtype:
+    fields = [
+        ("class_id", "<i2"),
+        ("name", "<u2"),
+        ("slot", "<i4"),
+        ("confidence", float_type),
+        ("bbox", float_type, (4,)),
+        ("center", float_type, (2,)),
+    ]
+    if int_flags:
+        # bit j = giá trị thứ j của (confidence, x1, y1, x2, y2, cx, cy) là int
+        fields.append(("ints", "<u1"))
+    return np.dtype(fields)
+
+
+_DTYPES = {
+    b"DQF4": _record_dtype("<f4"), b"DQF8": _record_dtype("<f8"),
+    b"DQI4": _record_dtype("<f4", True), b"DQI8": _record_dtype("<f8", True),
+}
+
+
+class JsonCodec:
+    """JSON text (tương thích dữ liệu cũ)"""
+
+    name = "json"
+
+    def encode(self, payload: Dict[str, Any]) -> str:
+        return json.dumps(payload, ensure_ascii=False)
+
+
+class DetectionCodec:
+    """Layout nhị phân cố định cho payload có danh sách detection (bbox/center/confidence)"""
+
+    name = "detection"
+    LIST_FIELDS = ("detections", "roi_detections")
+
+    def __init__(self, fallback: Optional[JsonCodec] = None) -> None:
+        self.fallback = fallback or JsonCodec()
+
+    def _list_field(self, payload: Dict[str, Any]) -> Optional[str]:
+        for field in self.LIST_FIELDS:
+            if isinstance(payload.get(field), list):
+                return field
+        return None
+
+    @staticmethod
+    def _is_int(value: Any, bounds: Tuple[int, int]) -> bool:
+        return type(value) is int and bounds[0] <= value <= bounds[1]
+
+    @staticmethod
+    def _int_flags(values: List[Any]) -> Optional[int]:
+        """Bitmask giá trị int của 1 detection; None nếu có giá trị không phải float/int biểu diễn chính xác"""
+        flags = 0
+        for j, value in enumerate(values):
+            if type(value) is int and -_MAX_EXACT_INT <= value <= _MAX_EXACT_INT:
+                flags |= 1 << j
+            elif not isinstance(value, float):
+                return None
+        return flags
+
+    def encode(self, payload: Dict[str, Any]) -> Union[str, bytes]:
+        field = self._list_field(payload)
+        if field is None or any(key in payload for key in _META_KEYS):
+            return self.fallback.encode(payload)
+        detections = payload[field]
+        names: List[str] = []
+        name_index: Dict[str, int] = {}
+        class_ids, name_ids, slots, floats, int_flags = [], [], [], [], []
+        try:
+            for det in detections:
+                keys = det.keys() - _DETECTION_KEYS
+                if keys and keys != {"slot_number"}:
+                    return self.fallback.encode(payload)
+                # Chỉ ghi nhị phân khi đọc lại được đúng giá trị và kiểu gốc: class_id int16, slot_number
+                # int32 khác NO_SLOT, class_name str, confidence/toạ độ float hoặc int (None/str/bool -> JSON)
+                class_id, class_name, slot = det["class_id"], det["class_name"], det.get("slot_number", NO_SLOT)
+                if (not self._is_int(class_id, _INT16_RANGE) or not isinstance(class_name, str)
+                        or ("slot_number" in det and (not self._is_int(slot, _INT32_RANGE) or slot == NO_SLOT))):
+                    return self.fallback.encode(payload)
+                if class_name not in name_index:
+                    name_index[class_name] = len(names)
+                    names.append(class_name)
+                class_ids.append(class_id)
+                name_ids.append(name_index[class_name])
+                slots.append(slot)
+                bbox, center = det["bbox"], det["center"]
+                if len(bbox) != 4 or len(center) != 2:
+                    return self.fallback.encode(payload)
+                row = [det["confidence"]] + [bbox[k] for k in _BBOX_KEYS] + [center[k] for k in _CENTER_KEYS]
+                flags = self._int_flags(row)
+                if flags is None:
+                    return self.fallback.encode(payload)
+                floats.append(row)
+                int_flags.append(flags)
+            if len(names) > _MAX_NAMES:
+                return self.fallback.encode(payload)
+
+            values = np.array(floats, dtype=np.float64).reshape(-1, 7)
+            # float32 khi không mất độ chính xác (bbox từ YOLO vốn là float32)
+            magic = b"DQF4" if np.array_equal(values.astype(np.float32), values) else b"DQF8"
+            if any(int_flags):
+                magic = magic.replace(b"F", b"I")
+            records = np.empty(len(detections), dtype=_DTYPES[magic])
+            records["class_id"] = class_ids
+            records["name"] = name_ids
+            records["slot"] = slots
+            records["confidence"] = values[:, 0]
+            records["bbox"] = values[:, 1:5]
+            records["center"] = values[:, 5:7]
+            if "ints" in records.dtype.names:
+                records["ints"] = int_flags
+        except (KeyError, TypeError, AttributeError, ValueError, OverflowError):
+            return self.fallback.encode(payload)
+
+        meta = {k: v for k, v in payload.items() if k != field}
+        meta["_list"] = field
+        meta["_names"] = names
+        meta_bytes = json.dumps(meta, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        return b"".join((magic, _U32.pack(len(meta_bytes)), meta_bytes, _U32.pack(len(records)), records.tobytes()))
+
+    @staticmethod
+    def decode(data: bytes) -> Dict[str, Any]:
+        dtype = _DTYPES[bytes(data[:4])]
+        meta_len = _U32.unpack_from(data, 4)[0]
+        meta = json.loads(bytes(data[8:8 + meta_len]))
+        offset = 8 + meta_len
+        count = _U32.unpack_from(data, offset)[0]
+        records = np.frombuffer(data, dtype=dtype, count=count, offset=offset + 4)
+
+        field = meta.pop("_list")
+        names = meta.pop("_names")
+        int_flags = records["ints"].tolist() if "ints" in dtype.names else [0] * count
+        detections = []
+        for class_id, name, slot, confidence, bbox, center, flags in zip(
+            records["class_id"].tolist(), records["name"].tolist(), records["slot"].tolist(),
+            records["confidence"].tolist(), records["bbox"].tolist(), records["center"].tolist(), int_flags,
+        ):
+            if flags:
+                values = [int(v) if flags >> j & 1 else v for j, v in enumerate([confidence] + bbox + center)]
+                confidence, bbox, center = values[0], values[1:5], values[5:7]
+            det = {
+                "class_id": class_id,
+                "class_name": names[name],
+                "confidence": confidence,
+                "bbox": {"x1": bbox[0], "y1": bbox[1], "x2": bbox[2], "y2": bbox[3]},
+                "center": {"x": center[0], "y": center[1]},
+            }
+            if slot != NO_SLOT:
+                det["slot_number"] = slot
+            detections.append(det)
+
+        payload = {}
+        # Giữ thứ tự khoá: danh sách detection đứng trước các trường *_count như payload gốc
+        for key, value in meta.items():
+            if key.endswith("_count") and field not in payload:
+                payload[field] = detections
+            payload[key] = value
+        payload.setdefault(field, detections)
+        return payload
+
+
+def decode_payload(value: Union[str, bytes, memoryview]) -> Dict[str, Any]:
+    """Giải mã payload đọc từ cột messages.payload (JSON text cũ hoặc BLOB nhị phân)"""
+    if isinstance(value, str):
+        return json.loads(value)
+    if bytes(value[:4]) in _DTYPES:
+        return DetectionCodec.decode(value)
+    return json.loads(bytes(value))
+
+
+JSON_CODEC = JsonCodec()
+DETECTION_CODEC = DetectionCodec(JSON_CODEC)
+
+# Codec mặc định theo topic (topic không có trong map dùng JSON)
+DEFAULT_CODECS = {
+    "raw_detection": DETECTION_CODEC,
+    "roi_detection": DETECTION_CODEC,
+}
+
+
+__all__ = ["JsonCodec", "DetectionCodec", "decode_payload", "JSON_CODEC", "DETECTION_CODEC", "DEFAULT_CODECS"]
@@ -2,8 +2,92 @@ import json
 import os
 import sqlite3
 import threading
-from datetime import datetime
-from typing import Any, Dict, Optional
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
+
+from queue_codec import DEFAULT_CODECS, JSON_CODEC, decode_payload
+
+# Câu SQL dùng lại: sqlite3 cache prepared statement theo connection (cached_statements),
+# nên giữ nguyên chuỗi SQL + dùng lại connection của thread là tránh được prepare lại.
+_INSERT_SQL = "INSERT INTO messages(topic, key, payload, created_at) VALUES (?, ?, ?, ?)"
+# Giá trị mới nhất đọc từ bảng latest (khoá chính (topic, key)) -> O(1) bất kể lịch sử dài bao nhiêu
+_LATEST_PAYLOAD_SQL = "SELECT payload FROM latest WHERE topic = ? AND key = ?"
+_LATEST_ROW_SQL = "SELECT id, payload, created_at FROM latest WHERE topic = ? AND key = ?"
+_LATEST_TOPIC_SQL = "SELECT key, id, payload, created_at FROM latest WHERE topic = ? ORDER BY key"
+_LATEST_IDS_SQL = "SELECT key, id FROM latest WHERE topic = ?"
+_LATEST_ID_SQL = "SELECT id FROM latest WHERE topic = ? AND key = ?"
+_AFTER_ID_SQL = (
+    "SELECT id, payload, created_at FROM messages WHERE topic = ? AND key = ? AND id > ? ORDER BY id ASC LIMIT ?"
+)
+_TOPIC_AFTER_ID_SQL = (
+    "SELECT id, key, payload, created_at FROM messages WHERE topic = ? AND id > ? ORDER BY id ASC LIMIT ?"
+)
+_TOPIC_LAST_ID_SQL = "SELECT MAX(id) FROM latest WHERE topic = ?"
+# Message hẹn giờ (publish deliver_at): nằm trong scheduled đến hạn rồi mới chuyển sang messages (id mới)
+_INSERT_SCHEDULED_SQL = "INSERT INTO scheduled(topic, key, payload, deliver_at, created_at) VALUES (?, ?, ?, ?, ?)"
+_NEXT_DUE_SQL = "SELECT MIN(deliver_at) FROM scheduled WHERE topic = ?"
+_RELEASE_DUE_SQL = """
+    INSERT INTO messages(topic, key, payload, created_at)
+    SELECT topic, key, payload, ? FROM scheduled WHERE topic = ? AND deliver_at <= ? ORDER BY deliver_at, id
+"""
+_DELETE_DUE_SQL = "DELETE FROM scheduled WHERE topic = ? AND deliver_at <= ?"
+# Lease của consumer group (at-least-once): message hết hạn lease (visible_at <= now) được giao lại
+_EXPIRED_LEASES_SQL = """
+    SELECT l.message_id, l.deliveries, l.state, m.key, m.payload, m.created_at
+    FROM consumer_leases AS l LEFT JOIN messages AS m ON m.id = l.message_id
+    WHERE l.group_name = ? AND l.topic = ? AND l.visible_at <= ?
+    ORDER BY l.message_id
+    LIMIT ?
+"""
+# deliveries = NULL: không kiểm tra fencing token
+_DELETE_LEASE_SQL = """
+DELETE FROM consumer_leases
+WHERE group_name = ? AND topic = ? AND message_id = ? AND (?4 IS NULL OR deliveries = ?4)
+"""
+_NEXT_LEASE_VISIBLE_SQL = "SELECT MIN(visible_at) FROM consumer_leases WHERE group_name = ? AND topic = ?"
+_SET_OFFSET_SQL = """
+    INSERT INTO consumer_offsets(group_name, topic, last_id, updated_at) VALUES (?, ?, ?, ?)
+    ON CONFLICT(group_name, topic) DO UPDATE SET last_id = excluded.last_id, updated_at = excluded.updated_at
+"""
+# Cursor nhiều key trong 1 query: json_each({key: last_id}) là vòng ngoài (CROSS JOIN), mỗi key
+# subquery tương quan nhảy theo index (topic, key, id) và chỉ đọc tối đa limit message sau cursor
+# (backlog dài của consumer chậm không bị quét/sắp xếp lại mỗi lần poll)
+_AFTER_IDS_SQL = """
+    SELECT m.id, m.key, m.payload, m.created_at
+    FROM json_each(?1) AS c
+    CROSS JOIN messages AS m
+    WHERE m.id IN (
+        SELECT id FROM messages
+        WHERE topic = ?2 AND key = c.key AND id > c.value
+        ORDER BY id
+        LIMIT ?3
+    )
+    ORDER BY m.id ASC
+"""
+# 1 cursor chung cho 1 tập key (json_each([key, ...])), mỗi key nhảy theo index (topic, key, id)
+_KEYS_AFTER_ID_SQL = """
+    SELECT m.id, m.key, m.payload, m.created_at
+    FROM json_each(?) AS c
+    CROSS JOIN messages AS m ON m.topic = ? AND m.key = c.value AND m.id > ?
+    ORDER BY m.id ASC
+    LIMIT ?
+"""
+
+# Chính sách lưu giữ theo topic (None = không giới hạn):
+# - max_age_seconds: xoá message cũ hơn
+# - max_rows_per_key: chỉ giữ N message mới nhất mỗi key
+DEFAULT_RETENTION: Dict[str, Dict[str, Optional[int]]] = {
+    "raw_detection": {"max_age_seconds": 3600, "max_rows_per_key": 2000},
+    "roi_detection": {"max_age_seconds": 3600, "max_rows_per_key": 2000},
+    "stable_pairs": {"max_age_seconds": 7 * 24 * 3600, "max_rows_per_key": None},
+    "unlock_start_slot": {"max_age_seconds": 24 * 3600, "max_rows_per_key": None},
+    "roi_slot_unlock": {"max_age_seconds": 24 * 3600, "max_rows_per_key": None},
+    # Dead letter của postAPI (stable_pairs giao thất bại quá số lần cho phép)
+    "stable_pairs_dlq": {"max_age_seconds": 30 * 24 * 3600, "max_rows_per_key": None},
+    # roi_config: luôn giữ bản mới nhất, không xoá theo tuổi
+    "roi_config": {"max_age_seconds": None, "max_rows_per_key": 20},
+}
 
 
 class SQLiteQueue:
@@ -12,20 +96,60 @@ class SQLiteQueue:
     - raw_detection (key = camera_id)
     - roi_config (key = camera_id)
 
-    Lưu message theo dạng (topic, key, payload_json, created_at).
-    Cung cấp publish() và tiện ích đọc gần nhất để debug.
+    Lưu message theo dạng (topic, key, payload, created_at); payload là JSON text hoặc BLOB
+    nhị phân tuỳ codec của topic (xem queue_codec.py).
+    Cung cấp publish()/publish_many() và tiện ích đọc gần nhất để debug.
+
+    Mỗi thread dùng 1 connection riêng, mở lazy ở lần gọi đầu và dùng lại cho các lần sau
+    (PRAGMA chỉ chạy 1 lần/connection). Gọi close() khi shutdown để đóng toàn bộ connection.
     """
 
-    def __init__(self, db_path: str = "queues.db") -> None:
+    JOURNAL_SIZE_LIMIT = 64 * 1024 * 1024
+
+    def __init__(self, db_path: str = "queues.db", cached_statements: int = 128,
+                 codecs: Optional[Dict[str, Any]] = None) -> None:
         self._db_path = db_path
+        # Codec ghi theo topic (đọc luôn tự nhận dạng JSON cũ / BLOB nhị phân qua decode_payload)
+        self._codecs = DEFAULT_CODECS if codecs is None else codecs
+        self._cached_statements = cached_statements
         self._lock = threading.Lock()
+        # Connection theo thread + danh sách (pid, connection) để close() đóng được tất cả
+        self._local = threading.local()
+        self._conns: List[Tuple[int, sqlite3.Connection]] = []
+        self._conns_lock = threading.Lock()
+        # Báo cho subscriber cùng process khi có publish (connection khác process -> PRAGMA data_version)
+        self._changed = threading.Condition()
+        self._write_seq = 0
         os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
         self._init_db()
 
-    def _connect(self) -> sqlite3.Connection:
-        conn = sqlite3.connect(self._db_path, check_same_thread=False)
+    def _open_connection(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(
+            self._db_path, check_same_thread=False, cached_statements=self._cached_statements
+        )
         conn.execute("PRAGMA journal_mode=WAL;")
         conn.execute("PRAGMA synchronous=NORMAL;")
+        # Cắt file -wal về tối đa 64MB sau mỗi checkpoint
+        conn.execute(f"PRAGMA journal_size_limit={self.JOURNAL_SIZE_LIMIT};")
+        return conn
+
+    def _connect(self) -> sqlite3.Connection:
+        """
+        Connection của thread hiện tại (dùng lại giữa các lần gọi).
+
+        Dùng được với `with queue._connect() as conn:` như trước: khối with chỉ commit/rollback,
+        không đóng connection.
+        """
+        pid = os.getpid()
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and self._local.pid == pid:
+            return conn
+        # Thread mới, hoặc process con sau fork (không dùng lại connection của process cha)
+        conn = self._open_connection()
+        self._local.conn = conn
+        self._local.pid = pid
+        with self._conns_lock:
+            self._conns.append((pid, conn))
         return conn
 
     def _init_db(self) -> None:
@@ -44,65 +168,811 @@ class SQLiteQueue:
             conn.execute(
                 "CREATE INDEX IF NOT EXISTS idx_messages_topic_key_time ON messages(topic, key, created_at);"
             )
+            # Cursor theo topic (Subscription, get_after_id_topic) và theo (topic, key) (get_after_id(s))
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_messages_topic_id ON messages(topic, id);")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_messages_topic_key_id ON messages(topic, key, id);")
+            # Bảng "latest": message mới nhất theo (topic, key), cập nhật bằng trigger trong cùng transaction
+            # với INSERT vào messages (kể cả INSERT trực tiếp không qua publish). Giữ bản copy payload nên
+            # vẫn còn giá trị mới nhất sau khi prune() xoá message cũ.
+            has_latest = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'latest'"
+            ).fetchone()
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS latest (
+                    topic TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    id INTEGER NOT NULL,
+                    payload TEXT NOT NULL,
+                    created_at TEXT NOT NULL,
+                    PRIMARY KEY (topic, key)
+                ) WITHOUT ROWID;
+                """
+            )
+            conn.execute(
+                """
+                CREATE TRIGGER IF NOT EXISTS trg_messages_latest AFTER INSERT ON messages
+                BEGIN
+                    INSERT INTO latest(topic, key, id, payload, created_at)
+                    VALUES (NEW.topic, NEW.key, NEW.id, NEW.payload, NEW.created_at)
+                    ON CONFLICT(topic, key) DO UPDATE SET
+                        id = excluded.id, payload = excluded.payload, created_at = excluded.created_at
+                    WHERE excluded.id > latest.id;
+                END;
+                """
+            )
+            if not has_latest:
+                # DB cũ: dựng bảng latest 1 lần từ lịch sử messages
+                conn.execute(
+                    """
+                    INSERT OR REPLACE INTO latest(topic, key, id, payload, created_at)
+                    SELECT m.topic, m.key, m.id, m.payload, m.created_at
+                    FROM messages AS m
+                    JOIN (SELECT MAX(id) AS id FROM messages GROUP BY topic, key) AS last ON m.id = last.id
+                    """
+                )
+            # Cursor bền của consumer group (theo topic)
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS consumer_offsets (
+                    group_name TEXT NOT NULL,
+                    topic TEXT NOT NULL,
+                    last_id INTEGER NOT NULL,
+                    updated_at TEXT NOT NULL,
+                    PRIMARY KEY (group_name, topic)
+                );
+                """
+            )
+            # Message đang giao của consumer group có ack (Subscription visibility_timeout):
+            # có lease = chưa ack; visible_at = lúc được giao lại nếu consumer không ack/nack kịp
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS consumer_leases (
+                    group_name TEXT NOT NULL,
+                    topic TEXT NOT NULL,
+                    message_id INTEGER NOT NULL,
+                    deliveries INTEGER NOT NULL,
+                    visible_at REAL NOT NULL,
+                    state TEXT,
+                    PRIMARY KEY (group_name, topic, message_id)
+                );
+                """
+            )
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_consumer_leases_visible ON consumer_leases(group_name, topic, visible_at);"
+            )
+            # Message hẹn giờ chưa đến hạn; index (topic, deliver_at) để consumer tìm hạn gần nhất O(log n)
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS scheduled (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    topic TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    deliver_at REAL NOT NULL,
+                    created_at TEXT NOT NULL
+                );
+                """
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_scheduled_topic_due ON scheduled(topic, deliver_at);")
+            # Sequence số nguyên bền (vd orderId ICS): next_value = giá trị chưa cấp nhỏ nhất
+            conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS sequences (
+                    name TEXT PRIMARY KEY,
+                    next_value INTEGER NOT NULL,
+                    updated_at TEXT NOT NULL
+                );
+                """
+            )
+
+    def publish(self, topic: str, key: str, payload: Dict[str, Any], deliver_at: Optional[float] = None) -> None:
+        self.publish_many(topic, [(key, payload)], deliver_at=deliver_at)
+
+    def publish_many(self, topic: str, items: Iterable[Tuple[str, Dict[str, Any]]],
+                     deliver_at: Optional[float] = None) -> int:
+        """
+        Ghi nhiều message cùng topic trong 1 transaction
 
-    def publish(self, topic: str, key: str, payload: Dict[str, Any]) -> None:
+        Args:
+            topic: Tên topic
+            items: Danh sách (key, payload)
+            deliver_at: Epoch (time.time()) message được giao; None hoặc đã qua = giao ngay.
+                Message hẹn giờ lưu trong bảng scheduled (bền qua restart, không cần thread chờ)
+                và được chuyển vào topic khi consumer poll lúc đến hạn (xem release_due()).
+
+        Returns:
+            int: Số message đã ghi
+        """
         now_iso = datetime.utcnow().isoformat() + "Z"
-        record = (topic, key, json.dumps(payload, ensure_ascii=False), now_iso)
+        codec = self._codecs.get(topic, JSON_CODEC)
+        if deliver_at is not None and deliver_at > time.time():
+            sql = _INSERT_SCHEDULED_SQL
+            records = [(topic, key, codec.encode(payload), deliver_at, now_iso) for key, payload in items]
+        else:
+            sql = _INSERT_SQL
+            records = [(topic, key, codec.encode(payload), now_iso) for key, payload in items]
+        if not records:
+            return 0
         with self._lock:
             with self._connect() as conn:
-                conn.execute(
-                    "INSERT INTO messages(topic, key, payload, created_at) VALUES (?, ?, ?, ?)",
-                    record,
-                )
+                conn.executemany(sql, records)
+        with self._changed:
+            self._write_seq += 1
+            self._changed.notify_all()
+        return len(records)
 
     def get_latest(self, topic: str, key: str) -> Optional[Dict[str, Any]]:
-        with self._connect() as conn:
-            cur = conn.execute(
-                """
-                SELECT payload FROM messages
-                WHERE topic = ? AND key = ?
-                ORDER BY id DESC
-                LIMIT 1
-                """,
-                (topic, key),
-            )
-            row = cur.fetchone()
-            if row is None:
-                return None
-            return json.loads(row[0])
+        row = self._connect().execute(_LATEST_PAYLOAD_SQL, (topic, key)).fetchone()
+        if row is None:
+            return None
+        return decode_payload(row[0])
 
     def get_latest_row(self, topic: str, key: str) -> Optional[Dict[str, Any]]:
-        with self._connect() as conn:
-            cur = conn.execute(
-                """
-                SELECT id, payload, created_at FROM messages
-                WHERE topic = ? AND key = ?
-                ORDER BY id DESC
-                LIMIT 1
-                """,
-                (topic, key),
-            )
-            row = cur.fetchone()
-            if row is None:
-                return None
-            return {"id": row[0], "payload": json.loads(row[1]), "created_at": row[2]}
+        row = self._connect().execute(_LATEST_ROW_SQL, (topic, key)).fetchone()
+        if row is None:
+            return None
+        return {"id": row[0], "payload": decode_payload(row[1]), "created_at": row[2]}
+
+    def get_latest_all(self, topic: str) -> Dict[str, Dict[str, Any]]:
+        """Snapshot giá trị mới nhất của mọi key trong topic: {key: {id, payload, created_at}}"""
+        rows = self._connect().execute(_LATEST_TOPIC_SQL, (topic,)).fetchall()
+        return {r[0]: {"id": r[1], "payload": decode_payload(r[2]), "created_at": r[3]} for r in rows}
+
+    def get_latest_ids(self, topic: str) -> Dict[str, int]:
+        """id message mới nhất theo key (không decode payload, dùng để phát hiện key có cập nhật)"""
+        return dict(self._connect().execute(_LATEST_IDS_SQL, (topic,)).fetchall())
+
+    def get_latest_id(self, topic: str, key: str) -> Optional[int]:
+        """id message mới nhất của 1 key (tra PRIMARY KEY (topic, key) của latest, không decode payload)"""
+        row = self._connect().execute(_LATEST_ID_SQL, (topic, key)).fetchone()
+        return row[0] if row else None
 
     def get_after_id(self, topic: str, key: str, after_id: int, limit: int = 50) -> list[Dict[str, Any]]:
-        with self._connect() as conn:
-            cur = conn.execute(
-                """
-                SELECT id, payload, created_at FROM messages
-                WHERE topic = ? AND key = ? AND id > ?
-                ORDER BY id ASC
-                LIMIT ?
-                """,
-                (topic, key, after_id, limit),
+        rows = self._connect().execute(_AFTER_ID_SQL, (topic, key, after_id, limit)).fetchall()
+        result = []
+        for r in rows:
+            result.append({"id": r[0], "payload": decode_payload(r[1]), "created_at": r[2]})
+        return result
+
+    def get_after_ids(self, topic: str, cursors: Dict[str, int], limit: int = 50) -> Dict[str, List[Dict[str, Any]]]:
+        """
+        Message mới của nhiều key trong 1 query (thay cho 1 get_after_id mỗi camera)
+
+        Args:
+            topic: Tên topic
+            cursors: {key: last_id}, chỉ đọc các key có trong map
+            limit: Số message tối đa mỗi key
+
+        Returns:
+            dict: {key: [{id, payload, created_at}, ...]} theo id tăng dần, chỉ gồm key có message mới
+        """
+        if not cursors:
+            return {}
+        rows = self._connect().execute(_AFTER_IDS_SQL, (json.dumps(cursors), topic, limit)).fetchall()
+        result: Dict[str, List[Dict[str, Any]]] = {}
+        for r in rows:
+            result.setdefault(r[1], []).append({"id": r[0], "payload": decode_payload(r[2]), "created_at": r[3]})
+        return result
+
+    def get_after_id_topic(self, topic: str, after_id: int, limit: int = 100) -> List[Dict[str, Any]]:
+        """Message của topic có id > after_id (mọi key), theo thứ tự id tăng dần"""
+        rows = self._connect().execute(_TOPIC_AFTER_ID_SQL, (topic, after_id, limit)).fetchall()
+        return [{"id": r[0], "key": r[1], "payload": decode_payload(r[2]), "created_at": r[3]} for r in rows]
+
+    def get_after_id_keys(self, topic: str, keys: Iterable[str], after_id: int,
+                          limit: int = 100) -> List[Dict[str, Any]]:
+        """Message của các key trong keys có id > after_id, theo thứ tự id tăng dần (payload key khác không bị decode)"""
+        keys = list(keys)
+        if not keys:
+            return []
+        rows = self._connect().execute(_KEYS_AFTER_ID_SQL, (json.dumps(keys), topic, after_id, limit)).fetchall()
+        return [{"id": r[0], "key": r[1], "payload": decode_payload(r[2]), "created_at": r[3]} for r in rows]
+
+    def release_due(self, topic: str, now: Optional[float] = None) -> Optional[float]:
+        """
+        Chuyển message hẹn giờ đã đến hạn của topic sang messages (id mới, theo thứ tự deliver_at).
+
+        Chỉ 1 lần đọc index khi chưa có gì đến hạn; nhiều consumer (kể cả khác process) cùng gọi
+        vẫn chỉ giao mỗi message 1 lần (chuyển + xoá trong cùng transaction BEGIN IMMEDIATE).
+
+        Returns:
+            float | None: deliver_at gần nhất còn lại của topic (None nếu không còn message hẹn giờ)
+        """
+        now = time.time() if now is None else now
+        conn = self._connect()
+        next_due = conn.execute(_NEXT_DUE_SQL, (topic,)).fetchone()[0]
+        if next_due is None or next_due > now:
+            return next_due
+        now_iso = datetime.utcnow().isoformat() + "Z"
+        with self._lock:
+            with conn:
+                conn.execute("BEGIN IMMEDIATE;")
+                released = conn.execute(_RELEASE_DUE_SQL, (now_iso, topic, now)).rowcount
+                conn.execute(_DELETE_DUE_SQL, (topic, now))
+                next_due = conn.execute(_NEXT_DUE_SQL, (topic,)).fetchone()[0]
+        if released:
+            with self._changed:
+                self._write_seq += 1
+                self._changed.notify_all()
+        return next_due
+
+    def last_id(self, topic: str) -> int:
+        """id lớn nhất của topic (0 nếu chưa có message)"""
+        row = self._connect().execute(_TOPIC_LAST_ID_SQL, (topic,)).fetchone()
+        return row[0] or 0
+
+    def change_token(self) -> Tuple[int, int]:
+        """
+        Mốc để wait_for_change() so sánh: (PRAGMA data_version, số lần publish trong process).
+
+        data_version của 1 connection chỉ đổi khi connection KHÁC commit, nên cộng thêm bộ đếm
+        publish trong process để bắt cả ghi từ chính thread này.
+        """
+        version = self._connect().execute("PRAGMA data_version;").fetchone()[0]
+        return version, self._write_seq
+
+    def wait_for_change(self, token: Tuple[int, int], timeout: Optional[float] = None,
+                        poll_interval: float = 0.01) -> bool:
+        """
+        Chờ đến khi DB có commit mới so với token (từ change_token()).
+
+        Publish cùng process đánh thức ngay qua Condition; ghi từ process khác được phát hiện bằng
+        PRAGMA data_version mỗi poll_interval (chỉ đọc header WAL trong shared memory, rất rẻ).
+
+        Returns:
+            bool: True nếu có thay đổi, False nếu hết timeout
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            if self.change_token() != token:
+                return True
+            wait_time = poll_interval
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                wait_time = min(wait_time, remaining)
+            with self._changed:
+                if self._write_seq == token[1]:
+                    self._changed.wait(wait_time)
+
+    def get_offset(self, group: str, topic: str) -> Optional[int]:
+        """Cursor đã lưu của consumer group (None nếu group chưa đọc topic)"""
+        row = self._connect().execute(
+            "SELECT last_id FROM consumer_offsets WHERE group_name = ? AND topic = ?", (group, topic)
+        ).fetchone()
+        return None if row is None else row[0]
+
+    def claim_after_offset(self, group: str, topic: str, default_id: int, limit: int = 100) -> List[Dict[str, Any]]:
+        """
+        Lấy tối đa limit message sau cursor của group và dời cursor trong cùng 1 transaction ghi,
+        nên nhiều consumer cùng group (kể cả khác process) không nhận trùng message.
+
+        Args:
+            default_id: Cursor khởi tạo nếu group chưa có offset
+        """
+        now_iso = datetime.utcnow().isoformat() + "Z"
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                # BEGIN IMMEDIATE: giữ write lock từ lúc đọc offset đến lúc ghi offset mới
+                conn.execute("BEGIN IMMEDIATE;")
+                row = conn.execute(
+                    "SELECT last_id FROM consumer_offsets WHERE group_name = ? AND topic = ?", (group, topic)
+                ).fetchone()
+                after_id = default_id if row is None else row[0]
+                rows = conn.execute(_TOPIC_AFTER_ID_SQL, (topic, after_id, limit)).fetchall()
+                new_id = rows[-1][0] if rows else after_id
+                if row is None or rows:
+                    conn.execute(_SET_OFFSET_SQL, (group, topic, new_id, now_iso))
+        return [{"id": r[0], "key": r[1], "payload": decode_payload(r[2]), "created_at": r[3]} for r in rows]
+
+    def claim_leased(self, group: str, topic: str, default_id: int, limit: int = 100,
+                     visibility_timeout: float = 60.0) -> List[Dict[str, Any]]:
+        """
+        Như claim_after_offset nhưng at-least-once: mỗi message nhận được giữ 1 lease trong
+        consumer_leases cho đến khi ack(); nếu consumer không ack/nack trong visibility_timeout giây
+        (crash, treo) message được giao lại cho consumer bất kỳ của group, kể cả sau restart.
+
+        Message hết hạn lease được giao trước, rồi đến message mới sau offset của group.
+
+        Returns:
+            list: [{id, key, payload, created_at, deliveries, state}, ...] theo id tăng dần;
+                deliveries = số lần đã giao (1 = lần đầu), state = dữ liệu consumer lưu qua extend_lease/nack
+        """
+        now = time.time()
+        now_iso = datetime.utcnow().isoformat() + "Z"
+        visible_at = now + visibility_timeout
+        result: List[Dict[str, Any]] = []
+        with self._lock:
+            conn = self._connect()
+            with conn:
+                conn.execute("BEGIN IMMEDIATE;")
+                expired = conn.execute(_EXPIRED_LEASES_SQL, (group, topic, now, limit)).fetchall()
+                # Message đã bị prune trong lúc còn lease -> bỏ lease
+                gone = [(group, topic, r[0]) for r in expired if r[4] is None]
+                if gone:
+                    conn.executemany(
+                        "DELETE FROM consumer_leases WHERE group_name = ? AND topic = ? AND message_id = ?", gone
+                    )
+                expired = [r for r in expired if r[4] is not None]
+                if expired:
+                    conn.executemany(
+                        """
+                        UPDATE consumer_leases SET deliveries = deliveries + 1, visible_at = ?
+                        WHERE group_name = ? AND topic = ? AND message_id = ?
+                        """,
+                        [(visible_at, group, topic, r[0]) for r in expired],
+                    )
+                    result += [
+                        {"id": r[0], "key": r[3], "payload": decode_payload(r[4]), "created_at": r[5],
+                         "deliveries": r[1] + 1, "state": None if r[2] is None else json.loads(r[2])}
+                        for r in expired
+                    ]
+                if len(result) < limit:
+                    row = conn.execute(
+                        "SELECT last_id FROM consumer_offsets WHERE group_name = ? AND topic = ?", (group, topic)
+                    ).fetchone()
+                    after_id = default_id if row is None else row[0]
+                    rows = conn.execute(_TOPIC_AFTER_ID_SQL, (topic, after_id, limit - len(result))).fetchall()
+                    if rows:
+                        conn.executemany(
+                            """
+                            INSERT OR IGNORE INTO consumer_leases(group_name, topic, message_id, deliveries, visible_at)
+                            VALUES (?, ?, ?, 1, ?)
+                            """,
+                            [(group, topic, r[0], visible_at) for r in rows],
+                        )
+                    if row is None or rows:
+                        conn.execute(_SET_OFFSET_SQL, (group, topic, rows[-1][0] if rows else after_id, now_iso))
+                    result += [
+                        {"id": r[0], "key": r[1], "payload": decode_payload(r[2]), "created_at": r[3],
+                         "deliveries": 1, "state": None}
+                        for r in rows
+                    ]
+        result.sort(key=lambda r: r["id"])
+        return result
+
+    def ack(self, group: str, topic: str, message_ids: Iterable[int], deliveries: Optional[int] = None) -> int:
+        """
+        Xác nhận đã xử lý xong: xoá lease, message không được giao lại.
+
+        Args:
+            deliveries: Fencing token = row["deliveries"] của lần giao đang xử lý; nếu có, chỉ xoá lease
+                còn thuộc lần giao đó (message đã được giao lại cho consumer khác thì không bị ack nhầm)
+
+        Returns:
+            int: Số lease đã xoá
+        """
+        params = [(group, topic, message_id, deliveries) for message_id in message_ids]
+        with self._lock:
+            with self._connect() as conn:
+                cur = conn.executemany(_DELETE_LEASE_SQL, params)
+        return cur.rowcount
+
+    def extend_lease(self, group: str, topic: str, message_id: int, visibility_timeout: float,
+                     state: Optional[Dict[str, Any]] = None, deliveries: Optional[int] = None) -> bool:
+        """
+        Đặt lại hạn lease = now + visibility_timeout (nack(delay) = extend_lease(delay)).
+
+        Args:
+            state: Nếu có, lưu kèm lease (JSON) và trả lại trong row["state"] ở lần giao sau
+            deliveries: Fencing token (xem ack())
+
+        Returns:
+            bool: False nếu lease không còn thuộc lần giao này (đã ack / giao lại cho consumer khác)
+        """
+        with self._lock:
+            with self._connect() as conn:
+                cur = conn.execute(
+                    """
+                    UPDATE consumer_leases SET visible_at = ?, state = COALESCE(?, state)
+                    WHERE group_name = ? AND topic = ? AND message_id = ? AND (? IS NULL OR deliveries = ?)
+                    """,
+                    (time.time() + visibility_timeout, None if state is None else json.dumps(state),
+                     group, topic, message_id, deliveries, deliveries),
+                )
+        return cur.rowcount > 0
+
+    def nack(self, group: str, topic: str, message_id: int, delay: float = 0.0,
+             state: Optional[Dict[str, Any]] = None, deliveries: Optional[int] = None) -> bool:
+        """
+        Xử lý thất bại: giao lại message sau delay giây (lease giữ nguyên, deliveries tăng ở lần giao sau).
+        Trả về False nếu lease không còn thuộc lần giao này (xem ack()).
+        """
+        if not self.extend_lease(group, topic, message_id, delay, state, deliveries):
+            return False
+        with self._changed:
+            self._write_seq += 1
+            self._changed.notify_all()
+        return True
+
+    def dead_letter(self, group: str, topic: str, row: Dict[str, Any], reason: str) -> bool:
+        """
+        Bỏ message không xử lý được: publish sang topic "<topic>_dlq" và xoá lease trong cùng transaction.
+
+        Payload DLQ: {group, message_id, key, payload, deliveries, reason, failed_at}
+        Nếu row có "deliveries" (từ claim_leased) thì dùng làm fencing token (xem ack()).
+
+        Returns:
+            bool: False nếu lease không còn thuộc lần giao này (không publish DLQ)
+        """
+        dlq_topic = f"{topic}_dlq"
+        codec = self._codecs.get(dlq_topic, JSON_CODEC)
+        now_iso = datetime.utcnow().isoformat() + "Z"
+        payload = {
+            "group": group,
+            "message_id": row["id"],
+            "key": row.get("key"),
+            "payload": row["payload"],
+            "deliveries": row.get("deliveries"),
+            "reason": reason,
+            "failed_at": now_iso,
+        }
+        deliveries = row.get("deliveries")
+        with self._lock:
+            with self._connect() as conn:
+                cur = conn.execute(_DELETE_LEASE_SQL, (group, topic, row["id"], deliveries))
+                if deliveries is not None and cur.rowcount == 0:
+                    return False
+                conn.execute(_INSERT_SQL, (dlq_topic, row.get("key") or "", codec.encode(payload), now_iso))
+        with self._changed:
+            self._write_seq += 1
+            self._changed.notify_all()
+        return True
+
+    def next_lease_visible(self, group: str, topic: str) -> Optional[float]:
+        """Thời điểm (epoch) lease sớm nhất của group hết hạn (None nếu không có message đang giao)"""
+        return self._connect().execute(_NEXT_LEASE_VISIBLE_SQL, (group, topic)).fetchone()[0]
+
+    def reserve_sequence(self, name: str, count: int = 1, floor: int = 1) -> int:
+        """
+        Giữ chỗ count giá trị liên tiếp của sequence name, trả về giá trị đầu (dùng [first, first + count)).
+
+        Đọc + dời next_value trong 1 transaction BEGIN IMMEDIATE nên nhiều process cùng xin không bao giờ
+        nhận trùng; commit với synchronous=FULL để block đã cấp không bị mất khi mất điện (không cấp lại).
+
+        Args:
+            floor: Giá trị nhỏ nhất được cấp (vd số cuối của order_id.txt cũ + 1)
+        """
+        if count < 1:
+            raise ValueError(f"count phải >= 1 (nhận {count})")
+        now_iso = datetime.utcnow().isoformat() + "Z"
+        with self._lock:
+            conn = self._connect()
+            conn.execute("PRAGMA synchronous=FULL;")
+            try:
+                with conn:
+                    conn.execute("BEGIN IMMEDIATE;")
+                    row = conn.execute("SELECT next_value FROM sequences WHERE name = ?", (name,)).fetchone()
+                    first = floor if row is None else max(floor, row[0])
+                    conn.execute(
+                        """
+                        INSERT INTO sequences(name, next_value, updated_at) VALUES (?, ?, ?)
+                        ON CONFLICT(name) DO UPDATE SET next_value = excluded.next_value,
+                            updated_at = excluded.updated_at
+                        """,
+                        (name, first + count, now_iso),
+                    )
+            finally:
+                conn.execute("PRAGMA synchronous=NORMAL;")
+        return first
+
+    def subscribe(self, topic: str, start: Union[str, int] = "latest", group: Optional[str] = None,
+                  batch_size: int = 100, keys: Optional[Iterable[str]] = None,
+                  visibility_timeout: Optional[float] = None) -> "Subscription":
+        """Tạo Subscription đọc topic theo thứ tự id (xem Subscription)"""
+        return Subscription(self, topic, start=start, group=group, batch_size=batch_size, keys=keys,
+                            visibility_timeout=visibility_timeout)
+
+    def list_keys(self, topic: str) -> List[str]:
+        """
+        Danh sách key của topic (đã sắp xếp).
+
+        Nhảy theo index (topic, key, ...) mỗi key 1 lần thay vì quét toàn bộ message như
+        SELECT DISTINCT, nên chi phí theo số key chứ không theo số message.
+        """
+        rows = self._connect().execute(
+            """
+            WITH RECURSIVE keys(key) AS (
+                SELECT MIN(key) FROM messages WHERE topic = ?1
+                UNION ALL
+                SELECT (SELECT MIN(key) FROM messages WHERE topic = ?1 AND key > keys.key)
+                FROM keys WHERE keys.key IS NOT NULL
             )
-            rows = cur.fetchall()
-            result = []
-            for r in rows:
-                result.append({"id": r[0], "payload": json.loads(r[1]), "created_at": r[2]})
-            return result
+            SELECT key FROM keys WHERE key IS NOT NULL
+            """,
+            (topic,),
+        ).fetchall()
+        return [r[0] for r in rows]
+
+    def _delete_ids(self, select_sql: str, params: Tuple[Any, ...], batch_size: int) -> int:
+        """Xoá theo từng lô batch_size id (mỗi lô 1 transaction ngắn để không chặn writer khác lâu)"""
+        deleted = 0
+        while True:
+            with self._lock:
+                with self._connect() as conn:
+                    cur = conn.execute(
+                        f"DELETE FROM messages WHERE id IN ({select_sql} LIMIT ?)", params + (batch_size,)
+                    )
+            deleted += cur.rowcount
+            if cur.rowcount < batch_size:
+                return deleted
+
+    def prune(self, retention: Optional[Dict[str, Dict[str, Optional[int]]]] = None,
+              batch_size: int = 5000) -> Dict[str, int]:
+        """
+        Xoá message theo chính sách lưu giữ
+
+        Args:
+            retention: {topic: {max_age_seconds, max_rows_per_key}}, mặc định DEFAULT_RETENTION
+            batch_size: Số message tối đa xoá trong 1 transaction
+
+        Returns:
+            dict: Số message đã xoá theo topic
+        """
+        retention = DEFAULT_RETENTION if retention is None else retention
+        deleted: Dict[str, int] = {}
+        for topic, policy in retention.items():
+            count = 0
+            max_age = policy.get("max_age_seconds")
+            max_rows = policy.get("max_rows_per_key")
+            cutoff_iso = None
+            if max_age is not None:
+                cutoff_iso = (datetime.utcnow() - timedelta(seconds=max_age)).isoformat() + "Z"
+            for key in self.list_keys(topic):
+                if cutoff_iso is not None:
+                    count += self._delete_ids(
+                        "SELECT id FROM messages WHERE topic = ? AND key = ? AND created_at < ?",
+                        (topic, key, cutoff_iso),
+                        batch_size,
+                    )
+                if max_rows is not None:
+                    # id của message mới thứ max_rows + 1 -> xoá từ đó trở về trước
+                    row = self._connect().execute(
+                        "SELECT id FROM messages WHERE topic = ? AND key = ? ORDER BY id DESC LIMIT 1 OFFSET ?",
+                        (topic, key, max_rows),
+                    ).fetchone()
+                    if row is not None:
+                        count += self._delete_ids(
+                            "SELECT id FROM messages WHERE topic = ? AND key = ? AND id <= ?",
+                            (topic, key, row[0]),
+                            batch_size,
+                        )
+            if count:
+                deleted[topic] = count
+        return deleted
+
+    def checkpoint(self, mode: str = "PASSIVE") -> Tuple[int, int, int]:
+        """
+        Checkpoint WAL vào file db
+
+        Args:
+            mode: PASSIVE (không chờ reader/writer), FULL, RESTART hoặc TRUNCATE (cắt -wal về 0)
+
+        Returns:
+            tuple: (busy, số frame trong WAL, số frame đã checkpoint)
+        """
+        mode = mode.upper()
+        if mode not in ("PASSIVE", "FULL", "RESTART", "TRUNCATE"):
+            raise ValueError(f"Chế độ checkpoint không hợp lệ: {mode}")
+        with self._lock:
+            row = self._connect().execute(f"PRAGMA wal_checkpoint({mode});").fetchone()
+        return tuple(row)
+
+    def close(self) -> None:
+        """Đóng connection của mọi thread (chỉ các connection do process hiện tại mở)"""
+        pid = os.getpid()
+        with self._conns_lock:
+            conns, self._conns = self._conns, []
+            self._local = threading.local()
+        for conn_pid, conn in conns:
+            if conn_pid != pid:
+                continue
+            try:
+                conn.close()
+            except sqlite3.Error as e:
+                print(f"Lỗi đóng connection SQLite: {e}")
+
+    def __enter__(self) -> "SQLiteQueue":
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.close()
+
+
+class Subscription:
+    """
+    Consumer của 1 topic: poll() trả message mới (mọi key, theo id tăng dần) hoặc chờ đến khi có.
+
+    - Không có group: cursor nằm trong bộ nhớ, bắt đầu từ start.
+    - Có group: cursor lưu trong bảng consumer_offsets (tiếp tục sau restart); start chỉ dùng cho
+      lần đầu group đọc topic. Các consumer cùng group chia nhau message, không nhận trùng.
+
+    start: "latest" (chỉ message mới, mặc định), "earliest" hoặc 1 id cụ thể.
+    keys: chỉ đọc message của các key này (None = mọi key); gán lại .keys để đổi tập key khi đang chạy.
+
+    Message hẹn giờ (publish(..., deliver_at=...)) được release_due() trước mỗi lần đọc; poll() chờ
+    tối đa đến hạn gần nhất nên nhận message đúng lúc đến hạn mà không cần thread hẹn giờ.
+
+    visibility_timeout (cần group): at-least-once qua claim_leased(); mỗi message phải được ack(),
+    nack() hoặc dead_letter(), nếu không sẽ được giao lại sau visibility_timeout giây (kể cả sau restart).
+    """
+
+    def __init__(self, queue: SQLiteQueue, topic: str, start: Union[str, int] = "latest",
+                 group: Optional[str] = None, batch_size: int = 100,
+                 keys: Optional[Iterable[str]] = None, visibility_timeout: Optional[float] = None) -> None:
+        if group is not None and keys is not None:
+            raise ValueError("Subscription theo consumer group không hỗ trợ lọc keys")
+        if visibility_timeout is not None and group is None:
+            raise ValueError("visibility_timeout cần consumer group (lease lưu theo group)")
+        self.queue = queue
+        self.topic = topic
+        self.group = group
+        self.batch_size = batch_size
+        self.keys = None if keys is None else list(keys)
+        self.visibility_timeout = visibility_timeout
+        if start == "latest":
+            self._start_id = queue.last_id(topic)
+        elif start == "earliest":
+            self._start_id = 0
+        else:
+            self._start_id = int(start)
+        self.cursor = self._start_id
+        if group is not None:
+            offset = queue.get_offset(group, topic)
+            if offset is not None:
+                self.cursor = offset
+        self._next_due: Optional[float] = None
+
+    def _fetch(self) -> List[Dict[str, Any]]:
+        self._next_due = self.queue.release_due(self.topic)
+        if self.visibility_timeout is not None:
+            rows = self.queue.claim_leased(
+                self.group, self.topic, self._start_id, self.batch_size, self.visibility_timeout
+            )
+            # Chờ tối đa đến lúc lease sớm nhất hết hạn (message nack / consumer chết được giao lại)
+            lease_due = self.queue.next_lease_visible(self.group, self.topic)
+            if lease_due is not None and (self._next_due is None or lease_due < self._next_due):
+                self._next_due = lease_due
+        elif self.keys is not None:
+            rows = self.queue.get_after_id_keys(self.topic, self.keys, self.cursor, self.batch_size)
+        elif self.group is None:
+            rows = self.queue.get_after_id_topic(self.topic, self.cursor, self.batch_size)
+        else:
+            rows = self.queue.claim_after_offset(self.group, self.topic, self._start_id, self.batch_size)
+        if rows:
+            self.cursor = rows[-1]["id"]
+        return rows
+
+    def poll(self, timeout: Optional[float] = None) -> List[Dict[str, Any]]:
+        """
+        Lấy message mới; nếu chưa có thì chờ tối đa timeout giây (None = chờ mãi).
+
+        Returns:
+            list: [{id, key, payload, created_at}, ...] (rỗng nếu hết timeout)
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            # Lấy token TRƯỚC khi đọc để không bỏ lỡ commit xen giữa lúc đọc và lúc chờ
+            token = self.queue.change_token()
+            rows = self._fetch()
+            if rows:
+                return rows
+            remaining = None if deadline is None else deadline - time.monotonic()
+            if remaining is not None and remaining <= 0:
+                return []
+            wait_time = remaining
+            if self._next_due is not None:
+                # Thức dậy lúc message hẹn giờ gần nhất đến hạn (rồi vòng lặp tự kiểm tra lại deadline)
+                due_in = max(0.0, self._next_due - time.time())
+                if wait_time is None or due_in < wait_time:
+                    wait_time = due_in
+            if not self.queue.wait_for_change(token, wait_time) and wait_time == remaining:
+                return []
+
+    # ack/nack/extend_lease/dead_letter dùng row["deliveries"] làm fencing token: trả về False nếu
+    # message đã được giao lại (lease hết hạn) -> kết quả của lần giao cũ phải bỏ qua
+
+    def ack(self, row: Dict[str, Any]) -> bool:
+        return self.queue.ack(self.group, self.topic, [row["id"]], row.get("deliveries")) > 0
+
+    def nack(self, row: Dict[str, Any], delay: float = 0.0, state: Optional[Dict[str, Any]] = None) -> bool:
+        return self.queue.nack(self.group, self.topic, row["id"], delay, state, row.get("deliveries"))
+
+    def extend_lease(self, row: Dict[str, Any], state: Optional[Dict[str, Any]] = None,
+                     visibility_timeout: Optional[float] = None) -> bool:
+        timeout = self.visibility_timeout if visibility_timeout is None else visibility_timeout
+        return self.queue.extend_lease(self.group, self.topic, row["id"], timeout, state, row.get("deliveries"))
+
+    def dead_letter(self, row: Dict[str, Any], reason: str) -> bool:
+        return self.queue.dead_letter(self.group, self.topic, row, reason)
+
+    def __iter__(self):
+        """Duyệt message mãi mãi (chặn khi chưa có message mới)"""
+        while True:
+            for row in self.poll():
+                yield row
+
+
+class QueuePruner:
+    """
+    Thread nền dọn queues.db định kỳ: prune() theo chính sách lưu giữ rồi checkpoint WAL.
+
+    Checkpoint TRUNCATE khi vừa xoá nhiều message (hoặc WAL vượt wal_truncate_frames),
+    ngược lại PASSIVE để không chặn reader/writer.
+    """
+
+    def __init__(self, queue: SQLiteQueue, interval: float = 60.0,
+                 retention: Optional[Dict[str, Dict[str, Optional[int]]]] = None,
+                 batch_size: int = 5000, wal_truncate_frames: int = 10000) -> None:
+        self.queue = queue
+        self.interval = interval
+        self.retention = retention
+        self.batch_size = batch_size
+        self.wal_truncate_frames = wal_truncate_frames
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def run_once(self) -> Dict[str, int]:
+        start = time.time()
+        deleted = self.queue.prune(self.retention, batch_size=self.batch_size)
+        busy, wal_frames, _ = self.queue.checkpoint("PASSIVE")
+        if not busy and (sum(deleted.values()) >= self.batch_size or wal_frames >= self.wal_truncate_frames):
+            self.queue.checkpoint("TRUNCATE")
+        if deleted:
+            print(f"[QueuePruner] Đã xoá {deleted} trong {time.time() - start:.2f}s")
+        return deleted
+
+    def _loop(self) -> None:
+        while not self._stop_event.wait(self.interval):
+            try:
+                self.run_once()
+            except sqlite3.Error as e:
+                print(f"[QueuePruner] Lỗi prune queue: {e}")
+
+    def start(self) -> "QueuePruner":
+        if self._thread is None or not self._thread.is_alive():
+            self._stop_event.clear()
+            self._thread = threading.Thread(target=self._loop, name="QueuePruner", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout: Optional[float] = 5.0) -> None:
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+
+class SequenceAllocator:
+    """
+    Cấp số nguyên tăng dần từ sequence trong queues.db, giữ chỗ theo block (reserve_sequence) rồi
+    cấp từ bộ nhớ: chỉ 1 transaction mỗi block_size giá trị.
+
+    - Không bao giờ cấp trùng, kể cả nhiều allocator / nhiều process trên cùng DB (block rời nhau)
+    - Tăng dần trong 1 allocator và qua các lần restart (phần còn lại của block cũ bị bỏ qua,
+      nên dãy có thể có khoảng trống tối đa block_size - 1)
+    """
+
+    def __init__(self, queue: SQLiteQueue, name: str, block_size: int = 100, floor: int = 1) -> None:
+        self.queue = queue
+        self.name = name
+        self.block_size = block_size
+        self.floor = floor
+        self._next = 0
+        self._end = 0
+        self._lock = threading.Lock()
+
+    def allocate(self) -> int:
+        with self._lock:
+            if self._next >= self._end:
+                self._next = self.queue.reserve_sequence(self.name, self.block_size, self.floor)
+                self._end = self._next + self.block_size
+            value = self._next
+            self._next += 1
+            return value
 
 
-__all__ = ["SQLiteQueue"]
\ No newline at end of file
+__all__ = ["SQLiteQueue", "Subscription", "QueuePruner", "SequenceAllocator", "DEFAULT_RETENTION"]
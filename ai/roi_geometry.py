@@ -0,0 +1,235 @@
+"""
+Hình học ROI biên dịch sẵn cho ROIProcessor.
+
+CompiledROI được dựng 1 lần mỗi khi ROI config của camera thay đổi (update_roi_cache):
+- Cạnh polygon của mọi slot dồn vào mảng numpy (S, K) (polygon ít đỉnh hơn được đệm cạnh suy biến)
+- Bounding box từng slot để lọc nhanh cặp (detection, slot) trước khi ray-cast
+- bbox / center của detection "empty" từng slot tính sẵn (trước đây tính lại mỗi frame)
+
+contains() ray-cast cùng lúc cho tất cả detection, cho kết quả giống hệt
+ROIVisualizer._is_point_in_polygon (cùng quy tắc biên, cùng thứ tự phép tính).
+
+ROILabelMask (tuỳ chọn, camera nhiều slot): ảnh nhãn uint16 theo frame_shape, tra slot của mỗi
+center bằng 1 phép index mảng. Pixel gần cạnh polygon hoặc thuộc nhiều slot được đánh dấu
+AMBIGUOUS và tra lại bằng ray-cast, nên kết quả vẫn giống hệt contains().
+"""
+
+import math
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import cv2
+import numpy as np
+
+# Nhãn pixel cần tra lại bằng ray-cast (sát cạnh polygon hoặc thuộc nhiều slot)
+AMBIGUOUS = np.iinfo(np.uint16).max
+# Giới hạn số pixel của label mask mỗi camera (~2MB uint16); frame lớn hơn thì mask được thu nhỏ
+DEFAULT_MAX_MASK_PIXELS = 1280 * 720
+# Số điểm AMBIGUOUS tối đa được ray-cast từng điểm bằng Python (nhiều hơn thì dùng contains() vector hoá)
+_SCALAR_FALLBACK_MAX = 16
+# Số bit phân số toạ độ khi vẽ polygon bằng cv2 (vẽ chính xác dưới pixel khi mask bị thu nhỏ)
+_DRAW_SHIFT = 4
+
+
+def _point_in_polygon(x: float, y: float, polygon: List[List[float]]) -> bool:
+    """Ray-cast 1 điểm (cùng quy tắc với ROIVisualizer._is_point_in_polygon)"""
+    n = len(polygon)
+    inside = False
+    p1x, p1y = polygon[0]
+    for i in range(1, n + 1):
+        p2x, p2y = polygon[i % n]
+        if min(p1y, p2y) < y <= max(p1y, p2y) and p1y != p2y:
+            if x <= (y - p1y) * (p2x - p1x) / (p2y - p1y) + p1x:
+                inside = not inside
+        p1x, p1y = p2x, p2y
+    return inside
+
+
+class ROILabelMask:
+    """Ảnh nhãn slot: 0 = ngoài mọi slot, k = chỉ thuộc slot k-1, AMBIGUOUS = cần ray-cast"""
+
+    def __init__(self, polygons: List[np.ndarray], height: int, width: int,
+                 max_pixels: int = DEFAULT_MAX_MASK_PIXELS) -> None:
+        if len(polygons) >= AMBIGUOUS:
+            raise ValueError(f"Label mask hỗ trợ tối đa {AMBIGUOUS - 1} slot")
+        self.height = int(height)
+        self.width = int(width)
+        # Thu nhỏ mask để bộ nhớ mỗi camera không vượt max_pixels
+        self.scale = max(1, math.ceil(math.sqrt(self.height * self.width / max_pixels)))
+        mask_h = math.ceil(self.height / self.scale)
+        mask_w = math.ceil(self.width / self.scale)
+
+        self.labels = np.zeros((mask_h, mask_w), dtype=np.uint16)
+        cover = np.zeros((mask_h, mask_w), dtype=np.uint8)
+        border = np.zeros((mask_h, mask_w), dtype=np.uint8)
+        fill = np.zeros((mask_h, mask_w), dtype=np.uint8)
+        factor = (1 << _DRAW_SHIFT) / self.scale
+        for i, pts in enumerate(polygons):
+            if len(pts) == 0:
+                continue
+            poly = [np.round(pts * factor).astype(np.int32).reshape(-1, 1, 2)]
+            fill[:] = 0
+            cv2.fillPoly(fill, poly, 1, shift=_DRAW_SHIFT)
+            self.labels[fill > 0] = i + 1
+            cover += fill
+            # Dải 3 pixel quanh cạnh: pixel ở đây có thể chứa điểm trong lẫn ngoài polygon
+            cv2.polylines(border, poly, True, 1, thickness=3, shift=_DRAW_SHIFT)
+        self.labels[(cover > 1) | (border > 0)] = AMBIGUOUS
+
+    @property
+    def nbytes(self) -> int:
+        return self.labels.nbytes
+
+    def lookup(self, pts: np.ndarray) -> np.ndarray:
+        """Nhãn tại mỗi điểm (M, 2); điểm ngoài khung hình trả AMBIGUOUS"""
+        cols = np.floor(pts[:, 0] / self.scale).astype(np.intp)
+        rows = np.floor(pts[:, 1] / self.scale).astype(np.intp)
+        mask_h, mask_w = self.labels.shape
+        in_frame = (rows >= 0) & (rows < mask_h) & (cols >= 0) & (cols < mask_w)
+        result = np.full(len(pts), AMBIGUOUS, dtype=np.uint16)
+        result[in_frame] = self.labels[rows[in_frame], cols[in_frame]]
+        return result
+
+
+class CompiledROI:
+    """ROI slots của 1 camera dưới dạng mảng numpy"""
+
+    def __init__(self, slots: List[Dict[str, Any]]) -> None:
+        self.slots = slots
+        self.num_slots = len(slots)
+        max_edges = max((len(slot.get("points", [])) for slot in slots), default=0)
+        max_edges = max(max_edges, 1)
+
+        # Cạnh (p1 -> p2) của từng slot, đệm bằng cạnh suy biến (p1 == p2) không bao giờ cắt tia
+        edges = np.zeros((self.num_slots, max_edges, 4), dtype=np.float64)
+        # Bounding box polygon (xmin, ymin, xmax, ymax); slot không có đỉnh không chứa điểm nào
+        self.bounds = np.tile(np.array([np.inf, np.inf, -np.inf, -np.inf]), (self.num_slots, 1))
+        # bbox / center cho detection "empty" (giữ kiểu giá trị gốc của points như trước)
+        self.empty_bboxes: List[Dict[str, Any]] = []
+        self.empty_centers: List[Dict[str, Any]] = []
+        self._polygons: List[np.ndarray] = [np.empty((0, 2))] * self.num_slots
+        # Label mask dựng lazy theo frame_shape (1 mask/camera, dựng lại khi ROI hoặc kích thước frame đổi)
+        self._mask: Optional[ROILabelMask] = None
+        self.max_mask_pixels = DEFAULT_MAX_MASK_PIXELS
+
+        for i, slot in enumerate(slots):
+            points = slot.get("points", [])
+            n = len(points)
+            if n == 0:
+                self.empty_bboxes.append({"x1": 0, "y1": 0, "x2": 0, "y2": 0})
+                self.empty_centers.append({"x": 0.0, "y": 0.0})
+                continue
+            pts = np.asarray(points, dtype=np.float64).reshape(n, 2)
+            self._polygons[i] = pts
+            # Cạnh i: points[i-1] -> points[i % n], giống thứ tự duyệt của ray-cast gốc
+            edges[i, :n, 0:2] = pts
+            edges[i, :n, 2:4] = np.roll(pts, -1, axis=0)
+            edges[i, n:, 0:2] = pts[0]
+            edges[i, n:, 2:4] = pts[0]
+            self.bounds[i] = (pts[:, 0].min(), pts[:, 1].min(), pts[:, 0].max(), pts[:, 1].max())
+            self.empty_bboxes.append({
+                "x1": min(point[0] for point in points),
+                "y1": min(point[1] for point in points),
+                "x2": max(point[0] for point in points),
+                "y2": max(point[1] for point in points),
+            })
+            self.empty_centers.append({
+                "x": sum(point[0] for point in points) / n,
+                "y": sum(point[1] for point in points) / n,
+            })
+
+        self._p1x, self._p1y = edges[..., 0], edges[..., 1]
+        self._p2x, self._p2y = edges[..., 2], edges[..., 3]
+        self._ymin = np.minimum(self._p1y, self._p2y)
+        self._ymax = np.maximum(self._p1y, self._p2y)
+
+    def contains(self, points: Sequence[Sequence[float]]) -> np.ndarray:
+        """
+        Ma trận (M, S): điểm thứ m có nằm trong polygon slot s không
+
+        Args:
+            points: M điểm (x, y), thường là center của detection
+        """
+        pts = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        result = np.zeros((len(pts), self.num_slots), dtype=bool)
+        if len(pts) == 0 or self.num_slots == 0:
+            return result
+
+        x, y = pts[:, 0:1], pts[:, 1:2]
+        # Lọc theo bounding box: điểm ngoài bbox chắc chắn ngoài polygon
+        candidates = (
+            (x >= self.bounds[:, 0]) & (x <= self.bounds[:, 2])
+            & (y > self.bounds[:, 1]) & (y <= self.bounds[:, 3])
+        )
+        det_idx, slot_idx = np.nonzero(candidates)
+        if det_idx.size == 0:
+            return result
+
+        # Ray-cast cho các cặp ứng viên: (P, 1) x (P, K) cạnh
+        cx, cy = pts[det_idx, 0:1], pts[det_idx, 1:2]
+        p1x, p1y = self._p1x[slot_idx], self._p1y[slot_idx]
+        p2x, p2y = self._p2x[slot_idx], self._p2y[slot_idx]
+        crosses_y = (cy > self._ymin[slot_idx]) & (cy <= self._ymax[slot_idx])
+        with np.errstate(divide="ignore", invalid="ignore"):
+            xinters = (cy - p1y) * (p2x - p1x) / (p2y - p1y) + p1x
+        # crosses_y loại cạnh ngang nên p1y != p2y; p1x == p2x thì xinters == p1x
+        toggles = crosses_y & (cx <= xinters)
+        result[det_idx, slot_idx] = (np.count_nonzero(toggles, axis=1) % 2) == 1
+        return result
+
+    def label_mask(self, frame_shape: Tuple[int, int]) -> ROILabelMask:
+        """Label mask cho frame (height, width), dựng lần đầu hoặc khi kích thước frame đổi"""
+        height, width = int(frame_shape[0]), int(frame_shape[1])
+        if self._mask is None or (self._mask.height, self._mask.width) != (height, width):
+            self._mask = ROILabelMask(self._polygons, height, width, self.max_mask_pixels)
+        return self._mask
+
+    def _assign_polygons(self, pts: np.ndarray, excluded: np.ndarray) -> np.ndarray:
+        eligible = self.contains(pts) & ~excluded
+        return np.where(eligible.any(axis=1), eligible.argmax(axis=1), -1)
+
+    def assign(self, points: Sequence[Sequence[float]], excluded: np.ndarray,
+               frame_shape: Optional[Tuple[int, int]] = None) -> np.ndarray:
+        """
+        Slot đầu tiên (theo thứ tự config) chứa từng điểm, bỏ qua slot bị loại trừ
+
+        Args:
+            points: M điểm (x, y)
+            excluded: Mảng bool (S,) - slot không nhận detection (ví dụ đang bị block)
+            frame_shape: (height, width) - nếu có thì tra label mask, chỉ ray-cast điểm AMBIGUOUS
+
+        Returns:
+            np.ndarray (M,): chỉ số slot, -1 nếu không thuộc slot nào
+        """
+        pts = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+        if self.num_slots == 0:
+            return np.full(len(pts), -1, dtype=np.intp)
+        if frame_shape is None:
+            return self._assign_polygons(pts, excluded)
+
+        labels = self.label_mask(frame_shape).lookup(pts).astype(np.intp)
+        result = labels - 1
+        unique = (labels > 0) & (labels != AMBIGUOUS)
+        # Pixel chỉ thuộc 1 slot: slot đó bị loại trừ thì không còn slot nào khác chứa điểm
+        result[unique & excluded[np.clip(labels - 1, 0, self.num_slots - 1)]] = -1
+        fallback = np.flatnonzero(labels == AMBIGUOUS)
+        if fallback.size > _SCALAR_FALLBACK_MAX:
+            result[fallback] = self._assign_polygons(pts[fallback], excluded)
+        elif fallback.size:
+            # Ít điểm: ray-cast từng điểm với các slot có bbox chứa điểm
+            # (rẻ hơn chi phí cố định của contains() cho cả ma trận)
+            sub = pts[fallback]
+            candidates = (
+                (sub[:, 0:1] >= self.bounds[:, 0]) & (sub[:, 0:1] <= self.bounds[:, 2])
+                & (sub[:, 1:2] > self.bounds[:, 1]) & (sub[:, 1:2] <= self.bounds[:, 3])
+                & ~excluded
+            )
+            for row, (x, y), slot_row in zip(fallback.tolist(), sub.tolist(), candidates):
+                result[row] = -1
+                for i in np.flatnonzero(slot_row).tolist():
+                    if _point_in_polygon(x, y, self.slots[i]["points"]):
+                        result[row] = i
+                        break
+        return result
+
+
+__all__ = ["CompiledROI", "ROILabelMask", "AMBIGUOUS"]
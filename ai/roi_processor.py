@@ -4,26 +4,63 @@ import math
 import threading
 import json
 import os
+import zlib
 from datetime import datetime
-from typing import Dict, List, Tuple, Any, Optional, Set
+from multiprocessing import Process
+from typing import Dict, Iterable, List, Tuple, Any, Optional, Set
 import numpy as np
 import cv2
 from queue_store import SQLiteQueue
+from roi_geometry import CompiledROI
 # from roi_visualizer import ROIVisualizer, VideoDisplayManager
 from optimized_roi_visualizer import ROIVisualizer, VideoDisplayManager
 
+
+def camera_shard(camera_id: str, num_shards: int) -> int:
+    """Shard sở hữu camera (crc32 ổn định giữa các process, khác với hash() của Python)"""
+    return zlib.crc32(camera_id.encode("utf-8")) % num_shards
+
+
+def roi_shard_worker(shard_index: int, num_shards: int, db_path: str, use_label_mask: bool = False) -> None:
+    """Process worker: ROIProcessor chỉ xử lý các camera có camera_shard() == shard_index"""
+    processor = ROIProcessor(db_path, show_video=False, use_label_mask=use_label_mask,
+                             shard=(shard_index, num_shards))
+    processor.run()
+
+
 class ROIProcessor:
-    def __init__(self, db_path: str = "queues.db", show_video: bool = True):
+    # Thời gian tối đa (giây) mỗi subscriber chờ message mới trước khi kiểm tra lại self.running
+    SUBSCRIBE_POLL_TIMEOUT = 1.0
+    # Chu kỳ (giây) process cha làm mới roi_detection mới nhất từ bảng latest để hiển thị (chế độ nhiều worker)
+    DISPLAY_REFRESH_INTERVAL = 0.2
+
+    def __init__(self, db_path: str = "queues.db", show_video: bool = True, use_label_mask: bool = False,
+                 num_workers: int = 1, shard: Optional[Tuple[int, int]] = None,
+                 pairing_config_path: Optional[str] = None):
         """
         Khởi tạo ROI Processor
         
         Args:
             db_path: Đường dẫn đến database SQLite
             show_video: Hiển thị video real-time
+            use_label_mask: Tra slot bằng label mask uint16 theo frame_shape (camera nhiều slot)
+            num_workers: Số process worker lọc ROI (> 1: chia camera theo shard, process này chỉ
+                giám sát worker và hiển thị video)
+            shard: (shard_index, num_shards) khi chạy trong process worker (None = mọi camera)
+            pairing_config_path: File slot_pairing_config.json (mặc định logic/ theo thư mục hiện tại)
         """
+        self.db_path = db_path
         self.queue = SQLiteQueue(db_path)
+        self.num_workers = max(1, num_workers)
+        self.shard_index, self.num_shards = shard or (0, 1)
+        self.workers: List[Process] = []
+        # Threads trạng thái khi chạy như stage trong process khác (start_inline)
+        self._inline_threads: List[threading.Thread] = []
         # Cache ROI theo camera_id: {camera_id: [slots]}
         self.roi_cache: Dict[str, List[Dict[str, Any]]] = {}
+        # ROI đã biên dịch sang numpy theo camera_id (dựng lại mỗi khi roi_cache thay đổi)
+        self.roi_geometry: Dict[str, CompiledROI] = {}
+        self.use_label_mask = use_label_mask
         # Lock để thread-safe (RLock để tránh deadlock khi tái nhập trong cùng thread)
         self.cache_lock = threading.RLock()
         # Running flag
@@ -36,8 +73,8 @@ class ROIProcessor:
         self.frame_cache: Dict[str, np.ndarray] = {}
         # ROI Visualizer
         self.roi_visualizer = ROIVisualizer()
-        # Video Display Manager
-        self.video_display_manager = VideoDisplayManager(show_video)
+        # Video Display Manager (chỉ tạo khi hiển thị video: manager tự mở queues.db và load cấu hình camera)
+        self.video_display_manager = VideoDisplayManager(show_video) if show_video else None
         # Latest detection data cho mỗi camera
         self.latest_detections: Dict[str, Dict[str, Any]] = {}
         # Latest ROI detection data cho mỗi camera (bao gồm empty)
@@ -49,7 +86,7 @@ class ROIProcessor:
         # Mapping qr_code -> (camera_id, slot_number)
         self.qr_to_slot: Dict[int, Tuple[str, int]] = {}
         # Đường dẫn file pairing config
-        self.pairing_config_path: str = os.path.join("logic", "slot_pairing_config.json")
+        self.pairing_config_path: str = pairing_config_path or os.path.join("logic", "slot_pairing_config.json")
         # Tải mapping ban đầu (nếu có)
         self._load_qr_mapping()
         
@@ -83,6 +120,10 @@ class ROIProcessor:
         except Exception as e:
             print(f"Lỗi khi load pairing config: {e}")
     
+    def owns_camera(self, camera_id: str) -> bool:
+        """Camera thuộc shard của process này (luôn True khi không chia shard)"""
+        return self.num_shards == 1 or camera_shard(camera_id, self.num_shards) == self.shard_index
+
     def _setup_end_to_start_mapping(self) -> None:
         """Thiết lập mapping từ end slot đến start slot dựa trên pairs config"""
         try:
@@ -133,6 +174,8 @@ class ROIProcessor:
             return
         
         camera_id, slot_number = end_slot
+        if not self.owns_camera(camera_id):
+            return
         
         # Khởi tạo trạng thái theo dõi cho end slot này
         with self.cache_lock:
@@ -190,6 +233,26 @@ class ROIProcessor:
         start_camera_id, start_slot_number = start_slot
         end_camera_id, end_slot_number = end_slot
         
+        if not self.owns_camera(start_camera_id):
+            # Start slot thuộc shard khác: chuyển lệnh unlock qua topic roi_slot_unlock
+            self.queue.publish("roi_slot_unlock", start_camera_id, {
+                "camera_id": start_camera_id,
+                "slot_number": start_slot_number,
+                "end_camera_id": end_camera_id,
+                "end_slot_number": end_slot_number,
+                "timestamp": datetime.now().isoformat(),
+            })
+            print(f"[UNLOCK] Chuyển unlock start slot {start_slot_number} trên {start_camera_id} sang shard "
+                  f"{camera_shard(start_camera_id, self.num_shards)}")
+            return
+        
+        self._release_start_slot(start_slot, end_slot)
+    
+    def _release_start_slot(self, start_slot: Tuple[str, int], end_slot: Tuple[str, int]) -> None:
+        """Bỏ block start slot (thuộc shard này) khi end slot tương ứng có shelf stable"""
+        start_camera_id, start_slot_number = start_slot
+        end_camera_id, end_slot_number = end_slot
+        
         # Unlock start slot
         with self.cache_lock:
             if start_camera_id in self.blocked_slots:
@@ -221,6 +284,16 @@ class ROIProcessor:
         
         camera_id, slot_number = cam_slot
         
+        if not self.owns_camera(camera_id):
+            # Start slot thuộc shard khác (shard đó tự unlock); shard này chỉ bỏ theo dõi end slot của cặp
+            with self.cache_lock:
+                for end_slot, start_slot in self.end_to_start_mapping.items():
+                    if start_slot == cam_slot and end_slot in self.end_slot_states:
+                        del self.end_slot_states[end_slot]
+                        print(f"[UNLOCK_BY_QR] Đã xóa end slot {end_slot} khỏi monitoring")
+                        break
+            return
+        
         # Unlock start slot
         with self.cache_lock:
             if camera_id in self.blocked_slots:
@@ -301,19 +374,26 @@ class ROIProcessor:
         
         return False
     
-    def filter_detections_by_roi(self, detections: List[Dict[str, Any]], camera_id: str) -> List[Dict[str, Any]]:
+    def filter_detections_by_roi(self, detections: List[Dict[str, Any]], camera_id: str,
+                                 frame_shape: Optional[Dict[str, int]] = None) -> List[Dict[str, Any]]:
         """
         Lọc detections theo ROI và thêm "empty" cho ROI không có shelf hoặc confidence < 0.5
         
         Args:
             detections: Danh sách detections
             camera_id: ID của camera
+            frame_shape: {height, width} của frame - khi bật use_label_mask sẽ tra slot qua label mask
             
         Returns:
             Danh sách detections đã được lọc
         """
         with self.cache_lock:
             roi_slots = self.roi_cache.get(camera_id, [])
+            geometry = self.roi_geometry.get(camera_id)
+            if roi_slots and (geometry is None or geometry.slots is not roi_slots):
+                # roi_cache được gán không qua update_roi_cache -> biên dịch lại
+                geometry = self.roi_geometry[camera_id] = CompiledROI(roi_slots)
+            blocked = dict(self.blocked_slots.get(camera_id, {}))
         
         if not roi_slots:
             return []
@@ -324,41 +404,40 @@ class ROIProcessor:
         roi_has_shelf = [False] * len(roi_slots)  # Track xem ROI nào có shelf (không tính ROI bị block)
         
         # Lọc detections có trong ROI và là shelf với confidence >= 0.5
-        for detection in detections:
-            if detection.get("class_name") == "shelf" and detection.get("confidence", 0) >= 0.5:
-                for i, slot in enumerate(roi_slots):
-                    if self.is_detection_in_roi(detection, [slot]):
-                        # Nếu slot này đang bị block thì bỏ qua shelf này (để cuối cùng sẽ thêm empty)
-                        if self.blocked_slots.get(camera_id, {}).get(i + 1):
-                            # Bị block: không đánh dấu roi_has_shelf -> sẽ tạo empty
-                            continue
-                        # Gắn slot_number cho detection thuộc ROI i
-                        detection_with_slot = dict(detection)
-                        detection_with_slot["slot_number"] = i + 1
-                        filtered_detections.append(detection_with_slot)
-                        roi_has_shelf[i] = True
-                        break
+        shelves = [
+            detection for detection in detections
+            if detection.get("class_name") == "shelf" and detection.get("confidence", 0) >= 0.5
+        ]
+        if shelves:
+            # Slot bị block không nhận shelf (để cuối cùng sẽ thêm empty)
+            excluded = np.array([bool(blocked.get(i + 1)) for i in range(len(roi_slots))], dtype=bool)
+            centers = [(d["center"]["x"], d["center"]["y"]) for d in shelves]
+            mask_shape = None
+            if self.use_label_mask and frame_shape and frame_shape.get("height") and frame_shape.get("width"):
+                mask_shape = (frame_shape["height"], frame_shape["width"])
+            # Mỗi shelf gán vào slot đầu tiên (không bị block) chứa center, ray-cast cho cả batch 1 lần
+            for detection, i in zip(shelves, geometry.assign(centers, excluded, mask_shape).tolist()):
+                if i < 0:
+                    continue
+                # Gắn slot_number cho detection thuộc ROI i
+                detection_with_slot = dict(detection)
+                detection_with_slot["slot_number"] = i + 1
+                filtered_detections.append(detection_with_slot)
+                roi_has_shelf[i] = True
         
         # Thêm "empty" cho các ROI không có shelf hoặc confidence < 0.5
         for i, slot in enumerate(roi_slots):
             slot_number = i + 1
             # Nếu bị block hoặc không có shelf -> tạo empty
-            if (slot_number) in self.blocked_slots.get(camera_id, {}) or not roi_has_shelf[i]:
+            if (slot_number) in blocked or not roi_has_shelf[i]:
                 # Tạo detection "empty" cho ROI này và gắn slot_number
                 empty_detection = {
                     "class_name": "empty",
                     "confidence": 1.0,
                     "class_id": -1,
-                    "bbox": {
-                        "x1": min(point[0] for point in slot["points"]),
-                        "y1": min(point[1] for point in slot["points"]),
-                        "x2": max(point[0] for point in slot["points"]),
-                        "y2": max(point[1] for point in slot["points"])
-                    },
-                    "center": {
-                        "x": sum(point[0] for point in slot["points"]) / len(slot["points"]),
-                        "y": sum(point[1] for point in slot["points"]) / len(slot["points"])
-                    },
+                    # bbox/center của slot tính sẵn khi biên dịch ROI
+                    "bbox": dict(geometry.empty_bboxes[i]),
+                    "center": dict(geometry.empty_centers[i]),
                     "slot_number": slot_number,
                 }
                 filtered_detections.append(empty_detection)
@@ -378,37 +457,20 @@ class ROIProcessor:
         # Thiết lập end_to_start mapping
         self._setup_end_to_start_mapping()
         
-        # track latest global id for the topic
-        last_global_id: int = 0
-        try:
-            with self.queue._connect() as conn:
-                cur = conn.execute(
-                    "SELECT id FROM messages WHERE topic = ? ORDER BY id DESC LIMIT 1",
-                    ("stable_pairs",),
-                )
-                row = cur.fetchone()
-                if row:
-                    last_global_id = row[0]
-        except Exception as e:
-            print(f"Lỗi khi khởi tạo stable_pairs cursor: {e}")
+        # Cursor bắt đầu từ message mới nhất hiện có, poll() chờ đến khi có message mới
+        subscription = None
+        while self.running and subscription is None:
+            try:
+                subscription = self.queue.subscribe("stable_pairs", start="latest", batch_size=200)
+            except Exception as e:
+                print(f"Lỗi khi khởi tạo stable_pairs cursor: {e}")
+                time.sleep(1.0)
 
         while self.running:
             try:
-                with self.queue._connect() as conn:
-                    cur = conn.execute(
-                        """
-                        SELECT id, payload FROM messages
-                        WHERE topic = ? AND id > ?
-                        ORDER BY id ASC
-                        LIMIT 200
-                        """,
-                        ("stable_pairs", last_global_id),
-                    )
-                    rows = cur.fetchall()
+                rows = subscription.poll(timeout=self.SUBSCRIBE_POLL_TIMEOUT)
                 for r in rows:
-                    msg_id = r[0]
-                    payload = json.loads(r[1]) if isinstance(r[1], str) else r[1]
-                    last_global_id = msg_id
+                    payload = r["payload"]
                     
                     # stable_pairs payload: { pair_id, start_slot: str(start_qr), end_slot: str(end_qr), ... }
                     start_qr_str = payload.get("start_slot")
@@ -427,11 +489,13 @@ class ROIProcessor:
                             continue
                         cam_id, slot_number = cam_slot
                         expire_at = self.block_seconds  # vô thời hạn
-                        with self.cache_lock:
-                            if cam_id not in self.blocked_slots:
-                                self.blocked_slots[cam_id] = {}
-                            self.blocked_slots[cam_id][slot_number] = expire_at
-                            print(f"[BLOCK] Đã block ROI slot {slot_number} trên {cam_id} (vô thời hạn) do start_qr={start_qr}")
+                        # Chỉ shard sở hữu camera giữ trạng thái block (end_qr bên dưới vẫn xử lý)
+                        if self.owns_camera(cam_id):
+                            with self.cache_lock:
+                                if cam_id not in self.blocked_slots:
+                                    self.blocked_slots[cam_id] = {}
+                                self.blocked_slots[cam_id][slot_number] = expire_at
+                                print(f"[BLOCK] Đã block ROI slot {slot_number} trên {cam_id} (vô thời hạn) do start_qr={start_qr}")
                     
                     # Xử lý end_qr (bắt đầu theo dõi)
                     if end_qr_str:
@@ -443,8 +507,6 @@ class ROIProcessor:
                         self._load_qr_mapping()
                         # Thêm end slot vào danh sách theo dõi
                         self._add_end_slot_monitoring(end_qr)
-                        
-                time.sleep(0.2)
             except Exception as e:
                 print(f"Lỗi khi subscribe stable_pairs: {e}")
                 time.sleep(1.0)
@@ -453,37 +515,20 @@ class ROIProcessor:
         """Subscribe topic unlock_start_slot để nhận lệnh unlock ROI sau khi POST thất bại."""
         print("Bắt đầu subscribe unlock_start_slot để nhận lệnh unlock ROI...")
         
-        # track latest global id for the topic
-        last_global_id: int = 0
-        try:
-            with self.queue._connect() as conn:
-                cur = conn.execute(
-                    "SELECT id FROM messages WHERE topic = ? ORDER BY id DESC LIMIT 1",
-                    ("unlock_start_slot",),
-                )
-                row = cur.fetchone()
-                if row:
-                    last_global_id = row[0]
-        except Exception as e:
-            print(f"Lỗi khi khởi tạo unlock_start_slot cursor: {e}")
+        # Cursor bắt đầu từ message mới nhất hiện có, poll() chờ đến khi có message mới
+        subscription = None
+        while self.running and subscription is None:
+            try:
+                subscription = self.queue.subscribe("unlock_start_slot", start="latest", batch_size=200)
+            except Exception as e:
+                print(f"Lỗi khi khởi tạo unlock_start_slot cursor: {e}")
+                time.sleep(1.0)
 
         while self.running:
             try:
-                with self.queue._connect() as conn:
-                    cur = conn.execute(
-                        """
-                        SELECT id, payload FROM messages
-                        WHERE topic = ? AND id > ?
-                        ORDER BY id ASC
-                        LIMIT 200
-                        """,
-                        ("unlock_start_slot", last_global_id),
-                    )
-                    rows = cur.fetchall()
+                rows = subscription.poll(timeout=self.SUBSCRIBE_POLL_TIMEOUT)
                 for r in rows:
-                    msg_id = r[0]
-                    payload = json.loads(r[1]) if isinstance(r[1], str) else r[1]
-                    last_global_id = msg_id
+                    payload = r["payload"]
                     
                     # unlock_start_slot payload: { pair_id, start_slot: str(start_qr), reason, timestamp }
                     start_qr_str = payload.get("start_slot")
@@ -498,12 +543,34 @@ class ROIProcessor:
                         
                         # Unlock start slot theo QR code
                         self._unlock_start_by_qr(start_qr, reason=reason)
-                        
-                time.sleep(0.2)
             except Exception as e:
                 print(f"Lỗi khi subscribe unlock_start_slot: {e}")
                 time.sleep(1.0)
     
+    def _subscribe_slot_unlock(self) -> None:
+        """Subscribe topic roi_slot_unlock: lệnh unlock start slot do shard khác (sở hữu end slot) gửi sang."""
+        subscription = None
+        while self.running and subscription is None:
+            try:
+                subscription = self.queue.subscribe("roi_slot_unlock", start="latest", batch_size=200)
+            except Exception as e:
+                print(f"Lỗi khi khởi tạo roi_slot_unlock cursor: {e}")
+                time.sleep(1.0)
+
+        while self.running:
+            try:
+                for r in subscription.poll(timeout=self.SUBSCRIBE_POLL_TIMEOUT):
+                    payload = r["payload"]
+                    if not self.owns_camera(r["key"]):
+                        continue
+                    self._release_start_slot(
+                        (payload["camera_id"], int(payload["slot_number"])),
+                        (payload["end_camera_id"], int(payload["end_slot_number"])),
+                    )
+            except Exception as e:
+                print(f"Lỗi khi subscribe roi_slot_unlock: {e}")
+                time.sleep(1.0)
+    
     def update_roi_cache(self, camera_id: str, roi_data: Dict[str, Any]) -> None:
         """
         Cập nhật ROI cache
@@ -514,6 +581,7 @@ class ROIProcessor:
         """
         with self.cache_lock:
             self.roi_cache[camera_id] = roi_data.get("slots", [])
+            self.roi_geometry[camera_id] = CompiledROI(self.roi_cache[camera_id])
             print(f"Đã cập nhật ROI cache cho camera {camera_id}: {len(self.roi_cache[camera_id])} slots")
     
     def process_detection(self, detection_data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
@@ -530,7 +598,7 @@ class ROIProcessor:
         detections = detection_data["detections"]
         
         # Lọc detections theo ROI (sẽ luôn có kết quả cho mỗi ROI)
-        filtered_detections = self.filter_detections_by_roi(detections, camera_id)
+        filtered_detections = self.filter_detections_by_roi(detections, camera_id, detection_data.get("frame_shape"))
         
         # Tạo payload cho roi_detection_queue
         roi_detection_payload = {
@@ -545,6 +613,38 @@ class ROIProcessor:
         
         return roi_detection_payload
     
+    def process_batch(self, detections: Iterable[Tuple[str, Dict[str, Any]]]) -> List[Tuple[str, Dict[str, Any]]]:
+        """
+        Xử lý 1 lô detection data (raw_detection payload) của nhiều camera
+        
+        Args:
+            detections: [(camera_id, detection_data), ...]
+            
+        Returns:
+            [(camera_id, roi_detection_payload), ...] để publish_many("roi_detection", ...);
+            bỏ qua camera chưa có ROI config
+        """
+        roi_messages = []
+        for camera_id, detection_data in detections:
+            # Chỉ xử lý camera có ROI config
+            with self.cache_lock:
+                if camera_id not in self.roi_cache:
+                    continue
+            
+            # Lưu detection data để hiển thị video
+            with self.cache_lock:
+                self.latest_detections[camera_id] = detection_data
+            
+            # Xử lý detection (luôn có kết quả cho mỗi ROI)
+            roi_detection_payload = self.process_detection(detection_data)
+            
+            # Lưu ROI detection data để hiển thị video (bao gồm empty)
+            with self.cache_lock:
+                self.latest_roi_detections[camera_id] = roi_detection_payload
+            
+            roi_messages.append((camera_id, roi_detection_payload))
+        return roi_messages
+    
     def draw_roi_on_frame(self, frame: np.ndarray, camera_id: str) -> np.ndarray:
         """
         Vẽ ROI lên frame (delegate to roi_visualizer)
@@ -651,36 +751,28 @@ class ROIProcessor:
         """
         print("Bắt đầu subscribe ROI config queue...")
         
-        # Lấy tất cả camera IDs đã có ROI config
-        with self.queue._connect() as conn:
-            cur = conn.execute(
-                "SELECT DISTINCT key FROM messages WHERE topic = 'roi_config' ORDER BY key"
-            )
-            camera_ids = [row[0] for row in cur.fetchall()]
-        
-        # Load ROI config cho mỗi camera
-        for camera_id in camera_ids:
-            roi_data = self.queue.get_latest("roi_config", camera_id)
-            if roi_data:
-                self.update_roi_cache(camera_id, roi_data)
-        
-        print(f"Đã load ROI config cho {len(camera_ids)} cameras: {camera_ids}")
-        
-        # Monitor cho ROI config updates
+        # Lấy ROI config mới nhất của mọi camera từ bảng latest (1 query)
+        latest_rows = {
+            camera_id: row for camera_id, row in self.queue.get_latest_all("roi_config").items()
+            if self.owns_camera(camera_id)
+        }
         last_roi_ids = {}
-        for camera_id in camera_ids:
-            roi_data = self.queue.get_latest_row("roi_config", camera_id)
-            if roi_data:
-                last_roi_ids[camera_id] = roi_data["id"]
+        for camera_id, roi_row in latest_rows.items():
+            self.update_roi_cache(camera_id, roi_row["payload"])
+            last_roi_ids[camera_id] = roi_row["id"]
+        
+        print(f"Đã load ROI config cho {len(latest_rows)} cameras: {list(latest_rows)}")
         
+        # Monitor cho ROI config updates (kể cả camera mới có ROI config sau khi khởi động)
         while self.running:
             try:
-                for camera_id in camera_ids:
-                    # Kiểm tra ROI config mới
-                    roi_data = self.queue.get_latest_row("roi_config", camera_id)
-                    if roi_data and roi_data["id"] > last_roi_ids.get(camera_id, 0):
-                        self.update_roi_cache(camera_id, roi_data["payload"])
-                        last_roi_ids[camera_id] = roi_data["id"]
+                for camera_id, roi_id in self.queue.get_latest_ids("roi_config").items():
+                    # Chỉ decode payload khi camera (thuộc shard này) có ROI config mới
+                    if roi_id > last_roi_ids.get(camera_id, 0) and self.owns_camera(camera_id):
+                        roi_data = self.queue.get_latest_row("roi_config", camera_id)
+                        if roi_data:
+                            self.update_roi_cache(camera_id, roi_data["payload"])
+                            last_roi_ids[camera_id] = roi_data["id"]
                 
                 time.sleep(1)  # Check mỗi giây
                 
@@ -694,96 +786,128 @@ class ROIProcessor:
         """
         print("Bắt đầu subscribe raw detection queue...")
         
-        # Lấy tất cả camera IDs
-        with self.queue._connect() as conn:
-            cur = conn.execute(
-                "SELECT DISTINCT key FROM messages WHERE topic = 'raw_detection' ORDER BY key"
-            )
-            camera_ids = [row[0] for row in cur.fetchall()]
-        
-        if not camera_ids:
-            print("Không tìm thấy camera nào trong raw_detection queue")
-            return
-        
-        # Track last processed ID cho mỗi camera
-        last_detection_ids = {}
-        for camera_id in camera_ids:
-            detection_data = self.queue.get_latest_row("raw_detection", camera_id)
-            if detection_data:
-                last_detection_ids[camera_id] = detection_data["id"]
-        
-        print(f"Đang monitor {len(camera_ids)} cameras: {camera_ids}")
+        # Một cursor cho cả topic (mọi camera, kể cả camera mới xuất hiện sau khi khởi động),
+        # bắt đầu từ message mới nhất hiện có. Khi chia shard, chỉ đọc (và decode) message của
+        # các camera thuộc shard đã có ROI config.
+        sharded = self.num_shards > 1
+        with self.cache_lock:
+            keys = sorted(self.roi_cache) if sharded else None
+        subscription = self.queue.subscribe("raw_detection", start="latest", batch_size=200, keys=keys)
+        print(f"Đang monitor raw_detection từ id={subscription.cursor}")
         
         while self.running:
             try:
-                for camera_id in camera_ids:
-                    # Chỉ xử lý camera có ROI config
+                if sharded:
                     with self.cache_lock:
-                        if camera_id not in self.roi_cache:
-                            continue
-                    
-                    # Lấy detections mới
-                    new_detections = self.queue.get_after_id(
-                        "raw_detection", 
-                        camera_id, 
-                        last_detection_ids.get(camera_id, 0),
-                        limit=10
-                    )
-                    
-                    for detection_row in new_detections:
-                        detection_data = detection_row["payload"]
-                        last_detection_ids[camera_id] = detection_row["id"]
-                        
-                        # Lưu detection data để hiển thị video
-                        with self.cache_lock:
-                            self.latest_detections[camera_id] = detection_data
-                        
-                        # Xử lý detection (luôn có kết quả cho mỗi ROI)
-                        roi_detection_payload = self.process_detection(detection_data)
-                        
-                        # Lưu ROI detection data để hiển thị video (bao gồm empty)
-                        with self.cache_lock:
-                            self.latest_roi_detections[camera_id] = roi_detection_payload
-                        
-                        # Push vào roi_detection_queue
-                        self.queue.publish("roi_detection", camera_id, roi_detection_payload)
-                        
-                        # Đếm số shelf và empty
-                        shelf_count = sum(1 for d in roi_detection_payload['roi_detections'] if d['class_name'] == 'shelf')
-                        empty_count = sum(1 for d in roi_detection_payload['roi_detections'] if d['class_name'] == 'empty')
-                        
-                        # Hiển thị thông tin với video source
-                        video_mapping = {
-                            "cam-1": "hanam.mp4",
-                            "cam-2": "vinhPhuc.mp4"
-                        }
-                        video_name = video_mapping.get(camera_id, "unknown")
-                        
-                        # print(f"Camera {camera_id} ({video_name}) - Frame {detection_data['frame_id']}: "
-                            #   f"Shelf: {shelf_count}, Empty: {empty_count}, Total ROI: {roi_detection_payload['roi_detection_count']}")
+                        subscription.keys = sorted(self.roi_cache)
+                # Chờ đến khi có detection mới (không sleep-poll)
+                new_detections = subscription.poll(timeout=self.SUBSCRIBE_POLL_TIMEOUT)
                 
-                time.sleep(0.1)  # Check mỗi 100ms
+                # Ghi roi_detection của cả lô trong 1 transaction
+                roi_messages = self.process_batch((row["key"], row["payload"]) for row in new_detections)
+                self.queue.publish_many("roi_detection", roi_messages)
                 
             except Exception as e:
                 print(f"Lỗi khi subscribe raw detection: {e}")
                 time.sleep(1)
     
+    def _refresh_latest_roi_detections(self) -> None:
+        """Chế độ nhiều worker: lấy roi_detection mới nhất của mỗi camera từ bảng latest để hiển thị"""
+        last_ids: Dict[str, int] = {}
+        while self.running:
+            try:
+                for camera_id, row_id in self.queue.get_latest_ids("roi_detection").items():
+                    if row_id > last_ids.get(camera_id, 0):
+                        row = self.queue.get_latest_row("roi_detection", camera_id)
+                        if row:
+                            with self.cache_lock:
+                                self.latest_roi_detections[camera_id] = row["payload"]
+                            last_ids[camera_id] = row["id"]
+            except Exception as e:
+                print(f"Lỗi khi đọc roi_detection mới nhất: {e}")
+            time.sleep(self.DISPLAY_REFRESH_INTERVAL)
+    
+    def _start_worker(self, shard_index: int) -> Process:
+        worker = Process(
+            target=roi_shard_worker,
+            args=(shard_index, self.num_workers, self.db_path, self.use_label_mask),
+            name=f"roi-shard-{shard_index}",
+            daemon=True,
+        )
+        worker.start()
+        return worker
+    
+    def _supervise_workers(self) -> None:
+        """Khởi động lại worker bị chết (camera của shard đó sẽ ngừng có roi_detection nếu không restart)"""
+        for shard_index, worker in enumerate(self.workers):
+            if not worker.is_alive():
+                print(f"[ROI_WORKER] Shard {shard_index} đã dừng (exitcode={worker.exitcode}), khởi động lại...")
+                self.workers[shard_index] = self._start_worker(shard_index)
+    
+    def _stop_workers(self, timeout: float = 5.0) -> None:
+        # Worker nhận SIGINT cùng lúc khi Ctrl+C; terminate các worker còn sống sau timeout
+        deadline = time.time() + timeout
+        for worker in self.workers:
+            worker.join(max(0.0, deadline - time.time()))
+        for worker in self.workers:
+            if worker.is_alive():
+                worker.terminate()
+                worker.join(1.0)
+        self.workers = []
+    
+    def _state_threads(self) -> List[threading.Thread]:
+        """Threads cập nhật trạng thái lọc: ROI config, block (stable_pairs) và unlock start slot"""
+        threads = [
+            threading.Thread(target=self.subscribe_roi_config, daemon=True),
+            threading.Thread(target=self._subscribe_stable_pairs, daemon=True),
+            threading.Thread(target=self._subscribe_unlock_start_slot, daemon=True),
+        ]
+        if self.num_shards > 1:
+            # Nhận lệnh unlock start slot từ shard sở hữu end slot
+            threads.append(threading.Thread(target=self._subscribe_slot_unlock, daemon=True))
+        return threads
+    
+    def start_inline(self) -> None:
+        """
+        Chạy ROIProcessor như 1 stage trong process khác (vd. ai_inference_worker): chỉ khởi động
+        threads cập nhật trạng thái, detection được đưa vào trực tiếp qua process_batch()
+        thay vì subscribe raw_detection.
+        """
+        self.running = True
+        self._inline_threads = self._state_threads()
+        for thread in self._inline_threads:
+            thread.start()
+    
+    def stop_inline(self, timeout: float = 2.0) -> None:
+        """Dừng threads của start_inline() và đóng queue"""
+        self.running = False
+        for thread in self._inline_threads:
+            thread.join(timeout)
+        self._inline_threads = []
+        self.queue.close()
+    
     def run(self) -> None:
         """
         Chạy ROI processor
         """
         self.running = True
         
-        # Tạo threads cho ROI config, raw detection, stable_pairs, unlock_start_slot và video display
-        roi_thread = threading.Thread(target=self.subscribe_roi_config, daemon=True)
-        detection_thread = threading.Thread(target=self.subscribe_raw_detection, daemon=True)
-        stable_pairs_thread = threading.Thread(target=self._subscribe_stable_pairs, daemon=True)
-        unlock_thread = threading.Thread(target=self._subscribe_unlock_start_slot, daemon=True)
-        
-        roi_thread.start()
-        detection_thread.start()
-        stable_pairs_thread.start()
-        unlock_thread.start()
+        if self.num_workers > 1:
+            # Lọc ROI chạy trong các process worker (mỗi worker 1 shard camera), process này
+            # chỉ giám sát worker và (nếu bật) hiển thị video từ roi_detection trong queue
+            self.workers = [self._start_worker(i) for i in range(self.num_workers)]
+            print(f"Đã khởi động {self.num_workers} ROI worker (chia camera theo crc32(camera_id) % {self.num_workers})")
+            threads = []
+            if self.show_video:
+                threads.append(threading.Thread(target=self.subscribe_roi_config, daemon=True))
+                threads.append(threading.Thread(target=self._refresh_latest_roi_detections, daemon=True))
+        else:
+            # Tạo threads cho ROI config, stable_pairs, unlock_start_slot, raw detection và video display
+            threads = self._state_threads()
+            threads.append(threading.Thread(target=self.subscribe_raw_detection, daemon=True))
+        
+        for thread in threads:
+            thread.start()
         
         # Thread cho video display
         if self.show_video:
@@ -807,16 +931,22 @@ class ROIProcessor:
         try:
             while self.running:
                 time.sleep(1)
+                if self.workers:
+                    self._supervise_workers()
         except KeyboardInterrupt:
             print("\nĐang dừng ROI Processor...")
             self.running = False
         
+        self._stop_workers()
+        
         # Đóng video captures
         for cap in self.video_captures.values():
             cap.release()
         
         # Dừng video display manager
-        self.video_display_manager.stop()
+        if self.video_display_manager is not None:
+            self.video_display_manager.stop()
+        self.queue.close()
         
         print("ROI Processor đã dừng")
 
@@ -828,6 +958,10 @@ def parse_args():
                        help="Đường dẫn đến database SQLite")
     parser.add_argument("--no-video", action="store_true", 
                        help="Tắt hiển thị video")
+    parser.add_argument("--roi-mask", action="store_true",
+                       help="Tra slot bằng label mask (nhanh hơn khi camera có nhiều slot)")
+    parser.add_argument("--workers", type=int, default=1,
+                       help="Số process lọc ROI, camera chia theo shard (mặc định 1: chạy trong process hiện tại)")
     
     return parser.parse_args()
 
@@ -837,7 +971,8 @@ def main():
     args = parse_args()
     
     try:
-        processor = ROIProcessor(args.db_path, show_video=not args.no_video)
+        processor = ROIProcessor(args.db_path, show_video=not args.no_video, use_label_mask=args.roi_mask,
+                                 num_workers=args.workers)
         processor.run()
     except Exception as e:
         print(f"Lỗi: {e}")
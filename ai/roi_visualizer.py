@@ -394,31 +394,21 @@ class VideoDisplayManager:
             return self._roi_cache_db.get(camera_id, [])
 
         try:
-            with self.queue._connect() as conn:
-                cur = conn.execute(
-                    """
-                    SELECT id, payload FROM messages
-                    WHERE topic = 'roi_config' AND key = ?
-                    ORDER BY id DESC
-                    LIMIT 1
-                    """,
-                    (camera_id,),
-                )
-                row = cur.fetchone()
-                if not row:
-                    return self._roi_cache_db.get(camera_id, [])
-
-                row_id, payload = row
-                if self._roi_last_row_id.get(camera_id) == row_id:
-                    return self._roi_cache_db.get(camera_id, [])
-
-                data = json.loads(payload) if isinstance(payload, str) else payload
-                slots = data.get("slots", [])
-                if isinstance(slots, list):
-                    self._roi_cache_db[camera_id] = slots
-                    self._roi_last_row_id[camera_id] = row_id
-                    print(f"[ROI-DB] Đã cập nhật ROI từ DB cho {camera_id}: {len(slots)} slots (row_id={row_id})")
+            # Bảng latest: tra cứu O(1) theo (topic, key)
+            row_id = self.queue.get_latest_id("roi_config", camera_id)
+            if row_id is None or self._roi_last_row_id.get(camera_id) == row_id:
                 return self._roi_cache_db.get(camera_id, [])
+
+            row = self.queue.get_latest_row("roi_config", camera_id)
+            if not row:
+                return self._roi_cache_db.get(camera_id, [])
+
+            slots = row["payload"].get("slots", [])
+            if isinstance(slots, list):
+                self._roi_cache_db[camera_id] = slots
+                self._roi_last_row_id[camera_id] = row["id"]
+                print(f"[ROI-DB] Đã cập nhật ROI từ DB cho {camera_id}: {len(slots)} slots (row_id={row['id']})")
+            return self._roi_cache_db.get(camera_id, [])
         except Exception as e:
             print(f"[ROI-DB] Lỗi khi đọc ROI cho {camera_id}: {e}")
             return self._roi_cache_db.get(camera_id, [])
@@ -0,0 +1,119 @@
+"""
+Micro-benchmark chuyển kết quả YOLO -> payload raw_detection:
+
+- legacy: duyệt từng box, gọi .cpu().numpy() 3 lần/box (1 lần sync device mỗi trường)
+- vectorized: batch_boxes_to_numpy (1 lần copy cho cả batch) + build_detection_payload từ mảng
+
+Ví dụ (chạy từ thư mục ai/):
+    python test/bench_detection_payload.py
+    python test/bench_detection_payload.py --cameras 6 35 --detections 80 --device cuda:0
+"""
+
+import argparse
+import os
+import sys
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+import torch
+from ultralytics.engine.results import Results
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "detectObject"))
+from ai_inference import batch_boxes_to_numpy, build_detection_payload
+
+FRAME_SHAPE = (720, 1280, 3)
+NAMES = {0: "shelf", 1: "person", 2: "agv"}
+
+
+def make_batch(num_cameras, detections_per_frame, device):
+    """Sinh kết quả YOLO giả lập cảnh kệ dày đặc cho mỗi camera"""
+    rng = np.random.default_rng(0)
+    orig_img = np.zeros(FRAME_SHAPE, dtype=np.uint8)
+    batch = []
+    for _ in range(num_cameras):
+        xy = rng.uniform(0, [1180, 620], size=(detections_per_frame, 2))
+        wh = rng.uniform(40, 100, size=(detections_per_frame, 2))
+        conf = rng.uniform(0.3, 1.0, size=(detections_per_frame, 1))
+        cls = rng.integers(0, len(NAMES), size=(detections_per_frame, 1))
+        data = np.hstack([xy, xy + wh, conf, cls]).astype(np.float32)
+        boxes = torch.from_numpy(data).to(device)
+        batch.append(Results(orig_img=orig_img, path="", names=NAMES, boxes=boxes))
+    return batch
+
+
+def legacy_payloads(cam_names, frame, batch_results):
+    """Cách cũ: 3 lần .cpu().numpy() cho mỗi box"""
+    payloads = []
+    for frame_id, (cam_name, results) in enumerate(zip(cam_names, batch_results)):
+        detections = []
+        for box in results.boxes:
+            x1, y1, x2, y2 = box.xyxy[0].cpu().numpy()
+            confidence = float(box.conf[0].cpu().numpy())
+            class_id = int(box.cls[0].cpu().numpy())
+            detections.append({
+                "class_id": class_id,
+                "class_name": results.names[class_id],
+                "confidence": confidence,
+                "bbox": {"x1": float(x1), "y1": float(y1), "x2": float(x2), "y2": float(y2)},
+                "center": {"x": float((x1 + x2) / 2.0), "y": float((y1 + y2) / 2.0)},
+            })
+        payloads.append({
+            "camera_id": cam_name,
+            "frame_id": frame_id,
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "frame_shape": {"height": frame.shape[0], "width": frame.shape[1], "channels": frame.shape[2]},
+            "detections": detections,
+            "detection_count": len(detections),
+        })
+    return payloads
+
+
+def vectorized_payloads(cam_names, frame, batch_results):
+    batch_boxes = batch_boxes_to_numpy(batch_results)
+    return [
+        build_detection_payload(cam_name, frame, batch_boxes[i], results.names, frame_id=i)
+        for i, (cam_name, results) in enumerate(zip(cam_names, batch_results))
+    ]
+
+
+def timeit(func, *args, repeat):
+    func(*args)  # warmup
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func(*args)
+    return (time.perf_counter() - start) * 1000.0 / repeat
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Micro-benchmark build_detection_payload")
+    parser.add_argument("--cameras", type=int, nargs="+", default=[6, 35], help="Số camera mỗi batch")
+    parser.add_argument("--detections", type=int, default=60, help="Số detection mỗi frame (cảnh kệ dày)")
+    parser.add_argument("--device", default="cuda:0" if torch.cuda.is_available() else "cpu")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    frame = np.zeros(FRAME_SHAPE, dtype=np.uint8)
+    print(f"Device: {args.device} | detections/frame: {args.detections} | repeat: {args.repeat}")
+    print(f"{'cameras':>8} {'legacy ms':>12} {'vectorized ms':>14} {'speedup':>9}")
+    for num_cameras in args.cameras:
+        batch = make_batch(num_cameras, args.detections, args.device)
+        cam_names = [f"cam-{i + 1}" for i in range(num_cameras)]
+
+        # Kiểm tra 2 cách cho cùng kết quả
+        old = legacy_payloads(cam_names, frame, batch)
+        new = vectorized_payloads(cam_names, frame, batch)
+        for a, b in zip(old, new):
+            assert a["detection_count"] == b["detection_count"]
+            for da, db in zip(a["detections"], b["detections"]):
+                assert da["class_name"] == db["class_name"]
+                assert abs(da["bbox"]["x1"] - db["bbox"]["x1"]) < 1e-3
+
+        legacy_ms = timeit(legacy_payloads, cam_names, frame, batch, repeat=args.repeat)
+        vectorized_ms = timeit(vectorized_payloads, cam_names, frame, batch, repeat=args.repeat)
+        print(f"{num_cameras:>8} {legacy_ms:>12.2f} {vectorized_ms:>14.2f} {legacy_ms / vectorized_ms:>8.1f}x")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,101 @@
+"""
+Benchmark chi phí CPU mỗi frame của 2 chế độ truyền frame camera -> AI inference:
+
+- jpeg: resize 640x360 + encode JPEG (camera) -> decode + resize lên frame_size (AI)
+- raw:  resize 1 lần về frame_size (camera) -> đọc mảng BGR thẳng từ shared memory (AI)
+
+Ví dụ:
+    python test/bench_frame_transport.py
+    python test/bench_frame_transport.py --video video/hanam.mp4 --frames 300
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "detectObject"))
+from camera_thread import CameraThread
+from frame_ring import SharedFrameRing, TRANSPORTS, TRANSPORT_RAW, slot_bytes_for
+
+
+def load_source_frames(video_path, count, source_size):
+    """Lấy frame nguồn từ video, hoặc sinh frame tổng hợp (gradient + nhiễu) nếu không có video"""
+    frames = []
+    if video_path:
+        cap = cv2.VideoCapture(video_path)
+        while len(frames) < count:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            frames.append(frame)
+        cap.release()
+    if not frames:
+        width, height = source_size
+        rng = np.random.default_rng(0)
+        gradient = np.tile(np.linspace(0, 255, width, dtype=np.uint8), (height, 1))
+        for i in range(count):
+            noise = rng.integers(0, 32, size=(height, width, 3), dtype=np.uint8)
+            frame = np.dstack([gradient, np.roll(gradient, i * 7, axis=1), gradient[::-1]]) // 2 + noise
+            frames.append(frame.astype(np.uint8))
+    return frames
+
+
+def bench_transport(transport, frames, frame_size):
+    """Trả về (cpu_ms_camera, cpu_ms_ai) trung bình mỗi frame"""
+    ring = SharedFrameRing(["bench"], num_slots=3, slot_bytes=slot_bytes_for(transport, frame_size))
+    camera = CameraThread("bench", None, ring, transport=transport, frame_size=frame_size)
+    target_width, target_height = frame_size
+    camera_cpu = 0.0
+    ai_cpu = 0.0
+    try:
+        for frame in frames:
+            # Phía camera: chuẩn bị frame + ghi vào ring
+            start = time.process_time()
+            ring["bench"] = {"frame": camera._prepare_frame(frame), "ts": time.time(), "status": "ok"}
+            camera_cpu += time.process_time() - start
+
+            # Phía AI: đọc frame từ ring thành mảng BGR kích thước frame_size
+            start = time.process_time()
+            view = ring.read_latest("bench")
+            model_input = ring.as_array(view)
+            if model_input is None:
+                model_input = cv2.imdecode(np.frombuffer(view.data, np.uint8), cv2.IMREAD_COLOR)
+            if (model_input.shape[1], model_input.shape[0]) != (target_width, target_height):
+                model_input = cv2.resize(model_input, frame_size, interpolation=cv2.INTER_LINEAR)
+            ring.is_valid(view)
+            ai_cpu += time.process_time() - start
+            del model_input, view
+    finally:
+        ring.close()
+        ring.unlink()
+    n = max(1, len(frames))
+    return camera_cpu * 1000.0 / n, ai_cpu * 1000.0 / n
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark CPU/frame: JPEG vs raw frame transport")
+    parser.add_argument("--video", default=None, help="Video nguồn (mặc định: frame tổng hợp)")
+    parser.add_argument("--frames", type=int, default=200, help="Số frame đo")
+    parser.add_argument("--source-size", type=int, nargs=2, default=(1920, 1080), metavar=("W", "H"),
+                        help="Kích thước frame tổng hợp")
+    parser.add_argument("--frame-size", type=int, nargs=2, default=(1280, 720), metavar=("W", "H"),
+                        help="Kích thước input model")
+    args = parser.parse_args()
+
+    frame_size = tuple(args.frame_size)
+    frames = load_source_frames(args.video, args.frames, tuple(args.source_size))
+    print(f"Frames: {len(frames)} | source: {frames[0].shape[1]}x{frames[0].shape[0]} | model input: {frame_size}")
+    print(f"{'transport':<10} {'camera ms':>10} {'ai ms':>10} {'total ms':>10} {'slot KB':>10}")
+    for transport in TRANSPORTS:
+        camera_ms, ai_ms = bench_transport(transport, frames, frame_size)
+        slot_kb = slot_bytes_for(transport, frame_size) / 1024.0
+        print(f"{transport:<10} {camera_ms:>10.2f} {ai_ms:>10.2f} {camera_ms + ai_ms:>10.2f} {slot_kb:>10.0f}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
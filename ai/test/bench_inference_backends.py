@@ -0,0 +1,92 @@
+"""
+Benchmark throughput của các backend inference YOLO (PyTorch CUDA/CPU, ONNX Runtime, OpenVINO).
+
+Ví dụ (chạy từ thư mục ai/):
+    python test/bench_inference_backends.py
+    python test/bench_inference_backends.py --targets torch_cpu:fp32 onnx:fp32 onnx:int8 openvino:fp32 --batch 6
+    python test/bench_inference_backends.py --video video/hanam.mp4 --iterations 50
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "detectObject"))
+from inference_backends import create_backend
+
+DEFAULT_MODEL = os.path.join("detectObject", "weights", "model-hanam_0506.pt")
+DEFAULT_TARGETS = ["torch_cuda:fp32", "torch_cuda:fp16", "torch_cpu:fp32", "onnx:fp32", "onnx:int8", "openvino:fp32"]
+
+
+def load_frames(video_path, count, frame_size):
+    """Frame từ video (resize về frame_size), hoặc frame tổng hợp nếu không có video"""
+    frames = []
+    if video_path:
+        cap = cv2.VideoCapture(video_path)
+        while len(frames) < count:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            frames.append(cv2.resize(frame, frame_size))
+        cap.release()
+    rng = np.random.default_rng(0)
+    width, height = frame_size
+    while len(frames) < count:
+        frames.append(rng.integers(0, 255, size=(height, width, 3), dtype=np.uint8))
+    return frames
+
+
+def bench_target(model_path, backend, precision, frames, batch, iterations, warmup, imgsz, calibration_data):
+    """Trả về (ms/batch, ảnh/giây, số detection trung bình mỗi ảnh)"""
+    engine = create_backend(model_path, backend, precision, imgsz, calibration_data)
+    batches = [frames[i:i + batch] for i in range(0, len(frames) - batch + 1, batch)] or [frames[:batch]]
+    for i in range(warmup):
+        engine.predict(batches[i % len(batches)])
+
+    detections = 0
+    start = time.perf_counter()
+    for i in range(iterations):
+        results = engine.predict(batches[i % len(batches)])
+        detections += sum(len(r.boxes) for r in results)
+    elapsed = time.perf_counter() - start
+    images = iterations * batch
+    return elapsed * 1000.0 / iterations, images / elapsed, detections / max(1, images)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark throughput theo backend inference")
+    parser.add_argument("--model", default=DEFAULT_MODEL, help="Đường dẫn model .pt")
+    parser.add_argument("--targets", nargs="+", default=DEFAULT_TARGETS,
+                        help="Danh sách backend:precision cần đo")
+    parser.add_argument("--video", default=None, help="Video nguồn (mặc định: frame tổng hợp)")
+    parser.add_argument("--batch", type=int, default=6, help="Số camera mỗi batch")
+    parser.add_argument("--iterations", type=int, default=20, help="Số batch đo")
+    parser.add_argument("--warmup", type=int, default=3, help="Số batch warmup (không tính)")
+    parser.add_argument("--frame-size", type=int, nargs=2, default=(1280, 720), metavar=("W", "H"))
+    parser.add_argument("--imgsz", type=int, default=640, help="Kích thước input model")
+    parser.add_argument("--calibration-data", default=None, help="Dataset yaml cho OpenVINO int8")
+    args = parser.parse_args()
+
+    frames = load_frames(args.video, args.batch * 4, tuple(args.frame_size))
+    print(f"Model: {args.model} | batch: {args.batch} | iterations: {args.iterations} | imgsz: {args.imgsz}")
+    print(f"{'backend':<12} {'precision':<10} {'ms/batch':>10} {'img/s':>10} {'det/img':>10}")
+    for target in args.targets:
+        backend, _, precision = target.partition(":")
+        precision = precision or "fp32"
+        try:
+            ms_per_batch, images_per_sec, det_per_image = bench_target(
+                args.model, backend, precision, frames, args.batch, args.iterations, args.warmup,
+                args.imgsz, args.calibration_data,
+            )
+            print(f"{backend:<12} {precision:<10} {ms_per_batch:>10.1f} {images_per_sec:>10.1f} {det_per_image:>10.1f}")
+        except Exception as e:
+            print(f"{backend:<12} {precision:<10} bỏ qua: {e}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,110 @@
+"""
+So sánh codec payload của SQLiteQueue: JSON text vs DetectionCodec (BLOB nhị phân)
+
+Đo kích thước queues.db và thời gian decode mỗi message cho raw_detection / roi_detection.
+
+Ví dụ (chạy từ thư mục ai/):
+    python test/bench_queue_codec.py
+    python test/bench_queue_codec.py --messages 5000 --detections 80
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from queue_codec import DEFAULT_CODECS, JSON_CODEC, decode_payload
+from queue_store import SQLiteQueue
+
+TOPICS = ("raw_detection", "roi_detection")
+
+
+def make_payloads(count, detections, seed=0):
+    """Payload raw_detection (bbox float32 từ YOLO) và roi_detection (shelf + empty theo slot)"""
+    rng = np.random.default_rng(seed)
+    raw, roi = [], []
+    for frame_id in range(count):
+        boxes = rng.uniform(0, 1200, size=(detections, 4)).astype(np.float32)
+        conf = rng.uniform(0.3, 1.0, size=detections).astype(np.float32)
+        centers = (boxes[:, 0:2] + boxes[:, 2:4]) / 2.0
+        dets = [
+            {
+                "class_id": 0,
+                "class_name": "shelf",
+                "confidence": c,
+                "bbox": {"x1": b[0], "y1": b[1], "x2": b[2], "y2": b[3]},
+                "center": {"x": cxy[0], "y": cxy[1]},
+            }
+            for b, c, cxy in zip(boxes.tolist(), conf.tolist(), centers.tolist())
+        ]
+        base = {
+            "camera_id": f"cam-{frame_id % 6 + 1}",
+            "frame_id": frame_id,
+            "timestamp": "2025-01-04T02:48:53.445631+00:00",
+            "frame_shape": {"height": 720, "width": 1280, "channels": 3},
+        }
+        raw.append(dict(base, detections=dets, detection_count=len(dets)))
+        slots = [dict(d, slot_number=i + 1) for i, d in enumerate(dets[:8])]
+        slots += [
+            {
+                "class_name": "empty", "confidence": 1.0, "class_id": -1,
+                "bbox": {"x1": 100 * i, "y1": 50, "x2": 100 * i + 90, "y2": 170},
+                "center": {"x": 100 * i + 45.0, "y": 110.0 / 3},
+                "slot_number": i + 9,
+            }
+            for i in range(4)
+        ]
+        roi.append(dict(base, roi_detections=slots, roi_detection_count=len(slots),
+                        original_detection_count=len(dets)))
+    return {"raw_detection": raw, "roi_detection": roi}
+
+
+def bench(codecs, payloads):
+    """Trả về {topic: (kích thước db KB, µs decode/message)}"""
+    result = {}
+    for topic in TOPICS:
+        with tempfile.TemporaryDirectory() as tmp:
+            db_path = os.path.join(tmp, "queues.db")
+            with SQLiteQueue(db_path, codecs=codecs) as queue:
+                for i in range(0, len(payloads[topic]), 100):
+                    queue.publish_many(topic, [(p["camera_id"], p) for p in payloads[topic][i:i + 100]])
+                queue.checkpoint("TRUNCATE")
+                size_kb = os.path.getsize(db_path) / 1024.0
+                rows = [r[0] for r in queue._connect().execute(
+                    "SELECT payload FROM messages WHERE topic = ?", (topic,))]
+            start = time.perf_counter()
+            for value in rows:
+                decode_payload(value)
+            decode_us = (time.perf_counter() - start) * 1e6 / max(1, len(rows))
+            result[topic] = (size_kb, decode_us)
+    return result
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="So sánh kích thước DB / thời gian decode: JSON vs nhị phân")
+    parser.add_argument("--messages", type=int, default=2000, help="Số message mỗi topic")
+    parser.add_argument("--detections", type=int, default=60, help="Số detection mỗi frame")
+    args = parser.parse_args()
+
+    payloads = make_payloads(args.messages, args.detections)
+    # Kiểm tra decode nhị phân cho lại đúng payload
+    for topic in TOPICS:
+        for p in payloads[topic][:20]:
+            assert decode_payload(DEFAULT_CODECS[topic].encode(p)) == p
+
+    json_result = bench({}, payloads)
+    binary_result = bench(DEFAULT_CODECS, payloads)
+    print(f"messages/topic: {args.messages} | detections/frame: {args.detections}")
+    print(f"{'topic':<15} {'json KB':>10} {'binary KB':>10} {'json µs':>9} {'binary µs':>10}")
+    for topic in TOPICS:
+        (json_kb, json_us), (bin_kb, bin_us) = json_result[topic], binary_result[topic]
+        print(f"{topic:<15} {json_kb:>10.0f} {bin_kb:>10.0f} {json_us:>9.1f} {bin_us:>10.1f}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,103 @@
+"""
+Benchmark chi phí polling SQLiteQueue (số lần đọc/giây) như ROI processor / StablePairProcessor / postAPI:
+
+- legacy: mỗi lần đọc mở connection mới + chạy lại PRAGMA (cách cũ của _connect())
+- pooled: connection theo thread được dùng lại + prepared statement cache
+- multi:  1 query get_after_ids({camera: last_id}) cho tất cả camera mỗi vòng
+
+Ví dụ (chạy từ thư mục ai/):
+    python test/bench_queue_poll.py
+    python test/bench_queue_poll.py --cameras 35 --rounds 200 --threads 3
+"""
+
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from queue_codec import decode_payload
+from queue_store import SQLiteQueue
+
+
+def legacy_get_after_id(db_path, topic, key, after_id, limit=50):
+    """Cách cũ: connection mới + PRAGMA cho mỗi lần đọc"""
+    conn = sqlite3.connect(db_path, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL;")
+    conn.execute("PRAGMA synchronous=NORMAL;")
+    try:
+        rows = conn.execute(
+            """
+            SELECT id, payload, created_at FROM messages
+            WHERE topic = ? AND key = ? AND id > ?
+            ORDER BY id ASC
+            LIMIT ?
+            """,
+            (topic, key, after_id, limit),
+        ).fetchall()
+        return [{"id": r[0], "payload": decode_payload(r[1]), "created_at": r[2]} for r in rows]
+    finally:
+        conn.close()
+
+
+def poll_loop(mode, queue, db_path, cam_names, rounds, last_ids):
+    for _ in range(rounds):
+        if mode == "multi":
+            for cam, rows in queue.get_after_ids("raw_detection", last_ids).items():
+                last_ids[cam] = rows[-1]["id"]
+            continue
+        for cam in cam_names:
+            if mode == "legacy":
+                rows = legacy_get_after_id(db_path, "raw_detection", cam, last_ids[cam])
+            else:
+                rows = queue.get_after_id("raw_detection", cam, last_ids[cam])
+            if rows:
+                last_ids[cam] = rows[-1]["id"]
+
+
+def bench(mode, db_path, cam_names, rounds, num_threads):
+    """Trả về số camera được đọc/giây (tổng các thread)"""
+    queue = SQLiteQueue(db_path)
+    threads = [
+        threading.Thread(target=poll_loop, args=(mode, queue, db_path, cam_names, rounds, {c: 0 for c in cam_names}))
+        for _ in range(num_threads)
+    ]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    queue.close()
+    return rounds * len(cam_names) * num_threads / elapsed
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark đọc/giây: connection mới mỗi lần vs connection pool")
+    parser.add_argument("--cameras", type=int, default=35, help="Số camera (key) được poll mỗi vòng")
+    parser.add_argument("--rounds", type=int, default=100, help="Số vòng poll mỗi thread")
+    parser.add_argument("--threads", type=int, default=3, help="Số thread poll song song")
+    parser.add_argument("--messages", type=int, default=20, help="Số message có sẵn mỗi camera")
+    args = parser.parse_args()
+
+    cam_names = [f"cam-{i + 1}" for i in range(args.cameras)]
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "queues.db")
+        with SQLiteQueue(db_path) as queue:
+            for i in range(args.messages):
+                queue.publish_many("raw_detection", [(cam, {"camera_id": cam, "frame_id": i}) for cam in cam_names])
+
+        print(f"cameras: {args.cameras} | rounds: {args.rounds} | threads: {args.threads}")
+        legacy = bench("legacy", db_path, cam_names, args.rounds, args.threads)
+        pooled = bench("pooled", db_path, cam_names, args.rounds, args.threads)
+        multi = bench("multi", db_path, cam_names, args.rounds, args.threads)
+        print(f"{'legacy reads/s':>16} {'pooled reads/s':>16} {'multi reads/s':>15} {'speedup':>9}")
+        print(f"{legacy:>16.0f} {pooled:>16.0f} {multi:>15.0f} {multi / legacy:>8.1f}x")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
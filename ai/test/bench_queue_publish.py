@@ -0,0 +1,100 @@
+"""
+Benchmark throughput ghi SQLiteQueue (messages/giây):
+
+- publish: mỗi message 1 lần ghi (cách cũ: mở connection + commit mỗi message)
+- publish_many: cả batch camera trong 1 transaction trên connection persistent
+
+Ví dụ (chạy từ thư mục ai/):
+    python test/bench_queue_publish.py
+    python test/bench_queue_publish.py --cameras 6 35 --batches 200
+"""
+
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from queue_store import SQLiteQueue
+
+
+def make_payload(cam_name, frame_id, detections):
+    """Payload raw_detection giả lập"""
+    return {
+        "camera_id": cam_name,
+        "frame_id": frame_id,
+        "timestamp": datetime.utcnow().isoformat(),
+        "frame_shape": {"height": 720, "width": 1280, "channels": 3},
+        "detections": [
+            {
+                "class_id": 0,
+                "class_name": "shelf",
+                "confidence": 0.9,
+                "bbox": {"x1": 10.0 * i, "y1": 20.0, "x2": 10.0 * i + 50, "y2": 80.0},
+                "center": {"x": 10.0 * i + 25, "y": 50.0},
+            }
+            for i in range(detections)
+        ],
+        "detection_count": detections,
+    }
+
+
+def legacy_publish(db_path, topic, key, payload):
+    """Cách cũ: connection mới + PRAGMA + commit cho mỗi message"""
+    now_iso = datetime.utcnow().isoformat() + "Z"
+    conn = sqlite3.connect(db_path)
+    conn.execute("PRAGMA journal_mode=WAL;")
+    conn.execute("PRAGMA synchronous=NORMAL;")
+    with conn:
+        conn.execute(
+            "INSERT INTO messages(topic, key, payload, created_at) VALUES (?, ?, ?, ?)",
+            (topic, key, json.dumps(payload, ensure_ascii=False), now_iso),
+        )
+    conn.close()
+
+
+def bench(mode, num_cameras, batches, detections):
+    """Trả về messages/giây"""
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "queues.db")
+        queue = SQLiteQueue(db_path)
+        cam_names = [f"cam-{i + 1}" for i in range(num_cameras)]
+        start = time.perf_counter()
+        for frame_id in range(batches):
+            messages = [(cam, make_payload(cam, frame_id, detections)) for cam in cam_names]
+            if mode == "legacy":
+                for cam, payload in messages:
+                    legacy_publish(db_path, "raw_detection", cam, payload)
+            elif mode == "publish":
+                for cam, payload in messages:
+                    queue.publish("raw_detection", cam, payload)
+            else:
+                queue.publish_many("raw_detection", messages)
+        elapsed = time.perf_counter() - start
+        queue.close()
+        return num_cameras * batches / elapsed
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark messages/giây: publish vs publish_many")
+    parser.add_argument("--cameras", type=int, nargs="+", default=[6, 35], help="Số camera mỗi batch")
+    parser.add_argument("--batches", type=int, default=100, help="Số batch ghi")
+    parser.add_argument("--detections", type=int, default=20, help="Số detection mỗi payload")
+    args = parser.parse_args()
+
+    print(f"batches: {args.batches} | detections/payload: {args.detections}")
+    print(f"{'cameras':>8} {'legacy msg/s':>14} {'publish msg/s':>14} {'many msg/s':>12} {'speedup':>9}")
+    for num_cameras in args.cameras:
+        legacy = bench("legacy", num_cameras, args.batches, args.detections)
+        single = bench("publish", num_cameras, args.batches, args.detections)
+        many = bench("many", num_cameras, args.batches, args.detections)
+        print(f"{num_cameras:>8} {legacy:>14.0f} {single:>14.0f} {many:>12.0f} {many / legacy:>8.1f}x")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,139 @@
+"""
+Benchmark ROIProcessor.filter_detections_by_roi theo số slot ROI:
+
+- legacy:   ray-cast Python cho từng cặp (detection, slot) + tính lại bbox/center slot empty mỗi frame
+- compiled: CompiledROI (numpy, lọc bbox trước, ray-cast cả batch 1 lần)
+- mask:     label mask uint16 theo frame_shape (use_label_mask), chỉ ray-cast điểm sát cạnh
+
+Ví dụ (chạy từ thư mục ai/):
+    python test/bench_roi_filter.py
+    python test/bench_roi_filter.py --slots 4 16 64 128 --detections 80
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from roi_processor import ROIProcessor
+
+CAMERA_ID = "cam-bench"
+FRAME_SHAPE = {"height": 720, "width": 1280, "channels": 3}
+
+
+def make_slots(num_slots, frame_size=(1280, 720), seed=0):
+    """Lưới slot tứ giác (hơi méo như ROI vẽ tay) phủ khung hình"""
+    rng = np.random.default_rng(seed)
+    cols = int(np.ceil(np.sqrt(num_slots * frame_size[0] / frame_size[1])))
+    rows = int(np.ceil(num_slots / cols))
+    w, h = frame_size[0] / cols, frame_size[1] / rows
+    slots = []
+    for k in range(num_slots):
+        x0, y0 = (k % cols) * w, (k // cols) * h
+        corners = [[x0, y0], [x0 + w, y0], [x0 + w, y0 + h], [x0, y0 + h]]
+        points = [[int(x + rng.integers(-8, 9)), int(y + rng.integers(-8, 9))] for x, y in corners]
+        slots.append({"slot_id": k + 1, "points": points})
+    return slots
+
+
+def make_detections(count, frame_size=(1280, 720), seed=1):
+    rng = np.random.default_rng(seed)
+    detections = []
+    for _ in range(count):
+        x1, y1 = rng.uniform(0, frame_size[0] - 80), rng.uniform(0, frame_size[1] - 80)
+        x2, y2 = x1 + rng.uniform(30, 80), y1 + rng.uniform(30, 80)
+        detections.append({
+            "class_id": 0,
+            "class_name": "shelf",
+            "confidence": float(rng.uniform(0.3, 1.0)),
+            "bbox": {"x1": x1, "y1": y1, "x2": x2, "y2": y2},
+            "center": {"x": (x1 + x2) / 2.0, "y": (y1 + y2) / 2.0},
+        })
+    return detections
+
+
+def legacy_filter(processor, detections, camera_id):
+    """filter_detections_by_roi trước khi có CompiledROI"""
+    roi_slots = processor.roi_cache.get(camera_id, [])
+    filtered_detections = []
+    roi_has_shelf = [False] * len(roi_slots)
+    for detection in detections:
+        if detection.get("class_name") == "shelf" and detection.get("confidence", 0) >= 0.5:
+            for i, slot in enumerate(roi_slots):
+                if processor.is_detection_in_roi(detection, [slot]):
+                    if processor.blocked_slots.get(camera_id, {}).get(i + 1):
+                        continue
+                    detection_with_slot = dict(detection)
+                    detection_with_slot["slot_number"] = i + 1
+                    filtered_detections.append(detection_with_slot)
+                    roi_has_shelf[i] = True
+                    break
+    for i, slot in enumerate(roi_slots):
+        slot_number = i + 1
+        if slot_number in processor.blocked_slots.get(camera_id, {}) or not roi_has_shelf[i]:
+            filtered_detections.append({
+                "class_name": "empty",
+                "confidence": 1.0,
+                "class_id": -1,
+                "bbox": {
+                    "x1": min(point[0] for point in slot["points"]),
+                    "y1": min(point[1] for point in slot["points"]),
+                    "x2": max(point[0] for point in slot["points"]),
+                    "y2": max(point[1] for point in slot["points"])
+                },
+                "center": {
+                    "x": sum(point[0] for point in slot["points"]) / len(slot["points"]),
+                    "y": sum(point[1] for point in slot["points"]) / len(slot["points"])
+                },
+                "slot_number": slot_number,
+            })
+    return filtered_detections
+
+
+def timeit(func, *args, repeat):
+    func(*args)  # warmup
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func(*args)
+    return (time.perf_counter() - start) * 1000.0 / repeat
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark lọc detection theo ROI: legacy vs compiled")
+    parser.add_argument("--slots", type=int, nargs="+", default=[4, 8, 16, 32, 64, 128], help="Số slot ROI")
+    parser.add_argument("--detections", type=int, default=60, help="Số detection mỗi frame")
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        processor = ROIProcessor(os.path.join(tmp, "queues.db"), show_video=False)
+        detections = make_detections(args.detections)
+        print(f"\ndetections/frame: {args.detections} | repeat: {args.repeat}")
+        print(f"{'slots':>6} {'legacy ms':>10} {'compiled ms':>12} {'mask ms':>9} {'speedup':>9}")
+        for num_slots in args.slots:
+            processor.update_roi_cache(CAMERA_ID, {"slots": make_slots(num_slots)})
+            processor.blocked_slots[CAMERA_ID] = {2: float("inf")}
+            # Kiểm tra các cách cho cùng kết quả
+            expected = legacy_filter(processor, detections, CAMERA_ID)
+            processor.use_label_mask = False
+            assert expected == processor.filter_detections_by_roi(detections, CAMERA_ID, FRAME_SHAPE)
+            compiled_ms = timeit(processor.filter_detections_by_roi, detections, CAMERA_ID, FRAME_SHAPE,
+                                 repeat=args.repeat)
+            processor.use_label_mask = True
+            assert expected == processor.filter_detections_by_roi(detections, CAMERA_ID, FRAME_SHAPE)
+            mask_ms = timeit(processor.filter_detections_by_roi, detections, CAMERA_ID, FRAME_SHAPE,
+                             repeat=args.repeat)
+            legacy_ms = timeit(legacy_filter, processor, detections, CAMERA_ID, repeat=args.repeat)
+            best_ms = min(compiled_ms, mask_ms)
+            print(f"{num_slots:>6} {legacy_ms:>10.3f} {compiled_ms:>12.3f} {mask_ms:>9.3f} "
+                  f"{legacy_ms / best_ms:>8.1f}x")
+        processor.queue.close()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
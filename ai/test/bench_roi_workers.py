@@ -0,0 +1,107 @@
+"""
+Benchmark throughput lọc ROI end-to-end (raw_detection -> roi_detection) theo số process worker:
+
+- workers = 1: 1 process lọc mọi camera (như ROIProcessor mặc định)
+- workers = N: camera chia theo shard crc32(camera_id) % N, mỗi worker 1 process (ROIProcessor --workers N)
+
+Mỗi lần đo: dựng queues.db tạm với roi_config cho mọi camera, khởi động worker, publish sẵn
+frames x cameras message raw_detection rồi đo thời gian đến khi đủ roi_detection tương ứng.
+
+Ví dụ (chạy từ thư mục ai/):
+    python test/bench_roi_workers.py
+    python test/bench_roi_workers.py --cameras 35 --workers 1 2 4 8 --slots 32 --frames 40
+"""
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime
+from multiprocessing import Process
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from queue_store import SQLiteQueue
+from roi_processor import roi_shard_worker
+from bench_roi_filter import FRAME_SHAPE, make_detections, make_slots
+
+# Thời gian chờ worker load ROI config và mở subscription trước khi publish
+STARTUP_SECONDS = 3.0
+
+
+def quiet_worker(shard_index, num_workers, db_path):
+    """roi_shard_worker không in log (log mỗi worker làm rối bảng kết quả)"""
+    sys.stdout = open(os.devnull, "w")
+    roi_shard_worker(shard_index, num_workers, db_path)
+
+
+def bench(num_workers, num_cameras, num_slots, num_detections, frames, timeout):
+    """Trả về (số frame/giây, số roi_detection nhận được)"""
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "queues.db")
+        queue = SQLiteQueue(db_path)
+        cameras = [f"cam-{i + 1}" for i in range(num_cameras)]
+        for i, camera_id in enumerate(cameras):
+            queue.publish("roi_config", camera_id, {"camera_id": camera_id, "slots": make_slots(num_slots, seed=i)})
+
+        workers = [
+            Process(target=quiet_worker, args=(i, num_workers, db_path), daemon=True)
+            for i in range(num_workers)
+        ]
+        for worker in workers:
+            worker.start()
+        time.sleep(STARTUP_SECONDS)
+
+        detections = make_detections(num_detections)
+        messages = []
+        for frame_id in range(frames):
+            for camera_id in cameras:
+                messages.append((camera_id, {
+                    "camera_id": camera_id,
+                    "frame_id": frame_id,
+                    "timestamp": datetime.now().isoformat(),
+                    "frame_shape": FRAME_SHAPE,
+                    "detections": detections,
+                    "detection_count": len(detections),
+                }))
+        start_id = queue.last_id("roi_detection")
+        start = time.perf_counter()
+        queue.publish_many("raw_detection", messages)
+
+        # Đếm roi_detection mới cho đến khi đủ (hoặc hết timeout)
+        received = 0
+        subscription = queue.subscribe("roi_detection", start=start_id, batch_size=1000)
+        deadline = time.monotonic() + timeout
+        while received < len(messages) and time.monotonic() < deadline:
+            received += len(subscription.poll(timeout=0.5))
+        elapsed = time.perf_counter() - start
+
+        for worker in workers:
+            worker.terminate()
+            worker.join(5.0)
+        queue.close()
+    return received / elapsed, received
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark ROI worker theo số process")
+    parser.add_argument("--cameras", type=int, default=35, help="Số camera")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4], help="Số process worker cần đo")
+    parser.add_argument("--slots", type=int, default=32, help="Số slot ROI mỗi camera")
+    parser.add_argument("--detections", type=int, default=60, help="Số detection mỗi frame")
+    parser.add_argument("--frames", type=int, default=20, help="Số frame mỗi camera")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Thời gian chờ tối đa mỗi lần đo (giây)")
+    args = parser.parse_args()
+
+    total = args.cameras * args.frames
+    print(f"CPU: {os.cpu_count()} | cameras: {args.cameras} | slots: {args.slots} | "
+          f"detections/frame: {args.detections} | frames: {total}")
+    print(f"{'workers':>8} {'frames/s':>10} {'received':>10}")
+    for num_workers in args.workers:
+        rate, received = bench(num_workers, args.cameras, args.slots, args.detections, args.frames, args.timeout)
+        print(f"{num_workers:>8} {rate:>10.1f} {received:>7}/{total}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
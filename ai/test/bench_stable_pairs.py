@@ -0,0 +1,141 @@
+"""
+Benchmark StablePairProcessor theo số cặp slot (start_qr -> end_qr):
+
+- legacy: slot_state dict key "cam:slot", đánh giá lại mọi cặp mỗi lần có roi_detection mới (vòng lặp cũ)
+- engine: trạng thái slot dạng mảng theo slot id + timer wheel, chỉ đánh giá cặp của slot vừa stable
+
+Mô phỏng trên đồng hồ ảo (không sleep): mỗi camera gửi roi_detection theo --fps, mỗi slot đổi
+shelf/empty ngẫu nhiên. Kiểm tra 2 cách publish cùng tập stable_pairs (pair_id, stable_since).
+
+Ví dụ (chạy từ thư mục ai/):
+    python test/bench_stable_pairs.py
+    python test/bench_stable_pairs.py --pairs 100 1000 5000 --seconds 600
+"""
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "logic"))
+from stable_pair_processor import StablePairProcessor
+
+
+def make_config(path, num_pairs, num_cameras, seed=0):
+    """Mỗi cặp: 1 slot start và 1 slot end (slot mới, rải đều qua các camera)"""
+    rng = np.random.default_rng(seed)
+    starts, ends, pairs = [], [], []
+    next_slot = {}
+    for i in range(num_pairs):
+        for items, qr in ((starts, 2 * i + 1), (ends, 2 * i + 2)):
+            camera_id = f"cam-{int(rng.integers(num_cameras)) + 1}"
+            next_slot[camera_id] = next_slot.get(camera_id, 0) + 1
+            items.append({"camera_id": camera_id, "slot_number": next_slot[camera_id], "qr_code": qr})
+        pairs.append({"start_qr": 2 * i + 1, "end_qrs": 2 * i + 2})
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"starts": starts, "ends": ends, "pairs": pairs}, f)
+    return next_slot
+
+
+def make_stream(slots_per_camera, seconds, fps, flip_seconds, start, seed=1):
+    """[(now, [row, ...]), ...]: mỗi frame 1 roi_detection / camera, slot đổi trạng thái trung bình mỗi flip_seconds"""
+    rng = np.random.default_rng(seed)
+    cameras = sorted(slots_per_camera)
+    states = {cam: rng.random(n) < 0.5 for cam, n in slots_per_camera.items()}
+    flip_p = 1.0 / (flip_seconds * fps)
+    stream = []
+    for frame in range(int(seconds * fps)):
+        now = start + frame / fps
+        rows = []
+        for cam in cameras:
+            state = states[cam]
+            state ^= rng.random(len(state)) < flip_p
+            rows.append({"key": cam, "payload": {"roi_detections": [
+                {"class_name": "shelf" if shelf else "empty", "slot_number": i + 1}
+                for i, shelf in enumerate(state.tolist())
+            ]}})
+        stream.append((now, rows))
+    return stream
+
+
+def run_legacy(proc, stream):
+    """Vòng lặp cũ: dict "cam:slot" + đánh giá mọi cặp sau mỗi lô roi_detection"""
+    slot_state = {}
+
+    def is_stable(camera_id, slot_number, expect_status, now):
+        st = slot_state.get(f"{camera_id}:{slot_number}")
+        if not st or st["status"] != expect_status:
+            return False, None
+        stable = (now - st["since"]) >= proc.stable_seconds
+        return stable, st["since"] if stable else None
+
+    for now, rows in stream:
+        for r in rows:
+            for slot_num, status in proc._compute_slot_statuses(r["key"], r["payload"]["roi_detections"]).items():
+                key = f"{r['key']}:{slot_num}"
+                prev = slot_state.get(key)
+                if prev is None or prev["status"] != status:
+                    slot_state[key] = {"status": status, "since": now}
+        for start_qr, end_qrs in proc.pairs:
+            start_cam, start_slot = proc.qr_to_slot[start_qr]
+            start_ok, start_since = is_stable(start_cam, start_slot, "shelf", now)
+            if not start_ok:
+                continue
+            for end_qr in end_qrs:
+                end_cam, end_slot = proc.qr_to_slot[end_qr]
+                end_ok, end_since = is_stable(end_cam, end_slot, "empty", now)
+                if end_ok:
+                    proc._maybe_publish_pair(start_qr, end_qr, max(start_since, end_since), now)
+
+
+def run_engine(proc, stream):
+    for now, rows in stream:
+        proc.process_rows(rows, now)
+        proc.process_timers(now)
+
+
+def published(proc):
+    rows = proc.queue.get_after_id_topic("stable_pairs", 0, 10 ** 9)
+    return sorted((r["payload"]["pair_id"], r["payload"]["stable_since"]) for r in rows)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark StablePairProcessor theo số cặp slot")
+    parser.add_argument("--pairs", type=int, nargs="+", default=[100, 1000, 3000], help="Số cặp start -> end")
+    parser.add_argument("--cameras", type=int, default=35)
+    parser.add_argument("--fps", type=float, default=2.0, help="roi_detection mỗi giây mỗi camera")
+    parser.add_argument("--seconds", type=float, default=300.0, help="Thời lượng mô phỏng (giây ảo)")
+    parser.add_argument("--flip-seconds", type=float, default=60.0, help="Thời gian trung bình giữa 2 lần đổi trạng thái slot")
+    args = parser.parse_args()
+
+    print(f"cameras: {args.cameras} | fps: {args.fps} | {args.seconds:.0f}s ảo | slot đổi trạng thái ~{args.flip_seconds:.0f}s")
+    print(f"{'pairs':>6} {'legacy s':>10} {'engine s':>10} {'speedup':>9} {'published':>10}")
+    for num_pairs in args.pairs:
+        with tempfile.TemporaryDirectory() as tmp:
+            config_path = os.path.join(tmp, "slot_pairing_config.json")
+            slots_per_camera = make_config(config_path, num_pairs, args.cameras)
+            legacy = StablePairProcessor(os.path.join(tmp, "legacy.db"), config_path)
+            engine = StablePairProcessor(os.path.join(tmp, "engine.db"), config_path)
+            stream = make_stream(slots_per_camera, args.seconds, args.fps, args.flip_seconds, start=time.time() + 1)
+
+            start = time.process_time()
+            run_legacy(legacy, stream)
+            legacy_s = time.process_time() - start
+            start = time.process_time()
+            run_engine(engine, stream)
+            engine_s = time.process_time() - start
+
+            expected, got = published(legacy), published(engine)
+            assert expected == got, f"khác kết quả: legacy {len(expected)} / engine {len(got)}"
+            legacy.queue.close()
+            engine.queue.close()
+        print(f"{num_pairs:>6} {legacy_s:>10.2f} {engine_s:>10.2f} {legacy_s / engine_s:>8.1f}x {len(got):>10}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
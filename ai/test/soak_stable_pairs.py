@@ -0,0 +1,101 @@
+"""
+Soak test StablePairProcessor: phát lại roi_detection tổng hợp của nhiều ngày (mặc định 30 ngày)
+trên đồng hồ ảo và kiểm tra RSS của process không tăng theo thời gian chạy.
+
+- Mỗi --step giây ảo, mỗi camera gửi 1 roi_detection (shelf/empty cho các slot có trong pair)
+- Slot đổi trạng thái ngẫu nhiên trung bình mỗi --flip-seconds -> pair liên tục stable và publish
+- Cuối mỗi ngày ảo: gc + đo RSS; RSS ngày cuối không được vượt RSS sau ngày đầu quá --rss-tolerance-mb
+
+Ví dụ (chạy từ thư mục ai/):
+    python test/soak_stable_pairs.py
+    python test/soak_stable_pairs.py --days 60 --pairs 500 --step 15
+"""
+
+import argparse
+import gc
+import os
+import resource
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "logic"))
+from stable_pair_processor import StablePairProcessor
+from bench_stable_pairs import make_config
+
+DAY_SECONDS = 24 * 3600
+
+
+def current_rss_mb():
+    """RSS hiện tại (MB): /proc/self/statm trên Linux, ngược lại RSS đỉnh từ getrusage"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Soak test bộ nhớ StablePairProcessor")
+    parser.add_argument("--days", type=int, default=30, help="Số ngày ảo phát lại")
+    parser.add_argument("--cameras", type=int, default=10)
+    parser.add_argument("--pairs", type=int, default=200, help="Số cặp start -> end")
+    parser.add_argument("--step", type=float, default=30.0, help="Giây ảo giữa 2 roi_detection của 1 camera")
+    parser.add_argument("--flip-seconds", type=float, default=300.0, help="Thời gian trung bình giữa 2 lần đổi trạng thái slot")
+    parser.add_argument("--rss-tolerance-mb", type=float, default=8.0, help="Mức tăng RSS tối đa sau ngày đầu")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    with tempfile.TemporaryDirectory() as tmp:
+        config_path = os.path.join(tmp, "slot_pairing_config.json")
+        slots_per_camera = make_config(config_path, args.pairs, args.cameras)
+        proc = StablePairProcessor(os.path.join(tmp, "queues.db"), config_path)
+        cameras = sorted(slots_per_camera)
+        states = {cam: rng.random(n) < 0.5 for cam, n in slots_per_camera.items()}
+        flip_p = args.step / args.flip_seconds
+        steps_per_day = int(DAY_SECONDS / args.step)
+
+        print(f"{args.days} ngày ảo | cameras: {args.cameras} | pairs: {len(proc.edge_qrs)} | "
+              f"step: {args.step:.0f}s | slot đổi trạng thái ~{args.flip_seconds:.0f}s")
+        print(f"{'day':>4} {'rss MB':>8} {'published':>10} {'dedup keys':>11} {'timers':>7} {'wall s':>7}")
+
+        start_wall = time.time()
+        now = start_wall + 1
+        published = 0
+        baseline = None
+        rss = []
+        for day in range(1, args.days + 1):
+            for _ in range(steps_per_day):
+                rows = []
+                for cam in cameras:
+                    state = states[cam]
+                    state ^= rng.random(len(state)) < flip_p
+                    rows.append({"key": cam, "payload": {"roi_detections": [
+                        {"class_name": "shelf" if shelf else "empty", "slot_number": i + 1}
+                        for i, shelf in enumerate(state.tolist())
+                    ]}})
+                proc.process_rows(rows, now)
+                proc.process_timers(now)
+                now += args.step
+            gc.collect()
+            rss.append(current_rss_mb())
+            published = proc.queue.last_id("stable_pairs")
+            if day == 1:
+                baseline = rss[-1]
+            print(f"{day:>4} {rss[-1]:>8.1f} {published:>10} {len(proc.published_minute):>11} "
+                  f"{len(proc.timers):>7} {time.time() - start_wall:>7.0f}")
+
+        proc.queue.close()
+
+    growth = max(rss) - baseline
+    print(f"RSS tăng sau ngày 1: {growth:+.1f} MB (giới hạn {args.rss_tolerance_mb} MB); "
+          f"published_by_minute cũ sẽ giữ ~{published} minute key")
+    assert len(proc.published_minute) <= len(proc.edge_qrs)
+    assert growth <= args.rss_tolerance_mb, f"RSS tăng {growth:.1f} MB"
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
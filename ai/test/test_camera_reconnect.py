@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+Test kết nối lại camera (detectObject/camera_thread.py + supervisor của camera_process_worker):
+
+- Camera nhận kết nối nhưng không trả lời: open() dừng sau OPEN_TIMEOUT_MS thay vì treo thread
+- Stream ngừng gửi frame giữa chừng: grab() thất bại sau READ_TIMEOUT_MS, thread release capture và kết thúc
+- Kết nối thất bại liên tục không rò FD (capture lỗi được release ngay)
+- Camera chết được hẹn giờ kết nối lại với backoff (retrying, retry_count tăng dần) trong khi
+  camera khác cùng process vẫn ghi frame bình thường
+
+Chạy từ thư mục ai/:
+    python test/test_camera_reconnect.py
+    python -m pytest -q test/test_camera_reconnect.py
+"""
+
+import os
+import socket
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from multiprocessing import Process
+
+import cv2
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "detectObject"))
+import camera_thread
+from camera_process import camera_process_worker
+from camera_thread import CameraThread
+from frame_ring import SharedFrameRing
+from test_capture_scheduler import wait_for
+
+REFUSED_URL = "rtsp://127.0.0.1:1/live"  # cổng không có server -> connection refused
+
+
+def silent_server():
+    """TCP server nhận kết nối nhưng không bao giờ trả lời RTSP; trả về (url, socket đã nhận)"""
+    server = socket.socket()
+    server.bind(("127.0.0.1", 0))
+    server.listen(16)
+    accepted = []
+
+    def accept_forever():
+        while True:
+            accepted.append(server.accept()[0])
+
+    threading.Thread(target=accept_forever, daemon=True).start()
+    return f"rtsp://127.0.0.1:{server.getsockname()[1]}/live", accepted
+
+
+class StubMJPEGCamera:
+    """Camera IP giả: stream MJPEG qua HTTP, 25 FPS thời gian thực; stall_after = số frame trước khi ngừng gửi"""
+
+    def __init__(self, stall_after=None):
+        jpeg = cv2.imencode(".jpg", np.zeros((120, 160, 3), np.uint8))[1].tobytes()
+        part = b"--frame\r\nContent-Type: image/jpeg\r\nContent-Length: %d\r\n\r\n" % len(jpeg) + jpeg + b"\r\n"
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                self.send_response(200)
+                self.send_header("Content-Type", "multipart/x-mixed-replace; boundary=frame")
+                self.end_headers()
+                sent = 0
+                try:
+                    while stall_after is None or sent < stall_after:
+                        self.wfile.write(part)
+                        sent += 1
+                        time.sleep(0.04)
+                    time.sleep(3600)  # giữ kết nối nhưng không gửi gì nữa
+                except OSError:
+                    pass
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_port}/stream.mjpg"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def open_fds():
+    return len(os.listdir("/proc/self/fd"))
+
+
+def test_open_timeout_on_unresponsive_camera():
+    url, _ = silent_server()
+    old_timeout = camera_thread.OPEN_TIMEOUT_MS
+    camera_thread.OPEN_TIMEOUT_MS = 1000
+    try:
+        start = time.monotonic()
+        assert CameraThread("silent", url, {})._try_connect_camera() is None
+        elapsed = time.monotonic() - start
+    finally:
+        camera_thread.OPEN_TIMEOUT_MS = old_timeout
+    assert 0.8 < elapsed < 3.0, elapsed
+
+
+def test_read_timeout_on_stalled_stream():
+    camera = StubMJPEGCamera(stall_after=10)
+    ring = SharedFrameRing(["stalled"])
+    old_timeout = camera_thread.READ_TIMEOUT_MS
+    camera_thread.READ_TIMEOUT_MS = 1000
+    try:
+        thread = CameraThread("stalled", camera.url, ring, target_fps=25.0)
+        thread.start()
+        thread.join(timeout=10.0)
+        assert not thread.is_alive()  # grab() không treo vô hạn khi stream im lặng
+        assert thread.last_successful_connection is not None
+        assert ring.latest_seq("stalled") > 0
+    finally:
+        camera_thread.READ_TIMEOUT_MS = old_timeout
+        camera.close()
+        ring.close()
+        ring.unlink()
+
+
+def test_failed_connects_do_not_leak_fds():
+    camera = CameraThread("refused", REFUSED_URL, {})
+    camera._try_connect_camera()
+    before = open_fds()
+    for _ in range(30):
+        assert camera._try_connect_camera() is None
+    assert open_fds() <= before
+
+
+def test_supervisor_backoff_does_not_block_peers():
+    camera = StubMJPEGCamera()
+    ring = SharedFrameRing(["dead", "live"])
+    worker = Process(target=camera_process_worker,
+                     args=(0, [("dead", REFUSED_URL), ("live", camera.url)], ring),
+                     kwargs={"target_fps": 10.0}, daemon=True)
+    worker.start()
+    try:
+        assert wait_for(lambda: ring.get("dead")["status"] == "retrying", 5.0)
+        assert ring.get("dead")["retry_count"] == 1
+        seq = ring.latest_seq("live")
+        # Lần thất bại 1 chờ 2s, lần 2 chờ 4s: retry_count = 2 sau ~2s, camera "live" vẫn chạy
+        assert wait_for(lambda: ring.get("dead")["retry_count"] == 2, 4.0)
+        assert ring.latest_seq("live") >= seq + 10
+        time.sleep(1.0)
+        assert ring.get("dead")["retry_count"] == 2
+    finally:
+        worker.terminate()
+        worker.join()
+        camera.close()
+        ring.close()
+        ring.unlink()
+
+
+if __name__ == "__main__":
+    for name, fn in list(globals().items()):
+        if name.startswith("test_"):
+            start = time.perf_counter()
+            fn()
+            print(f"[OK] {name} ({time.perf_counter() - start:.2f}s)")
@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""
+Test CaptureScheduler (detectObject/capture_scheduler.py) và lệnh start/stop của camera_process_worker:
+
+- Khối camera nặng (4K) dồn vào 1 process theo cách chia cố định được dàn đều sau vài lần cân bằng
+- Chuyển camera 2 bước: process mới chỉ nhận "start" sau khi process cũ đã nhả camera (owners = NO_OWNER)
+- Worker thật (video file làm camera): đo được thời gian decode, "stop" nhả camera, "start" nhận lại
+
+Chạy từ thư mục ai/:
+    python test/test_capture_scheduler.py
+    python -m pytest -q test/test_capture_scheduler.py
+"""
+
+import os
+import sys
+import tempfile
+import time
+from multiprocessing import Array, Process, Queue
+
+import cv2
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "detectObject"))
+from camera_process import camera_process_worker
+from capture_scheduler import NO_OWNER, CaptureScheduler, plan_moves
+from frame_ring import SharedFrameRing
+
+
+def contiguous_groups(camera_urls, num_processes):
+    """Cách chia cố định cũ (CameraOrchestrator._divide_cameras)"""
+    per_process = -(-len(camera_urls) // num_processes)
+    return [camera_urls[i:i + per_process] for i in range(0, len(camera_urls), per_process)]
+
+
+def test_plan_moves_spreads_heavy_block():
+    # 4 camera 4K (40% CPU) đứng đầu danh sách -> cùng process 0 khi chia cố định
+    costs = [0.4] * 4 + [0.05] * 16
+    assignment = [idx // 4 for idx in range(20)]
+    loads_before = [sum(costs[i] for i in range(20) if assignment[i] == p) for p in range(5)]
+    rounds = 0
+    while True:
+        moves = plan_moves(costs, assignment, 5)
+        if not moves:
+            break
+        for idx, src, dst in moves:
+            assert assignment[idx] == src
+            assignment[idx] = dst
+        rounds += 1
+        assert rounds < 10
+    loads = [sum(costs[i] for i in range(20) if assignment[i] == p) for p in range(5)]
+    assert max(loads_before) == 1.6
+    assert max(loads) <= sum(costs) / 5 * 1.25 + 1e-9, loads
+    # Camera chết (chi phí 0) không bị chuyển
+    assert plan_moves([0.0, 0.0, 0.0, 0.3], [0, 0, 0, 1], 2) == []
+
+
+def test_move_waits_for_old_owner():
+    camera_urls = [(f"cam-{i}", f"rtsp://cam{i}") for i in range(4)]
+    decode_seconds = Array('d', 4)
+    owners = Array('i', [0, 0, 1, 1])
+    scheduler = CaptureScheduler(camera_urls, contiguous_groups(camera_urls, 2), decode_seconds, owners,
+                                 rebalance_interval=5.0, ewma_alpha=1.0)
+    sent = []
+    send = lambda process_idx, command: sent.append((process_idx, command))
+
+    # cam-0, cam-1 mỗi camera 60% CPU, cam-2, cam-3 mỗi camera 10%
+    now = scheduler._last_rebalance
+    scheduler.tick(send, now)
+    for _ in range(5):
+        now += 1.0
+        for idx, rate in enumerate([0.6, 0.6, 0.1, 0.1]):
+            decode_seconds[idx] += rate
+        scheduler.tick(send, now)
+    assert sent == [(0, ("stop", "cam-0"))]
+    assert scheduler.pending == {0: 1}
+
+    # Process cũ chưa nhả camera -> chưa gửi "start"
+    scheduler.tick(send, now + 1)
+    assert len(sent) == 1
+    assert scheduler.cameras_of(0) == [camera_urls[1]]
+    owners[0] = NO_OWNER
+    scheduler.tick(send, now + 2)
+    assert sent[1] == (1, ("start", "cam-0", "rtsp://cam0"))
+    assert scheduler.assignment == [1, 0, 1, 1] and not scheduler.pending
+
+
+def make_video(path, frames=60, size=(320, 240)):
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*"MJPG"), 25, size)
+    rng = np.random.default_rng(0)
+    for _ in range(frames):
+        writer.write(rng.integers(0, 255, size=(size[1], size[0], 3), dtype=np.uint8))
+    writer.release()
+
+
+def wait_for(condition, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.05)
+    return False
+
+
+def test_worker_start_stop_commands():
+    with tempfile.TemporaryDirectory() as tmp:
+        video = os.path.join(tmp, "cam.avi")
+        make_video(video)
+        names = ["cam-a", "cam-b"]
+        ring = SharedFrameRing(names)
+        decode_seconds = Array('d', 2)
+        owners = Array('i', [NO_OWNER] * 2)
+        commands = Queue()
+        worker = Process(target=camera_process_worker, args=(3, [("cam-a", video)], ring),
+                         kwargs={"target_fps": 25.0, "command_queue": commands,
+                                 "decode_seconds": decode_seconds, "owners": owners}, daemon=True)
+        worker.start()
+        try:
+            assert wait_for(lambda: owners[0] == 3 and decode_seconds[0] > 0, 10.0), decode_seconds[:]
+            commands.put(("start", "cam-b", video))
+            assert wait_for(lambda: owners[1] == 3 and decode_seconds[1] > 0, 10.0)
+            assert wait_for(lambda: ring.latest_seq("cam-b") > 0, 5.0)
+
+            commands.put(("stop", "cam-a"))
+            assert wait_for(lambda: owners[0] == NO_OWNER, 5.0)
+            seq = ring.latest_seq("cam-a")
+            time.sleep(0.5)
+            assert ring.latest_seq("cam-a") == seq  # thread cũ không còn ghi vào ring
+            commands.put(("start", "cam-a", video))
+            assert wait_for(lambda: owners[0] == 3 and ring.latest_seq("cam-a") > seq, 5.0)
+        finally:
+            worker.terminate()
+            worker.join()
+            ring.close()
+            ring.unlink()
+
+
+if __name__ == "__main__":
+    for name, fn in list(globals().items()):
+        if name.startswith("test_"):
+            start = time.perf_counter()
+            fn()
+            print(f"[OK] {name} ({time.perf_counter() - start:.2f}s)")
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Test lease / ack của consumer group trong SQLiteQueue (subscribe(..., group=..., visibility_timeout=...)):
+
+- Nhiều process cùng group: mỗi message giao đúng 1 lần khi consumer ack
+- Không ack trong visibility_timeout -> giao lại (deliveries tăng, state giữ nguyên)
+- nack(delay) giao lại sau delay; dead_letter() chuyển sang "<topic>_dlq"
+- Fencing theo deliveries: consumer cũ (lease đã hết hạn và giao lại) không ack/nack/dead_letter được
+
+Chạy từ thư mục ai/:
+    python test/test_consumer_leases.py
+    python -m pytest -q test/test_consumer_leases.py
+"""
+
+import os
+import sys
+import tempfile
+import time
+from multiprocessing import Pool
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from queue_store import SQLiteQueue
+
+
+def consume_and_ack(db_path):
+    queue = SQLiteQueue(db_path)
+    subscription = queue.subscribe("stable_pairs", start="earliest", group="post_api", visibility_timeout=30.0)
+    seen = []
+    while True:
+        rows = subscription.poll(timeout=0.5)
+        if not rows:
+            break
+        for row in rows:
+            seen.append(row["id"])
+            subscription.ack(row)
+    queue.close()
+    return seen
+
+
+def test_group_delivers_once_across_processes():
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "queues.db")
+        queue = SQLiteQueue(db_path)
+        queue.publish_many("stable_pairs", [(str(i), {"i": i}) for i in range(2000)])
+        with Pool(4) as pool:
+            results = pool.map(consume_and_ack, [db_path] * 4)
+        leases = queue._connect().execute("SELECT COUNT(*) FROM consumer_leases").fetchone()[0]
+        queue.close()
+        ids = [i for seen in results for i in seen]
+        assert len(ids) == len(set(ids)) == 2000
+        assert leases == 0
+
+
+def test_redelivery_after_visibility_timeout():
+    with tempfile.TemporaryDirectory() as tmp:
+        queue = SQLiteQueue(os.path.join(tmp, "queues.db"))
+        queue.publish("stable_pairs", "101 -> 201", {"start_slot": "101"})
+        subscription = queue.subscribe("stable_pairs", start="earliest", group="post_api", visibility_timeout=0.3)
+        (row,) = subscription.poll(timeout=1.0)
+        assert row["deliveries"] == 1 and row["state"] is None
+        subscription.extend_lease(row, state={"order_id": 7})
+        start = time.time()
+        (again,) = subscription.poll(timeout=2.0)  # không ack -> giao lại sau 0.3s
+        assert time.time() - start >= 0.25
+        assert (again["id"], again["deliveries"], again["state"]) == (row["id"], 2, {"order_id": 7})
+
+        subscription.nack(again, delay=0.2)
+        (third,) = subscription.poll(timeout=2.0)
+        assert third["deliveries"] == 3
+        subscription.dead_letter(third, "post_failed_after_retries")
+        assert subscription.poll(timeout=0.5) == []
+        (dlq,) = queue.get_after_id_topic("stable_pairs_dlq", 0, 10)
+        queue.close()
+        assert dlq["payload"]["message_id"] == row["id"]
+        assert dlq["payload"]["payload"] == {"start_slot": "101"}
+        assert dlq["payload"]["reason"] == "post_failed_after_retries"
+
+
+def test_stale_consumer_is_fenced():
+    with tempfile.TemporaryDirectory() as tmp:
+        queue = SQLiteQueue(os.path.join(tmp, "queues.db"))
+        queue.publish("stable_pairs", "a", {"n": 1})
+        old = queue.subscribe("stable_pairs", start="earliest", group="post_api", visibility_timeout=0.2)
+        new = queue.subscribe("stable_pairs", start="earliest", group="post_api", visibility_timeout=30.0)
+        [stale] = old.poll(timeout=1.0)
+        time.sleep(0.3)
+        [current] = new.poll(timeout=1.0)
+        assert (stale["deliveries"], current["deliveries"]) == (1, 2)
+
+        # Lần giao cũ không được đụng vào lease của lần giao mới
+        assert not old.extend_lease(stale)
+        assert not old.nack(stale)
+        assert not old.dead_letter(stale, "stale")
+        assert not old.ack(stale)
+        assert queue.get_after_id_topic("stable_pairs_dlq", 0, 10) == []
+        assert queue.next_lease_visible("post_api", "stable_pairs") > time.time() + 10
+
+        assert new.extend_lease(current)
+        assert new.ack(current)
+        assert queue.next_lease_visible("post_api", "stable_pairs") is None
+        queue.close()
+
+
+if __name__ == "__main__":
+    for name, fn in list(globals().items()):
+        if name.startswith("test_"):
+            start = time.perf_counter()
+            fn()
+            print(f"[OK] {name} ({time.perf_counter() - start:.2f}s)")
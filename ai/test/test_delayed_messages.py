@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Test message hẹn giờ của SQLiteQueue (publish(..., deliver_at=...)):
+
+- Subscription.poll() thức dậy đúng lúc message đến hạn (không giao sớm)
+- Message hẹn giờ bền qua restart (queue mới vẫn giao)
+- Nhiều process cùng release_due(): mỗi message chỉ giao 1 lần, giữ thứ tự deliver_at
+
+Chạy từ thư mục ai/:
+    python test/test_delayed_messages.py
+    python -m pytest -q test/test_delayed_messages.py
+"""
+
+import os
+import sys
+import tempfile
+import time
+from multiprocessing import Pool
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from queue_store import SQLiteQueue
+
+
+def test_poll_wakes_at_deliver_at():
+    with tempfile.TemporaryDirectory() as tmp:
+        queue = SQLiteQueue(os.path.join(tmp, "queues.db"))
+        subscription = queue.subscribe("unlock_start_slot", start="latest")
+        start = time.time()
+        queue.publish("unlock_start_slot", "101", {"start_slot": "101"}, deliver_at=start + 0.3)
+        queue.publish("unlock_start_slot", "102", {"start_slot": "102"})  # giao ngay
+        assert [r["key"] for r in subscription.poll(timeout=1.0)] == ["102"]
+        rows = subscription.poll(timeout=2.0)
+        elapsed = time.time() - start
+        queue.close()
+        assert [r["key"] for r in rows] == ["101"]
+        assert 0.3 <= elapsed < 0.5, elapsed
+
+
+def test_delayed_survive_restart():
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "queues.db")
+        with SQLiteQueue(db_path) as queue:
+            queue.publish("unlock_start_slot", "101", {"start_slot": "101"}, deliver_at=time.time() + 0.2)
+        time.sleep(0.3)
+        with SQLiteQueue(db_path) as queue:
+            rows = queue.subscribe("unlock_start_slot", start="earliest").poll(timeout=1.0)
+        assert [r["payload"]["start_slot"] for r in rows] == ["101"]
+
+
+def release_until(args):
+    db_path, until = args
+    queue = SQLiteQueue(db_path)
+    while time.time() < until:
+        queue.release_due("unlock_start_slot")
+    queue.close()
+
+
+def test_released_once_across_processes():
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "queues.db")
+        queue = SQLiteQueue(db_path)
+        due = time.time() + 0.3
+        # 200 message, deliver_at giảm dần theo i -> thứ tự giao ngược thứ tự publish
+        for i in range(200):
+            queue.publish("unlock_start_slot", str(i), {"i": i}, deliver_at=due + (200 - i) * 0.001)
+        with Pool(4) as pool:
+            pool.map(release_until, [(db_path, due + 0.6)] * 4)
+        rows = queue.get_after_id_topic("unlock_start_slot", 0, 1000)
+        queue.close()
+        assert [r["payload"]["i"] for r in rows] == list(range(199, -1, -1))
+
+
+if __name__ == "__main__":
+    for name, fn in list(globals().items()):
+        if name.startswith("test_"):
+            start = time.perf_counter()
+            fn()
+            print(f"[OK] {name} ({time.perf_counter() - start:.2f}s)")
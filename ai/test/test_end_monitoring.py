@@ -11,6 +11,7 @@ import os
 # Add project root to path
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
+from queue_codec import decode_payload
 from queue_store import SQLiteQueue
 
 def test_end_monitoring():
@@ -54,7 +55,7 @@ def test_end_monitoring():
             )
             row = cur.fetchone()
             if row:
-                payload = json.loads(row[0])
+                payload = decode_payload(row[0])
                 print(f"   - Message mới nhất: {payload}")
             else:
                 print("   - Không có message nào trong queue")
@@ -78,7 +79,7 @@ def test_end_monitoring():
             rows = cur.fetchall()
             for row in rows:
                 camera_id = row[0]
-                payload = json.loads(row[1])
+                payload = decode_payload(row[1])
                 roi_count = payload.get('roi_detection_count', 0)
                 print(f"   - Camera {camera_id}: {roi_count} ROI detections")
     except Exception as e:
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Test SharedFrameRing (detectObject/frame_ring.py), đường đi của mọi frame camera -> AI inference:
+
+- Writer ở process khác ghi liên tục (ring quay vòng nhiều lần) trong khi reader read_latest/is_valid:
+  view được is_valid() chấp nhận luôn có dữ liệu nguyên vẹn của đúng 1 frame
+- View đọc trước khi writer ghi đè slot luôn bị is_valid() từ chối
+- Round-trip raw (np.ndarray) / JPEG (bytes) / trạng thái qua __setitem__ / get, và qua pickle (__reduce__)
+
+Chạy từ thư mục ai/:
+    python test/test_frame_ring.py
+    python -m pytest -q test/test_frame_ring.py
+"""
+
+import multiprocessing as mp
+import os
+import pickle
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "detectObject"))
+from frame_ring import SharedFrameRing
+
+FRAME_BYTES = 64 * 1024
+
+
+def write_frames(ring, stop_event, sizes):
+    """Writer: frame thứ n có mọi byte = n % 256 và độ dài thay đổi theo sizes"""
+    seq = 0
+    while not stop_event.is_set():
+        seq += 1
+        size = sizes[seq % len(sizes)]
+        ring.write("cam", bytes([seq % 256]) * size)
+    ring.close()
+
+
+def write_from_attached(ring, frame):
+    """Process con: ring tới qua pickle (__reduce__ -> attach), đọc frame raw rồi ghi frame JPEG mới"""
+    assert ring.name and np.array_equal(ring.get("raw")["frame"], frame)
+    ring["jpeg"] = {"frame": b"next", "ts": 4.5, "status": "ok"}
+    ring.close()
+    ring.unlink()  # không phải owner -> không giải phóng vùng nhớ
+
+
+def test_concurrent_writer_never_yields_torn_frame():
+    ring = SharedFrameRing(["cam"], num_slots=2, slot_bytes=FRAME_BYTES)
+    ctx = mp.get_context("spawn")  # ring đi qua pickle (__reduce__ -> attach) như khi chạy thật
+    stop = ctx.Event()
+    writer = ctx.Process(target=write_frames, args=(ring, stop, [FRAME_BYTES, FRAME_BYTES // 2, 1000]))
+    writer.start()
+    accepted = rejected = 0
+    try:
+        deadline = time.monotonic() + 20.0
+        while ring.latest_seq("cam") == 0 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        end = time.monotonic() + 2.0
+        while time.monotonic() < end:
+            view = ring.read_latest("cam")
+            if view is None:
+                continue
+            data = bytes(view.data)  # dùng dữ liệu (copy) trước khi kiểm tra lại version
+            view.data.release()
+            if not ring.is_valid(view):
+                rejected += 1
+                continue
+            accepted += 1
+            assert len(data) in (FRAME_BYTES, FRAME_BYTES // 2, 1000)
+            assert data.count(data[0]) == len(data), f"frame {view.frame_seq} bị ghi dở"
+            assert data[0] == view.frame_seq % 256
+        wrapped = ring.latest_seq("cam")
+    finally:
+        stop.set()
+        writer.join(timeout=10.0)
+        ring.close()
+        ring.unlink()
+    assert writer.exitcode == 0
+    assert wrapped > 100  # ring 2 slot đã quay vòng nhiều lần trong lúc đọc
+    assert accepted > 100, (accepted, rejected)
+
+
+def test_overwritten_view_is_rejected():
+    ring = SharedFrameRing(["cam"], num_slots=2, slot_bytes=1024)
+    try:
+        ring.write("cam", b"a" * 100)
+        view = ring.read_latest("cam")
+        assert ring.is_valid(view)
+        ring.write("cam", b"b" * 100)  # slot còn lại
+        assert ring.is_valid(view)
+        ring.write("cam", b"c" * 100)  # quay vòng: ghi đè slot của view
+        assert not ring.is_valid(view)
+        view.data.release()
+        latest = ring.read_latest("cam")
+        assert (latest.frame_seq, bytes(latest.data)) == (3, b"c" * 100)
+        latest.data.release()
+    finally:
+        ring.close()
+        ring.unlink()
+
+
+def test_roundtrip_raw_jpeg_status_and_pickle():
+    ctx = mp.get_context("spawn")
+    event = ctx.Event()
+    ring = SharedFrameRing(["raw", "jpeg", "down"], num_slots=3, slot_bytes=64 * 48 * 3, new_frame_event=event)
+    try:
+        frame = np.random.default_rng(0).integers(0, 256, size=(48, 64, 3), dtype=np.uint8)
+        ring["raw"] = {"frame": frame, "ts": 1.5, "status": "ok"}
+        ring["jpeg"] = {"frame": b"\xff\xd8jpeg\xff\xd9", "ts": 2.5, "status": "ok"}
+        ring["down"] = {"frame": None, "ts": 3.5, "status": "retrying", "retry_count": 2}
+        assert event.is_set()
+
+        got = ring.get("raw")
+        assert got["status"] == "ok" and got["ts"] == 1.5
+        assert isinstance(got["frame"], np.ndarray) and np.array_equal(got["frame"], frame)
+        assert ring.get("jpeg") == {"frame": b"\xff\xd8jpeg\xff\xd9", "ts": 2.5, "status": "ok", "retry_count": 0}
+        assert ring.get("down") == {"frame": None, "ts": 3.5, "status": "retrying", "retry_count": 2}
+        assert ring.get("unknown", "default") == "default"
+        assert sorted(ring.keys()) == ["down", "jpeg", "raw"]
+        # Frame lớn hơn slot bị bỏ qua
+        assert ring.write("jpeg", b"x" * (ring.slot_bytes + 1)) is None
+
+        # Trong cùng process, pickle -> attach thấy cùng vùng nhớ (event chỉ truyền được khi spawn process)
+        plain = SharedFrameRing(["cam"], num_slots=2, slot_bytes=16)
+        attached = pickle.loads(pickle.dumps(plain))
+        assert (attached.name, attached.camera_names, attached.num_slots) == (plain.name, ["cam"], 2)
+        attached.write("cam", b"pickled")
+        assert plain.get("cam")["frame"] == b"pickled"
+        attached.close()
+        plain.close()
+        plain.unlink()
+
+        # Process con nhận ring (kèm new_frame_event) qua pickle, ghi frame cho process gốc đọc
+        event.clear()
+        child = ctx.Process(target=write_from_attached, args=(ring, frame))
+        child.start()
+        child.join(timeout=30.0)
+        assert child.exitcode == 0
+        assert event.is_set()
+        assert ring.get("jpeg")["frame"] == b"next"
+        assert ring.frame_info("jpeg") == (2, 4.5, "ok")
+        assert np.array_equal(ring.get("raw")["frame"], frame)
+    finally:
+        ring.close()
+        ring.unlink()
+
+
+if __name__ == "__main__":
+    for name, fn in list(globals().items()):
+        if name.startswith("test_"):
+            start = time.perf_counter()
+            fn()
+            print(f"[OK] {name} ({time.perf_counter() - start:.2f}s)")
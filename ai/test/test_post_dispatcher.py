@@ -0,0 +1,309 @@
+#!/usr/bin/env python3
+"""
+Test PairDispatcher (postRq/postAPI.py) với stub ICS server chạy local:
+
+- Cặp bị ICS trả chậm không chặn các cặp phía sau
+- Lỗi tạm thời được retry với backoff tăng dần
+- Vượt deadline đủ số lần -> FAIL + hẹn giờ unlock_start_slot
+- Kết nối keep-alive được dùng lại (số kết nối <= max_in_flight)
+- At-least-once: giao lại giữ nguyên orderId, quá số lần giao -> stable_pairs_dlq,
+  restart không mất cặp publish lúc postAPI dừng và không gửi lại cặp đã ack
+- Backlog lớn hơn max_in_flight với lease ngắn: lease được gia hạn / lần giao lại gộp vào task đang chạy,
+  mỗi orderId chỉ được POST 1 lần
+- Thao tác queues.db (cấp orderId, lease, ack, unlock) chạy trên thread DB riêng: writer khác giữ DB không làm
+  event loop (các POST đang chạy) bị chặn
+
+Chạy từ thư mục ai/:
+    python test/test_post_dispatcher.py
+    python -m pytest -q test/test_post_dispatcher.py
+"""
+
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "postRq"))
+import postAPI
+from postAPI import GROUP, TOPIC, PairDispatcher, make_client
+from queue_store import SQLiteQueue
+
+
+class StubICS:
+    """
+    Stub /ics/taskOrder/addTask. Hành vi theo start slot trong taskPath:
+    - "slow-<giây>": trả lời sau <giây>
+    - "flaky-<n>": HTTP 500 cho n lần đầu, sau đó OK
+    - còn lại: OK ngay (code 2009)
+    """
+
+    def __init__(self):
+        self.attempts = {}
+        self.order_ids = {}
+        self.client_ports = set()
+        self.lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # keep-alive
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                start_slot = body["taskOrderDetail"][0]["taskPath"].split(",")[0]
+                with stub.lock:
+                    stub.client_ports.add(self.client_address[1])
+                    attempt = stub.attempts[start_slot] = stub.attempts.get(start_slot, 0) + 1
+                    stub.order_ids.setdefault(start_slot, []).append(body["orderId"])
+                status = 200
+                if start_slot.startswith("slow-"):
+                    time.sleep(float(start_slot.split("-")[1]))
+                elif start_slot.startswith("flaky-") and attempt <= int(start_slot.split("-")[1]):
+                    status = 500
+                data = json.dumps({"code": 2009 if status == 200 else 5000}).encode()
+                try:
+                    self.send_response(status)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(data)))
+                    self.end_headers()
+                    self.wfile.write(data)
+                except OSError:
+                    pass  # client đã bỏ request (deadline)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self.server.server_port}/ics/taskOrder/addTask"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def publish_pairs(queue, start_slots):
+    queue.publish_many(TOPIC, [(f"{slot} -> end", {"pair_id": f"{slot} -> end", "start_slot": slot, "end_slot": "end"})
+                               for slot in start_slots])
+
+
+def dispatch_until_done(queue, stub, start_slots, visibility_timeout=30.0, timeout=10.0, **kwargs):
+    """
+    Chạy vòng poll -> PairDispatcher như postAPI.run() đến khi mọi cặp có kết quả cuối
+    (ack = True, dead letter = False). Trả về ({slot: kết quả}, {slot: giây đến lúc xong})
+    """
+    subscription = queue.subscribe(TOPIC, start="earliest", group=GROUP, visibility_timeout=visibility_timeout)
+    max_deliveries = kwargs.get("max_deliveries", postAPI.MAX_DELIVERIES)
+    final, done_at = {}, {}
+
+    async def main():
+        loop = asyncio.get_running_loop()
+        max_in_flight = kwargs.pop("max_in_flight", postAPI.MAX_IN_FLIGHT)
+        async with make_client(max_in_flight) as client:
+            dispatcher = PairDispatcher(subscription, client, stub.url, max_in_flight=max_in_flight, **kwargs)
+            start = time.perf_counter()
+
+            def on_done(task, row):
+                slot = row["payload"]["start_slot"]
+                if task.result() or row["deliveries"] >= max_deliveries:
+                    final[slot] = task.result()
+                    done_at[slot] = time.perf_counter() - start
+
+            while len(final) < len(start_slots) and time.perf_counter() - start < timeout:
+                for row in await loop.run_in_executor(None, subscription.poll, 0.1):
+                    task = dispatcher.submit(row)
+                    if task is not None:
+                        task.add_done_callback(lambda task, row=row: on_done(task, row))
+            await dispatcher.drain()
+            dispatcher.close()
+
+    asyncio.run(main())
+    return final, done_at
+
+
+def run_pairs(start_slots, **kwargs):
+    """Publish các cặp (start_slot, "end") vào stable_pairs rồi gửi qua dispatcher; trả về (kết quả, thời điểm xong, stub, queue)"""
+    stub = StubICS()
+    queue = SQLiteQueue(os.path.join(tempfile.mkdtemp(), "queues.db"))
+    publish_pairs(queue, start_slots)
+    try:
+        final, done_at = dispatch_until_done(queue, stub, start_slots, **kwargs)
+    finally:
+        stub.close()
+    return [final.get(slot) for slot in start_slots], done_at, stub, queue
+
+
+def test_slow_pair_does_not_block_others():
+    results, done_at, _, queue = run_pairs(["slow-2"] + [f"fast-{i}" for i in range(5)])
+    queue.close()
+    assert all(results)
+    assert max(done_at[f"fast-{i}"] for i in range(5)) < 1.0, done_at
+    assert done_at["slow-2"] >= 2.0
+
+
+def test_retry_with_backoff():
+    results, done_at, stub, queue = run_pairs(["flaky-2", "fast-0"], backoff_base=0.2)
+    queue.close()
+    assert results == [True, True]
+    assert stub.attempts["flaky-2"] == 3
+    assert done_at["flaky-2"] >= 0.2 + 0.4  # backoff 0.2s rồi 0.4s
+    assert done_at["fast-0"] < 0.5
+
+
+def test_deadline_then_unlock():
+    results, _, stub, queue = run_pairs(["slow-3"], deadline=0.3, max_attempts=2, backoff_base=0.1,
+                                        max_deliveries=1, unlock_delay=0.5)
+    assert results == [False]
+    assert stub.attempts["slow-3"] == 2
+    # unlock hẹn giờ (deliver_at): chưa có trong topic, subscriber nhận khi đến hạn
+    assert not queue.get_after_id_topic("unlock_start_slot", 0, 10)
+    unlocks = queue.subscribe("unlock_start_slot", start="earliest").poll(timeout=3.0)
+    queue.close()
+    assert [r["payload"]["start_slot"] for r in unlocks] == ["slow-3"]
+
+
+def test_connection_reuse():
+    results, _, stub, queue = run_pairs([f"fast-{i}" for i in range(40)], max_in_flight=2)
+    queue.close()
+    assert all(results)
+    assert len(stub.client_ports) <= 2, stub.client_ports
+
+
+def test_redelivery_keeps_order_id():
+    # Lần giao 1: 2 lần thử đều lỗi -> nack; lần giao 2 thành công với cùng orderId
+    results, _, stub, queue = run_pairs(["flaky-2"], max_attempts=2, backoff_base=0.05, redelivery_delay=0.2)
+    dlq = queue.get_after_id_topic(f"{TOPIC}_dlq", 0, 10)
+    queue.close()
+    assert results == [True]
+    assert stub.attempts["flaky-2"] == 3
+    assert len(set(stub.order_ids["flaky-2"])) == 1
+    assert not dlq
+
+
+def test_dead_letter_after_max_deliveries():
+    results, _, stub, queue = run_pairs(["flaky-99", "fast-0"], max_attempts=1, max_deliveries=2,
+                                        redelivery_delay=0.1, unlock_delay=0)
+    dlq = queue.get_after_id_topic(f"{TOPIC}_dlq", 0, 10)
+    unlocks = queue.get_after_id_topic("unlock_start_slot", 0, 10)
+    queue.close()
+    assert results == [False, True]
+    assert stub.attempts["flaky-99"] == 2
+    assert [(r["payload"]["payload"]["start_slot"], r["payload"]["deliveries"]) for r in dlq] == [("flaky-99", 2)]
+    assert [r["payload"]["start_slot"] for r in unlocks] == ["flaky-99"]
+
+
+def test_backlog_outlives_lease_without_double_send():
+    slots = [f"slow-0.3-{i}" for i in range(6)]
+    # renew_interval mặc định (visibility_timeout / 3) và renew_interval > visibility_timeout
+    # (lease hết hạn, poll() giao lại cặp còn đang chờ slot trong dispatcher)
+    for renew_interval in (None, 10.0):
+        results, _, stub, queue = run_pairs(slots, max_in_flight=1, visibility_timeout=0.5,
+                                            renew_interval=renew_interval)
+        leases = queue.next_lease_visible(GROUP, TOPIC)
+        queue.close()
+        assert results == [True] * 6
+        assert all(stub.attempts[slot] == 1 for slot in slots), stub.attempts
+        order_ids = [stub.order_ids[slot][0] for slot in slots]
+        assert order_ids == sorted(set(order_ids))
+        assert leases is None  # mọi cặp đã ack
+
+
+def hold_db_lock(queue, seconds, held):
+    """Writer khác giữ queues.db (SQLiteQueue._lock, như poller trong BEGIN IMMEDIATE)"""
+    with queue._lock:
+        held.set()
+        time.sleep(seconds)
+
+
+def test_db_lock_does_not_stall_event_loop():
+    stub = StubICS()
+    queue = SQLiteQueue(os.path.join(tempfile.mkdtemp(), "queues.db"))
+    slots = [f"slow-0.1-{i}" for i in range(4)]
+    publish_pairs(queue, slots)
+    subscription = queue.subscribe(TOPIC, start="earliest", group=GROUP, visibility_timeout=30.0)
+    rows = subscription.poll(timeout=1.0)
+    gaps = []
+
+    async def main():
+        async with make_client() as client:
+            dispatcher = PairDispatcher(subscription, client, stub.url)
+            # Hết block orderId: submit() không chờ reserve_sequence khi DB đang bị giữ
+            held = threading.Event()
+            holder = threading.Thread(target=hold_db_lock, args=(queue, 0.3, held))
+            holder.start()
+            held.wait()
+            start = time.perf_counter()
+            tasks = [dispatcher.submit(row) for row in rows]
+            submit_time = time.perf_counter() - start
+            holder.join()
+
+            async def heartbeat():
+                last = time.perf_counter()
+                while True:
+                    await asyncio.sleep(0.01)
+                    now = time.perf_counter()
+                    gaps.append(now - last)
+                    last = now
+
+            beat = asyncio.create_task(heartbeat())
+            await asyncio.sleep(0.05)
+            # DB bị giữ 0.6s trong lúc POST trả về và cần ack
+            held = threading.Event()
+            holder = threading.Thread(target=hold_db_lock, args=(queue, 0.6, held))
+            holder.start()
+            held.wait()
+            results = await asyncio.gather(*tasks)
+            beat.cancel()
+            holder.join()
+            dispatcher.close()
+            return results, submit_time
+
+    try:
+        results, submit_time = asyncio.run(main())
+        leases = queue.next_lease_visible(GROUP, TOPIC)
+    finally:
+        stub.close()
+        queue.close()
+    assert results == [True] * 4
+    assert leases is None
+    assert submit_time < 0.05, submit_time
+    assert max(gaps) < 0.2, max(gaps)
+    assert len({stub.order_ids[slot][0] for slot in slots}) == 4
+
+
+def test_restart_resumes_and_redelivers():
+    stub = StubICS()
+    db_path = os.path.join(tempfile.mkdtemp(), "queues.db")
+    queue = SQLiteQueue(db_path)
+    publish_pairs(queue, ["a-0", "a-1", "a-2"])
+    # postAPI cũ nhận 3 cặp (lease) rồi chết trước khi POST
+    crashed = queue.subscribe(TOPIC, start="earliest", group=GROUP, visibility_timeout=0.3)
+    assert len(crashed.poll(timeout=1.0)) == 3
+    queue.close()
+
+    # 2 cặp publish trong lúc postAPI dừng
+    queue = SQLiteQueue(db_path)
+    publish_pairs(queue, ["b-0", "b-1"])
+    slots = ["a-0", "a-1", "a-2", "b-0", "b-1"]
+    try:
+        final, _ = dispatch_until_done(queue, stub, slots, visibility_timeout=0.3)
+        # Restart lần nữa: mọi cặp đã ack, không gửi lại
+        again = queue.subscribe(TOPIC, start="earliest", group=GROUP, visibility_timeout=0.3).poll(timeout=0.6)
+    finally:
+        stub.close()
+        queue.close()
+    assert final == {slot: True for slot in slots}
+    assert all(stub.attempts[slot] == 1 for slot in slots)
+    assert again == []
+
+
+if __name__ == "__main__":
+    for name, fn in list(globals().items()):
+        if name.startswith("test_"):
+            start = time.perf_counter()
+            fn()
+            print(f"[OK] {name} ({time.perf_counter() - start:.2f}s)")
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+Test SequenceAllocator (queue_store.py), nguồn orderId của postAPI:
+
+- Tăng dần qua các lần restart (allocator mới tiếp tục sau block đã giữ chỗ)
+- Nhiều process cùng cấp trên 1 queues.db: không trùng, mỗi process tăng dần
+- floor: tiếp tục sau giá trị của order_id.txt cũ
+
+Chạy từ thư mục ai/:
+    python test/test_sequence_allocator.py
+    python -m pytest -q test/test_sequence_allocator.py
+"""
+
+import os
+import sys
+import tempfile
+import time
+from multiprocessing import Pool
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from queue_store import SequenceAllocator, SQLiteQueue
+
+
+def allocate_many(args):
+    db_path, count, block_size = args
+    queue = SQLiteQueue(db_path)
+    allocator = SequenceAllocator(queue, "order", block_size)
+    ids = [allocator.allocate() for _ in range(count)]
+    queue.close()
+    return ids
+
+
+def test_monotonic_across_restarts():
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "queues.db")
+        seen = []
+        for _ in range(3):  # mỗi vòng = 1 lần restart postAPI
+            seen += allocate_many((db_path, 7, 5))
+        assert seen == sorted(set(seen)), seen
+        assert seen[:7] == [1, 2, 3, 4, 5, 6, 7]
+        assert seen[7] == 11  # phần còn lại của block [6, 11) bị bỏ qua
+
+
+def test_concurrent_processes_never_duplicate():
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "queues.db")
+        SQLiteQueue(db_path).close()
+        with Pool(4) as pool:
+            results = pool.map(allocate_many, [(db_path, 1000, 50)] * 4)
+        for ids in results:
+            assert ids == sorted(ids)
+        all_ids = [i for ids in results for i in ids]
+        assert len(set(all_ids)) == len(all_ids) == 4000
+
+
+def test_floor_from_legacy_counter():
+    with tempfile.TemporaryDirectory() as tmp:
+        queue = SQLiteQueue(os.path.join(tmp, "queues.db"))
+        assert SequenceAllocator(queue, "order", 10, floor=128).allocate() == 128
+        # floor nhỏ hơn giá trị đã cấp không kéo sequence lùi lại
+        assert SequenceAllocator(queue, "order", 10, floor=1).allocate() == 138
+        queue.close()
+
+
+if __name__ == "__main__":
+    for name, fn in list(globals().items()):
+        if name.startswith("test_"):
+            start = time.perf_counter()
+            fn()
+            print(f"[OK] {name} ({time.perf_counter() - start:.2f}s)")
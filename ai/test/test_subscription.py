@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+"""
+Test Subscription của SQLiteQueue (queue_store.py) và codec payload (queue_codec.py):
+
+- 2 consumer group khác nhau: mỗi group nhận đủ mọi message
+- Nhiều consumer (process) cùng group: không message nào bị giao cho 2 consumer
+- poll(timeout) thức dậy ngay khi process khác commit (không chờ hết timeout)
+- Lọc keys theo .keys hiện tại (gán lại .keys khi đang chạy)
+- get_after_ids(): cursor riêng mỗi key, tối đa limit message mỗi key kể cả khi backlog dài
+- Payload detection có khoá lạ hoặc trùng khoá meta của codec: ghi JSON như cũ; khoá lạ ngoài danh sách detection vẫn ghi BLOB,
+  đọc lại đúng payload gốc
+- Trường detection sai kiểu / tràn phạm vi layout nhị phân (class_id, slot_number, confidence, toạ độ):
+  ghi JSON, không lỗi publish; toạ độ int vẫn ghi nhị phân; đọc lại không đổi giá trị/kiểu
+
+Chạy từ thư mục ai/:
+    python test/test_subscription.py
+    python -m pytest -q test/test_subscription.py
+"""
+
+import json
+import os
+import sys
+import tempfile
+import time
+from multiprocessing import Pool, Process
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from queue_codec import DETECTION_CODEC, decode_payload
+from queue_store import SQLiteQueue
+
+
+def test_groups_each_receive_every_message():
+    with tempfile.TemporaryDirectory() as tmp:
+        queue = SQLiteQueue(os.path.join(tmp, "queues.db"))
+        post = queue.subscribe("stable_pairs", start="earliest", group="post", batch_size=7)
+        audit = queue.subscribe("stable_pairs", start="earliest", group="audit", batch_size=7)
+        queue.publish_many("stable_pairs", [(str(i), {"n": i}) for i in range(50)])
+        for subscription in (post, audit):
+            seen = []
+            while True:
+                rows = subscription.poll(timeout=0.1)
+                if not rows:
+                    break
+                seen.extend(r["payload"]["n"] for r in rows)
+            assert seen == list(range(50))
+        queue.close()
+
+
+def consume_group(db_path):
+    queue = SQLiteQueue(db_path)
+    subscription = queue.subscribe("raw_detection", start="earliest", group="roi", batch_size=5)
+    ids = []
+    while True:
+        rows = subscription.poll(timeout=1.0)
+        if not rows:
+            break
+        ids.extend(r["id"] for r in rows)
+    queue.close()
+    return ids
+
+
+def test_group_consumers_never_share_message():
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "queues.db")
+        queue = SQLiteQueue(db_path)
+        with Pool(3) as pool:
+            result = pool.map_async(consume_group, [db_path] * 3)
+            # Publish trong lúc 3 consumer đang poll
+            for i in range(300):
+                queue.publish("raw_detection", f"cam-{i % 4}", {"frame_id": i})
+            per_consumer = result.get(timeout=60)
+        published = [r["id"] for r in queue.get_after_id_topic("raw_detection", 0, 1000)]
+        queue.close()
+    received = [msg_id for ids in per_consumer for msg_id in ids]
+    assert len(received) == len(set(received)), "message bị giao cho 2 consumer"
+    assert sorted(received) == published
+    assert all(ids == sorted(ids) for ids in per_consumer)
+
+
+def publish_later(db_path, delay):
+    time.sleep(delay)
+    with SQLiteQueue(db_path) as queue:
+        queue.publish("roi_config", "cam-1", {"camera_id": "cam-1"})
+
+
+def test_poll_wakes_on_commit_from_other_process():
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "queues.db")
+        queue = SQLiteQueue(db_path)
+        subscription = queue.subscribe("roi_config")
+        publisher = Process(target=publish_later, args=(db_path, 0.3))
+        start = time.monotonic()
+        publisher.start()
+        rows = subscription.poll(timeout=5.0)
+        elapsed = time.monotonic() - start
+        publisher.join()
+        queue.close()
+    assert [r["payload"] for r in rows] == [{"camera_id": "cam-1"}]
+    assert 0.3 <= elapsed < 1.0, elapsed
+
+
+def test_keys_filter_follows_reassignment():
+    with tempfile.TemporaryDirectory() as tmp:
+        queue = SQLiteQueue(os.path.join(tmp, "queues.db"))
+        subscription = queue.subscribe("roi_config", keys=["cam-1"])
+        queue.publish("roi_config", "cam-1", {"v": 1})
+        queue.publish("roi_config", "cam-2", {"v": 2})
+        assert [r["key"] for r in subscription.poll(timeout=0.5)] == ["cam-1"]
+
+        subscription.keys = ["cam-2", "cam-3"]
+        queue.publish("roi_config", "cam-1", {"v": 3})
+        queue.publish("roi_config", "cam-3", {"v": 4})
+        assert [(r["key"], r["payload"]["v"]) for r in subscription.poll(timeout=0.5)] == [("cam-2", 2), ("cam-3", 4)]
+
+        subscription.keys = []
+        queue.publish("roi_config", "cam-2", {"v": 5})
+        assert subscription.poll(timeout=0.1) == []
+        # Id mới nhất của 1 key (roi_visualizer phát hiện ROI thay đổi)
+        assert queue.get_latest_id("roi_config", "cam-2") == queue.get_latest_row("roi_config", "cam-2")["id"] == 5
+        assert queue.get_latest_id("roi_config", "cam-9") is None
+        queue.close()
+
+
+def test_after_ids_limits_each_key():
+    with tempfile.TemporaryDirectory() as tmp:
+        queue = SQLiteQueue(os.path.join(tmp, "queues.db"))
+        queue.publish_many("raw_detection", [(f"cam-{i % 3}", {"n": i}) for i in range(3000)])
+        result = queue.get_after_ids("raw_detection", {"cam-0": 0, "cam-1": 2950, "cam-9": 0}, limit=4)
+        queue.close()
+    assert {key: [r["payload"]["n"] for r in rows] for key, rows in result.items()} == {
+        "cam-0": [0, 3, 6, 9],
+        "cam-1": [2950, 2953, 2956, 2959],
+    }
+
+
+def detection(class_name, confidence, **extra):
+    det = {"class_id": 0, "class_name": class_name, "confidence": confidence,
+           "bbox": {"x1": 10.5, "y1": 20.0, "x2": 110.25, "y2": 220.0}, "center": {"x": 60.375, "y": 120.0}}
+    det.update(extra)
+    return det
+
+
+def test_detection_codec_unexpected_keys_roundtrip():
+    payloads = [
+        # Khoá lạ ngoài danh sách detection -> vẫn BLOB (nằm trong meta)
+        {"camera_id": "cam-1", "frame_id": 7, "detections": [detection("shelf", 0.5, slot_number=3)],
+         "detection_count": 1, "extra": {"_list": "x", "nested": [1, 2]}},
+        # Toạ độ float64 (0.1 không biểu diễn đúng bằng float32)
+        {"camera_id": "cam-1", "roi_detections": [detection("shelf", 0.1)], "roi_detection_count": 1},
+        # Khoá trùng khoá meta của codec / detection có khoá lạ / thiếu khoá / bbox sai dạng -> JSON như cũ
+        {"camera_id": "cam-2", "detections": [detection("shelf", 0.5)], "_names": "not-a-table"},
+        {"camera_id": "cam-2", "detections": [detection("shelf", 0.5, track_id=9)]},
+        {"camera_id": "cam-2", "detections": [{"class_id": 0, "class_name": "shelf", "confidence": 0.5}]},
+        {"camera_id": "cam-2", "detections": [detection("shelf", 0.5, bbox=[1, 2, 3, 4])]},
+        # Không có danh sách detection
+        {"camera_id": "cam-3", "detections": None},
+    ]
+    with tempfile.TemporaryDirectory() as tmp:
+        queue = SQLiteQueue(os.path.join(tmp, "queues.db"))
+        subscription = queue.subscribe("raw_detection", start="earliest")
+        for payload in payloads:
+            queue.publish("raw_detection", payload["camera_id"], payload)
+        rows = subscription.poll(timeout=0.5)
+        stored = [type(r[0]) for r in queue._connect().execute("SELECT payload FROM messages ORDER BY id")]
+        queue.close()
+    assert [r["payload"] for r in rows] == payloads
+    assert stored == [bytes, bytes, str, str, str, str, str]
+    # BLOB không có MAGIC detection được đọc như JSON
+    assert decode_payload(b'{"camera_id": "cam-4"}') == {"camera_id": "cam-4"}
+
+
+def test_detection_codec_rejects_lossy_fields():
+    lossy = [
+        detection("shelf", 0.5, slot_number=None),
+        detection("shelf", 0.5, slot_number="3"),
+        detection("shelf", 0.5, slot_number=-1),  # trùng NO_SLOT
+        detection("shelf", 0.5, slot_number=2 ** 31),
+        detection("shelf", 0.5, slot_number=True),
+        detection("shelf", 0.5, class_id=70000),  # tràn int16
+        detection("shelf", 0.5, class_id=1.7),
+        detection(7, 0.5),
+        detection("shelf", None),
+        detection("shelf", True),
+        detection("shelf", 0.5, bbox={"x1": "10.5", "y1": 20.0, "x2": 110.25, "y2": 220.0}),
+        detection("shelf", 0.5, center={"x": 2 ** 60, "y": 120.0}),  # float64 không biểu diễn chính xác
+    ]
+    for det in lossy:
+        payload = {"camera_id": "cam-1", "detections": [detection("shelf", 0.25), det], "detection_count": 2}
+        encoded = DETECTION_CODEC.encode(payload)
+        assert isinstance(encoded, str), det
+        # So chuỗi JSON để phân biệt cả kiểu (1 và 1.0)
+        assert json.dumps(decode_payload(encoded)) == json.dumps(payload)
+    # Đúng kiểu (kể cả toạ độ int của detection "empty") vẫn ghi nhị phân và đọc lại nguyên kiểu
+    exact = [
+        [detection("shelf", 0.25, class_id=-5, slot_number=2 ** 31 - 1)],
+        [detection("shelf", 0.25), detection("empty", 1, class_id=-1, slot_number=2,
+                                             bbox={"x1": 10, "y1": 20, "x2": 110, "y2": 220},
+                                             center={"x": 60.0, "y": 120})],
+        [detection("empty", 1.0, center={"x": 0.1, "y": -2 ** 53})],
+    ]
+    for dets in exact:
+        payload = {"camera_id": "cam-1", "roi_detections": dets, "roi_detection_count": len(dets)}
+        encoded = DETECTION_CODEC.encode(payload)
+        assert isinstance(encoded, bytes), dets
+        assert json.dumps(decode_payload(encoded)) == json.dumps(payload)
+
+if __name__ == "__main__":
+    for name, fn in list(globals().items()):
+        if name.startswith("test_"):
+            start = time.perf_counter()
+            fn()
+            print(f"[OK] {name} ({time.perf_counter() - start:.2f}s)")
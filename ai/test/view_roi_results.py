@@ -1,6 +1,7 @@
 import argparse
 import json
 from datetime import datetime
+from queue_codec import decode_payload
 from queue_store import SQLiteQueue
 
 
@@ -70,7 +71,7 @@ def view_roi_detection_results(db_path: str = "queues.db", camera_id: str = None
             print()
             
             for idx, (msg_id, payload_json, created_at) in enumerate(rows, 1):
-                payload = json.loads(payload_json)
+                payload = decode_payload(payload_json)
                 print(f"--- Kết quả {idx} (ID: {msg_id}) ---")
                 print(f"Timestamp: {payload['timestamp']}")
                 print(f"Frame ID: {payload['frame_id']}")
@@ -168,7 +169,7 @@ def view_recent_history(db_path: str = "queues.db", camera_id: str = None, limit
             continue
         
         for i, (msg_id, payload_json, created_at) in enumerate(rows, 1):
-            payload = json.loads(payload_json)
+            payload = decode_payload(payload_json)
             print(f"{i}. Frame {payload['frame_id']} - {created_at}")
             print(f"   ROI Detections: {payload['roi_detection_count']}/{payload['original_detection_count']}")
             
@@ -263,7 +264,7 @@ def export_results_to_json(db_path: str = "queues.db", camera_id: str = None, ou
     
     results = []
     for msg_id, key, payload_json, created_at in rows:
-        payload = json.loads(payload_json)
+        payload = decode_payload(payload_json)
         results.append({
             "message_id": msg_id,
             "camera_id": key,